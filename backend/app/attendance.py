@@ -3,19 +3,45 @@ Attendance tracking and management module.
 Handles student engagement tracking, attendance calculation, and status updates.
 """
 
-from datetime import datetime, timedelta
-from typing import Optional, List, Dict
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List, Dict, Set, Tuple, Any
+from pymongo import ReturnDocument
 from app.models import (
     Attendance, AttendanceStatus, AttendanceStart, 
-    FrameData, AttendanceReport
+    FrameData, AttendanceReport, AttendanceMetadata
 )
 from app.config import settings
-from app.face_detection import FaceDetector
+from app.face_analysis import FaceAnalysisExecutor, FaceAnalysisUnavailable
 from app.database import get_db
+from app.engagement_bitmap import class_engagement, engaged_at
+from app.frame_queue import FrameQueue, get_frame_queue
+from app.pacing import TickPacer, get_tick_pacer
+from app.session_registry import SessionRegistry
+from app.session_state import (
+    ADVERTISED_INCREMENT_FIELD, CACHED_PROJECTION, IN_PROGRESS, SessionStateStore,
+    finalize_update_pipeline, get_session_state_store, tick_update_pipeline
+)
+from app.timeline import TICKS_COLLECTION, TickRecorder, get_tick_recorder, timeline_pipeline
 import logging
 
 logger = logging.getLogger(__name__)
 
+def _as_utc_naive(value: datetime) -> datetime:
+    """Normalise a client timestamp to the naive UTC datetimes stored in MongoDB."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _metadata_fields(metadata: AttendanceMetadata) -> Dict[str, Any]:
+    """Detection fields stored for a client-side metadata tick."""
+    return {
+        "is_face_detected": metadata.face_detected,
+        "is_looking_at_screen": metadata.attention_score > 50,  # Estimate from attention score
+        "attention_score": metadata.attention_score,
+        "multiple_faces_detected": metadata.multiple_faces
+    }
+
 
 class AttendanceManager:
     """
@@ -25,7 +51,15 @@ class AttendanceManager:
     
     def __init__(self):
         """Initialize attendance manager."""
-        self.active_sessions: Dict[str, datetime] = {}  # session_id -> last_engaged_time
+        # Last activity per (session_id, student_id), bounded by size and idle TTL
+        self.active_sessions = SessionRegistry(
+            max_entries=settings.session_registry_max_entries,
+            ttl_seconds=settings.session_idle_timeout_seconds
+        )
+        self.session_state: SessionStateStore = get_session_state_store()
+        self.frame_queue: FrameQueue = get_frame_queue()
+        self.pacer: TickPacer = get_tick_pacer()
+        self.tick_recorder: TickRecorder = get_tick_recorder()
         logger.info("✓ Attendance manager initialized")
     
     async def start_attendance_session(
@@ -77,7 +111,7 @@ class AttendanceManager:
         attendance.id = str(result.inserted_id)
         
         # Track in active sessions
-        self.active_sessions[f"{session_id}_{student_id}"] = datetime.utcnow()
+        self.active_sessions.touch(session_id, student_id)
         
         logger.info(f"✓ Started attendance session for student {student_id} in class {class_id}")
         return attendance
@@ -85,12 +119,16 @@ class AttendanceManager:
     async def process_frame(
         self,
         frame_data: FrameData,
-        face_detector: FaceDetector,
+        face_analyzer: FaceAnalysisExecutor,
         db
     ) -> Dict:
         """
         Process a webcam frame and update engagement tracking.
         
+        Frames go through the per-student frame queue: if a newer frame from
+        the same student arrives while this one is still waiting, this one is
+        answered with the last known result instead of being analyzed.
+        
         This is the core attendance logic:
         1. Detect face in frame
         2. Check if looking at screen
@@ -99,89 +137,506 @@ class AttendanceManager:
         
         Args:
             frame_data: Frame data containing image and metadata
-            face_detector: Face detector instance
+            face_analyzer: Face analysis executor
             db: Database instance
             
         Returns:
             Dictionary with detection results and updated attendance info
-        """
-        try:
-            # Find attendance record
-            attendance_doc = await db.attendance.find_one({
-                "session_id": frame_data.session_id,
-                "student_id": frame_data.student_id
-            })
-            
-            if not attendance_doc:
-                logger.warning(f"No attendance record found for session {frame_data.session_id}")
-                return {
-                    "success": False,
-                    "message": "Attendance session not found"
-                }
             
+        Raises:
+            FaceAnalysisUnavailable: If the analysis queue is full or timed out
+        """
+        key = (frame_data.session_id, frame_data.student_id)
+        
+        async def analyze() -> Dict:
             # Analyze frame for face detection
-            face_detected, looking_at_screen = face_detector.analyze_frame(frame_data.frame_base64)
+            face_detected, looking_at_screen = await face_analyzer.analyze_base64(
+                frame_data.frame_base64,
+                tracker_key=key
+            )
             
-            # Calculate engagement time increment
-            current_time = datetime.utcnow()
-            session_key = f"{frame_data.session_id}_{frame_data.student_id}"
+            return await self.record_frame_analysis(
+                session_id=frame_data.session_id,
+                student_id=frame_data.student_id,
+                face_detected=face_detected,
+                looking_at_screen=looking_at_screen,
+                db=db
+            )
+        
+        try:
+            return await self.frame_queue.submit(key, analyze)
             
-            # Calculate time since last frame
-            last_engaged_time = self.active_sessions.get(session_key)
-            time_increment = 0
+        except FaceAnalysisUnavailable:
+            raise
+        except Exception as e:
+            logger.error(f"Error processing frame: {e}")
+            return {
+                "success": False,
+                "message": str(e)
+            }
+    
+    async def process_frame_bytes(
+        self,
+        session_id: str,
+        student_id: str,
+        frame_bytes: bytes,
+        face_analyzer: FaceAnalysisExecutor,
+        db
+    ) -> Dict:
+        """
+        Process a webcam frame uploaded as raw encoded image bytes.
+        
+        Args:
+            session_id: Session identifier
+            student_id: Student's user ID
+            frame_bytes: Encoded image bytes (JPEG/PNG)
+            face_analyzer: Face analysis executor
+            db: Database instance
             
-            if last_engaged_time:
-                # Calculate seconds since last update
-                time_diff = (current_time - last_engaged_time).total_seconds()
-                
-                # Only count if face is detected AND looking at screen
-                # Cap at frame interval + buffer to prevent manipulation
-                if face_detected and looking_at_screen:
-                    time_increment = min(time_diff, settings.frame_interval_seconds + 2)
+        Returns:
+            Dictionary with detection results and updated attendance info
             
-            # Update last engaged time
-            self.active_sessions[session_key] = current_time
+        Raises:
+            FaceAnalysisUnavailable: If the analysis queue is full or timed out
+        """
+        key = (session_id, student_id)
+        
+        async def analyze() -> Dict:
+            face_detected, looking_at_screen = await face_analyzer.analyze_bytes(
+                frame_bytes,
+                tracker_key=key
+            )
             
-            # Update attendance record
-            new_engagement_seconds = attendance_doc["engagement_duration_seconds"] + time_increment
-            total_duration = attendance_doc["total_class_duration_seconds"]
+            return await self.record_frame_analysis(
+                session_id=session_id,
+                student_id=student_id,
+                face_detected=face_detected,
+                looking_at_screen=looking_at_screen,
+                db=db
+            )
+        
+        try:
+            return await self.frame_queue.submit(key, analyze)
             
-            # Calculate engagement percentage
-            engagement_percentage = (new_engagement_seconds / total_duration * 100) if total_duration > 0 else 0
+        except FaceAnalysisUnavailable:
+            raise
+        except Exception as e:
+            logger.error(f"Error processing frame: {e}")
+            return {
+                "success": False,
+                "message": str(e)
+            }
+    
+    async def record_frame_analysis(
+        self,
+        session_id: str,
+        student_id: str,
+        face_detected: bool,
+        looking_at_screen: bool,
+        db
+    ) -> Dict:
+        """
+        Credit engagement for an analyzed frame.
+        
+        Args:
+            session_id: Session identifier
+            student_id: Student's user ID
+            face_detected: Whether a face was detected
+            looking_at_screen: Whether the student was looking at the screen
+            db: Database instance
             
-            # Update database
-            update_data = {
-                "last_frame_timestamp": current_time,
+        Returns:
+            Dictionary with detection results and updated attendance info
+        """
+        # Only count time if face is detected AND looking at screen
+        # Cap at the advertised interval + buffer to prevent manipulation
+        current_time = datetime.utcnow()
+        attendance_doc = await self._apply_tick(
+            session_id=session_id,
+            student_id=student_id,
+            current_time=current_time,
+            engaged=face_detected and looking_at_screen,
+            max_increment=self.pacer.max_increment(session_id, student_id),
+            fields={
                 "is_face_detected": face_detected,
-                "is_looking_at_screen": looking_at_screen,
-                "engagement_duration_seconds": new_engagement_seconds,
-                "engagement_percentage": round(engagement_percentage, 2)
+                "is_looking_at_screen": looking_at_screen
+            },
+            db=db
+        )
+        
+        if not attendance_doc:
+            logger.warning(f"No attendance record found for session {session_id}")
+            return {
+                "success": False,
+                "message": "Attendance session not found"
             }
+        
+        # Track last activity for this session
+        self.active_sessions.touch(session_id, student_id, current_time)
+        
+        engagement_percentage = attendance_doc["engagement_percentage"]
+        
+        logger.debug(f"Frame processed for student {student_id}: "
+                    f"face={face_detected}, looking={looking_at_screen}, "
+                    f"engagement={engagement_percentage:.1f}%")
+        
+        return {
+            "success": True,
+            "face_detected": face_detected,
+            "looking_at_screen": looking_at_screen,
+            "engagement_percentage": engagement_percentage,
+            "engagement_seconds": attendance_doc["engagement_duration_seconds"],
+            "class_id": attendance_doc["class_id"]
+        }
+    
+    def compute_tick_update(
+        self,
+        attendance_doc: Dict,
+        current_time: datetime,
+        engaged: bool,
+        max_increment: float,
+        fields: Dict[str, Any]
+    ) -> Tuple[Dict, float]:
+        """
+        Compute the attendance fields for a single tick in memory.
+        
+        Mirrors tick_update_pipeline: engagement time since the last tick is
+        only credited while engaged, and each tick is capped to prevent
+        manipulation (at the larger of max_increment and the cap advertised
+        to the session by any worker).
+        
+        Args:
+            attendance_doc: Current attendance record
+            current_time: Time the tick is accounted at
+            engaged: Whether the student was engaged for this tick
+            max_increment: Maximum seconds credited for one tick
+            fields: Detection fields to store
             
-            await db.attendance.update_one(
-                {"_id": attendance_doc["_id"]},
-                {"$set": update_data}
+        Returns:
+            Tuple of (fields to $set on the record, time increment applied)
+        """
+        last_frame_time = attendance_doc.get("last_frame_timestamp")
+        time_increment = 0
+        
+        if last_frame_time and current_time <= last_frame_time:
+            # Not newer than the last tick; the pipeline ignores it too
+            return {}, 0
+        
+        if last_frame_time and engaged:
+            time_diff = (current_time - last_frame_time).total_seconds()
+            cap = max(max_increment, attendance_doc.get(ADVERTISED_INCREMENT_FIELD) or 0)
+            time_increment = max(0, min(time_diff, cap))
+        
+        new_engagement_seconds = attendance_doc["engagement_duration_seconds"] + time_increment
+        total_duration = attendance_doc["total_class_duration_seconds"]
+        engagement_percentage = (new_engagement_seconds / total_duration * 100) if total_duration > 0 else 0
+        
+        update_data = {
+            "last_frame_timestamp": current_time,
+            "engagement_duration_seconds": new_engagement_seconds,
+            "engagement_percentage": round(min(engagement_percentage, 100), 2),
+            **fields
+        }
+        
+        return update_data, time_increment
+    
+    async def _apply_tick(
+        self,
+        session_id: str,
+        student_id: str,
+        current_time: datetime,
+        engaged: bool,
+        max_increment: float,
+        fields: Dict[str, Any],
+        db
+    ) -> Optional[Dict]:
+        """
+        Credit one tick to an attendance record.
+        
+        With write-behind enabled the tick is applied to cached session state.
+        Otherwise it is applied with a single atomic update pipeline, so
+        concurrent ticks cannot lose increments. Either way the tick is
+        queued for the engagement time series. Finalized records are left
+        untouched in both modes.
+        
+        Returns:
+            Updated attendance record, or None if no session is in progress
+        """
+        if self.session_state.write_through:
+            attendance_doc = await db.attendance.find_one_and_update(
+                {"session_id": session_id, "student_id": student_id, "status": IN_PROGRESS},
+                tick_update_pipeline(current_time, engaged, max_increment, fields),
+                projection=CACHED_PROJECTION,
+                return_document=ReturnDocument.AFTER
             )
+            if not attendance_doc:
+                return None
+        else:
+            state = await self.session_state.get(session_id, student_id, db)
+            if not state:
+                return None
             
-            logger.debug(f"Frame processed for student {frame_data.student_id}: "
-                        f"face={face_detected}, looking={looking_at_screen}, "
-                        f"engagement={engagement_percentage:.1f}%")
+            update_data, _ = self.compute_tick_update(
+                state.doc, current_time, engaged, max_increment, fields
+            )
+            self.session_state.apply(state, update_data, (current_time, engaged, max_increment, fields))
+            attendance_doc = state.doc
+        
+        if attendance_doc:
+            self.tick_recorder.record(
+                session_id, student_id, attendance_doc["class_id"], current_time, engaged, fields
+            )
+        return attendance_doc
+    
+    async def process_metadata(
+        self,
+        metadata: AttendanceMetadata,
+        db
+    ) -> Optional[Dict]:
+        """
+        Apply a single metadata tick, accounted at server time.
+        
+        Engagement time is only credited while a face is detected.
+        
+        Args:
+            metadata: Face detection metadata from client
+            db: Database instance
             
-            return {
+        Returns:
+            Updated attendance record, or None if the session was not found
+        """
+        return await self._apply_tick(
+            session_id=metadata.session_id,
+            student_id=metadata.student_id,
+            current_time=datetime.utcnow(),
+            engaged=metadata.face_detected,
+            max_increment=self.pacer.max_increment(metadata.session_id, metadata.student_id),
+            fields=_metadata_fields(metadata),
+            db=db
+        )
+    
+    async def process_metadata_batch(
+        self,
+        ticks: List[AttendanceMetadata],
+        db,
+        student_id: Optional[str] = None,
+        class_ids: Optional[Set[str]] = None
+    ) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Apply an ordered batch of metadata ticks in a single pass.
+        
+        All referenced attendance records are loaded with at most one query
+        and ticks are answered in order from memory. The ticks are then
+        replayed on the server (write-through) or on the next flush
+        (write-behind), with one bulk_write for all touched records.
+        
+        A student submits their own ticks. A teacher (or a gateway acting for
+        one) may submit ticks for any student whose attendance record belongs
+        to one of their classes; the record's class_id is checked, not the
+        one claimed by the tick.
+        
+        Args:
+            ticks: Ordered metadata ticks
+            db: Database instance
+            student_id: Authenticated student; their ticks are accepted
+            class_ids: Classes taught by the caller; ticks for their students are accepted
+            
+        Returns:
+            Tuple of (per-tick results in input order, updated attendance records)
+        """
+        current_time = datetime.utcnow()
+        results: List[Dict] = []
+        
+        states = await self.session_state.load_many(
+            [(tick.session_id, tick.student_id) for tick in ticks
+             if class_ids or tick.student_id == student_id],
+            db
+        )
+        touched: Dict[Tuple[str, str], Dict] = {}
+        
+        for index, tick in enumerate(ticks):
+            state = states.get((tick.session_id, tick.student_id))
+            allowed = tick.student_id == student_id or (
+                state is not None and bool(class_ids) and state.doc["class_id"] in class_ids
+            )
+            if not allowed:
+                results.append({
+                    "index": index,
+                    "success": False,
+                    "message": "Cannot submit metadata for this student"
+                })
+                continue
+            
+            if not state:
+                results.append({
+                    "index": index,
+                    "success": False,
+                    "message": "Attendance session not found"
+                })
+                continue
+            
+            # Use the client's capture time, bounded by server time and kept
+            # monotonic so buffered ticks can never credit more than wall-clock time
+            tick_time = min(_as_utc_naive(tick.timestamp), current_time)
+            last_frame_time = state.doc.get("last_frame_timestamp")
+            if last_frame_time and tick_time < last_frame_time:
+                tick_time = last_frame_time
+            
+            max_increment = self.pacer.max_increment(tick.session_id, tick.student_id)
+            fields = _metadata_fields(tick)
+            update_data, time_increment = self.compute_tick_update(
+                state.doc, tick_time, tick.face_detected, max_increment, fields
+            )
+            self.session_state.apply(state, update_data, (tick_time, tick.face_detected, max_increment, fields))
+            self.tick_recorder.record(
+                tick.session_id, tick.student_id, state.doc["class_id"],
+                tick_time, tick.face_detected, fields
+            )
+            touched[state.key] = state.doc
+            
+            results.append({
+                "index": index,
                 "success": True,
-                "face_detected": face_detected,
-                "looking_at_screen": looking_at_screen,
-                "engagement_percentage": round(engagement_percentage, 2),
-                "engagement_seconds": new_engagement_seconds,
+                "engagement_percentage": state.doc["engagement_percentage"],
+                "engagement_seconds": state.doc["engagement_duration_seconds"],
                 "time_increment": time_increment
-            }
+            })
+        
+        if touched and self.session_state.write_through:
+            # Replay the ticks on the server in one bulk_write (atomic per
+            # record, so concurrent single ticks are not overwritten), then
+            # drop the cached records so the next request reloads them
+            await self.session_state.flush(db, touched.keys())
+            for session_id, sid in touched:
+                self.session_state.discard(session_id, sid)
+        
+        submitter = student_id or f"classes {sorted(class_ids or ())}"
+        logger.debug(f"Metadata batch processed for {submitter}: "
+                    f"{len(ticks)} ticks, {len(touched)} records updated")
+        
+        return results, list(touched.values())
+    
+    async def get_engagement_timeline(
+        self,
+        class_id: str,
+        session_id: str,
+        resolution_seconds: int,
+        db,
+        student_id: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Downsample a session's engagement ticks into per-student series.
+        
+        Buckets are computed by MongoDB ($dateTrunc) on the attendance_ticks
+        time-series collection. Ticks still buffered for insertion (a few
+        seconds' worth) are not included yet.
+        
+        Args:
+            class_id: Class identifier
+            session_id: Session identifier
+            resolution_seconds: Bucket size in seconds
+            db: Database instance
+            student_id: Restrict to one student (optional)
             
-        except Exception as e:
-            logger.error(f"Error processing frame: {e}")
-            return {
-                "success": False,
-                "message": str(e)
+        Returns:
+            List of {"student_id", "points"} with points in time order
+        """
+        cursor = db[TICKS_COLLECTION].aggregate(
+            timeline_pipeline(class_id, session_id, resolution_seconds, student_id)
+        )
+        return await cursor.to_list(length=None)
+    
+    async def get_class_engagement(
+        self,
+        class_id: str,
+        session_id: str,
+        resolution_seconds: int,
+        db,
+        at: Optional[datetime] = None
+    ) -> Dict:
+        """
+        Class-wide engagement for a session from the per-second bitmaps.
+        
+        Args:
+            class_id: Class identifier
+            session_id: Session identifier
+            resolution_seconds: Bucket size of the coverage curve
+            db: Database instance
+            at: Also report who was engaged at this time (optional)
+            
+        Returns:
+            Coverage curve, OR/AND engaged seconds and per-student engaged seconds
+        """
+        # Ticks of this class's active sessions may still be buffered in memory
+        await self.session_state.flush(db, self.session_state.keys_for_class(class_id))
+        
+        cursor = db.attendance.find(
+            {"class_id": class_id, "session_id": session_id},
+            {"student_id": 1, "student_name": 1, "started_at": 1,
+             "total_class_duration_seconds": 1, "engagement_bitmap": 1}
+        )
+        records = await cursor.to_list(length=None)
+        
+        bitmaps = [record.get("engagement_bitmap") for record in records]
+        started_at = [record["started_at"] for record in records]
+        durations = [record["total_class_duration_seconds"] for record in records]
+        
+        summary = class_engagement(bitmaps, started_at, durations, resolution_seconds)
+        student_seconds = summary.pop("student_seconds")
+        summary["students"] = [
+            {
+                "student_id": record["student_id"],
+                "student_name": record["student_name"],
+                "engaged_seconds": seconds
             }
+            for record, seconds in zip(records, student_seconds)
+        ]
+        
+        if at is not None:
+            flags = engaged_at(bitmaps, started_at, durations, _as_utc_naive(at))
+            summary["engaged_at"] = {
+                "time": _as_utc_naive(at),
+                "count": sum(flags),
+                "student_ids": [record["student_id"] for record, flag in zip(records, flags) if flag]
+            }
+        
+        return summary
+    
+    async def next_interval_ms(self, class_id: str, session_id: Optional[str], student_id: str, db) -> int:
+        """
+        Tick interval the server asks a student to use next.
+        
+        Adapts to server load and class size (see TickPacer). The interval is
+        remembered per session so the next tick's engagement cap matches it.
+        When the cap changes it is also stored on the attendance record, so
+        a tick served by another worker is credited the same.
+        
+        Args:
+            class_id: Class identifier
+            session_id: Attendance session (None if not yet known)
+            student_id: Student's user ID
+            db: Database instance
+            
+        Returns:
+            Interval in milliseconds
+        """
+        interval = self.pacer.advertise(class_id, session_id, student_id)
+        if session_id is None:
+            return interval
+        
+        max_increment = self.pacer.claim_store(session_id, student_id)
+        if max_increment is not None:
+            state = self.session_state.peek(session_id, student_id)
+            if state is not None:
+                state.doc[ADVERTISED_INCREMENT_FIELD] = max_increment
+            try:
+                await db.attendance.update_one(
+                    {"session_id": session_id, "student_id": student_id, "status": IN_PROGRESS},
+                    {"$set": {ADVERTISED_INCREMENT_FIELD: max_increment}}
+                )
+            except Exception as e:
+                logger.warning(f"⚠ Could not store advertised tick interval: {e}")
+        return interval
     
     async def end_attendance_session(
         self,
@@ -204,6 +659,9 @@ class AttendanceManager:
         Returns:
             Updated Attendance object, or None if not found
         """
+        # Write any buffered engagement before reading the final totals
+        await self.session_state.flush(db, [(session_id, student_id)])
+        
         attendance_doc = await db.attendance.find_one({
             "session_id": session_id,
             "student_id": student_id
@@ -232,10 +690,7 @@ class AttendanceManager:
             }
         )
         
-        # Remove from active sessions
-        session_key = f"{session_id}_{student_id}"
-        if session_key in self.active_sessions:
-            del self.active_sessions[session_key]
+        self._forget_session(session_id, student_id)
         
         logger.info(f"✓ Ended attendance session for student {student_id}: "
                    f"engagement={engagement_percentage:.1f}%, status={final_status}")
@@ -245,6 +700,126 @@ class AttendanceManager:
         updated_doc["id"] = updated_doc["_id"]
         return Attendance(**updated_doc)
     
+    async def finalize_class_sessions(self, class_id: str, db) -> List[Dict]:
+        """
+        End every open attendance session of a class at once.
+        
+        Args:
+            class_id: Class identifier
+            db: Database instance
+            
+        Returns:
+            Final status of each closed record
+        """
+        finalized = await self.finalize_sessions(
+            {"class_id": class_id},
+            self.session_state.keys_for_class(class_id),
+            db
+        )
+        logger.info(f"✓ Finalized {len(finalized)} attendance session(s) for class {class_id}")
+        return finalized
+    
+    async def finalize_sessions(self, query: Dict, keys: List[Tuple[str, str]], db) -> List[Dict]:
+        """
+        End the open attendance sessions matching a query in bulk.
+        
+        Buffered engagement for keys is flushed first. The matching open
+        records are then selected by _id, and one update_many pipeline
+        restricted to those _ids (and still in progress) sets ended_at and
+        derives PRESENT/ABSENT from each record's engagement_percentage
+        against the attendance threshold. Records closed concurrently by
+        someone else are left out. In-memory state of the closed sessions is
+        dropped.
+        
+        Args:
+            query: Filter selecting the records to close (in-progress only)
+            keys: (session_id, student_id) of cached sessions the query may match
+            db: Database instance
+            
+        Returns:
+            Final status of each closed record, including its class_id
+        """
+        await self.session_state.flush(db, keys)
+        
+        in_progress = AttendanceStatus.IN_PROGRESS.value
+        cursor = db.attendance.find({**query, "status": in_progress}, {"_id": 1})
+        ids = [doc["_id"] for doc in await cursor.to_list(length=None)]
+        if not ids:
+            return []
+        
+        # MongoDB stores milliseconds; truncate so the read-back matches exactly
+        ended_at = datetime.utcnow()
+        ended_at = ended_at.replace(microsecond=ended_at.microsecond // 1000 * 1000)
+        
+        result = await db.attendance.update_many(
+            {"_id": {"$in": ids}, "status": in_progress},
+            finalize_update_pipeline(
+                ended_at,
+                settings.attendance_threshold,
+                AttendanceStatus.PRESENT.value,
+                AttendanceStatus.ABSENT.value
+            )
+        )
+        if not result.modified_count:
+            return []
+        
+        # A concurrent finalize of the same _ids closes the rest at its own ended_at
+        cursor = db.attendance.find(
+            {"_id": {"$in": ids}, "ended_at": ended_at},
+            {"session_id": 1, "student_id": 1, "student_name": 1, "class_id": 1,
+             "status": 1, "engagement_percentage": 1}
+        )
+        finalized = []
+        for doc in await cursor.to_list(length=None):
+            self._forget_session(doc["session_id"], doc["student_id"])
+            finalized.append({
+                "class_id": doc["class_id"],
+                "student_id": doc["student_id"],
+                "student_name": doc["student_name"],
+                "status": doc["status"],
+                "engagement_percentage": doc["engagement_percentage"]
+            })
+        return finalized
+    
+    def last_activity(self, session_id: str, student_id: str) -> Optional[datetime]:
+        """Latest tick time known in memory for a session (may be ahead of MongoDB)."""
+        state = self.session_state.peek(session_id, student_id)
+        times = [
+            state.doc.get("last_frame_timestamp") if state is not None else None,
+            self.active_sessions.last_seen(session_id, student_id)
+        ]
+        times = [value for value in times if value is not None]
+        return max(times) if times else None
+    
+    def evict_idle_sessions(self, idle_seconds: float) -> int:
+        """
+        Drop this worker's in-memory state of sessions idle for idle_seconds.
+
+        Covers sessions finalized on another worker or abandoned without a
+        final tick, which nothing else removes from this worker's memory.
+
+        Args:
+            idle_seconds: Seconds without a tick or frame before state is dropped
+
+        Returns:
+            Number of entries dropped
+        """
+        evicted = self.active_sessions.expire()
+        for session_id, student_id in self.session_state.idle_keys(idle_seconds):
+            self.session_state.discard(session_id, student_id)
+            evicted += 1
+        for key in self.frame_queue.idle_keys(idle_seconds):
+            self.frame_queue.discard(key)
+            evicted += 1
+        return evicted
+    
+    def _forget_session(self, session_id: str, student_id: str):
+        """Drop all in-memory state of an ended session."""
+        self.active_sessions.discard(session_id, student_id)
+        self.session_state.discard(session_id, student_id)
+        self.frame_queue.discard((session_id, student_id))
+        self.pacer.forget(session_id, student_id)
+    
     async def get_class_attendance_report(
         self,
         class_id: str,
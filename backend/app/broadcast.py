@@ -0,0 +1,288 @@
+"""
+Pub/sub backends for WebSocket broadcasts.
+ConnectionManager publishes every broadcast as an envelope
+({class_id, role, key, text}); the backend delivers it to the manager of
+each worker, which fans it out to its own connections.
+"""
+
+import asyncio
+import os
+import socket
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Awaitable, Callable, Deque, Dict, Optional
+from pymongo.errors import CollectionInvalid, OperationFailure
+from app.config import settings
+from app.database import get_database
+import logging
+
+logger = logging.getLogger(__name__)
+
+Deliver = Callable[[Dict], Awaitable[None]]
+
+# Change stream errors after which the resume token is useless
+# (InvalidResumeToken, ChangeStreamFatalError, ChangeStreamHistoryLost)
+NON_RESUMABLE_CODES = {260, 280, 286}
+
+
+def is_non_resumable(error: Exception) -> bool:
+    """Whether a change stream error means it cannot resume from its token."""
+    if not isinstance(error, OperationFailure):
+        return False
+    return error.code in NON_RESUMABLE_CODES or error.has_error_label("NonResumableChangeStreamError")
+
+
+class BroadcastBackend:
+    """
+    Delivers published envelopes to subscribers.
+
+    The base class is the in-process backend: publish hands the envelope
+    straight to this worker's subscriber. Shared backends also deliver it
+    to the other workers.
+    """
+
+    # Whether only this worker's connections can receive broadcasts
+    local_only = True
+
+    def __init__(self):
+        """Initialize without a subscriber (set with start())."""
+        self._deliver: Optional[Deliver] = None
+        self.published = 0
+        self.delivered = 0
+
+    def start(self, deliver: Deliver):
+        """
+        Subscribe this worker to broadcasts.
+
+        Args:
+            deliver: Coroutine function fanning an envelope out to local connections
+        """
+        self._deliver = deliver
+
+    async def stop(self):
+        """Unsubscribe this worker."""
+        self._deliver = None
+
+    async def publish(self, envelope: Dict):
+        """
+        Publish an envelope to every subscribed worker.
+
+        Args:
+            envelope: Broadcast with class_id, role, key and encoded text
+        """
+        self.published += 1
+        await self._deliver_local(envelope)
+
+    async def _deliver_local(self, envelope: Dict):
+        if self._deliver is not None:
+            self.delivered += 1
+            await self._deliver(envelope)
+
+    def get_stats(self) -> Dict:
+        """Publish and delivery counters, for monitoring."""
+        return {
+            "backend": type(self).__name__,
+            "published": self.published,
+            "delivered": self.delivered
+        }
+
+
+class MongoBroadcastBackend(BroadcastBackend):
+    """
+    Shares broadcasts between workers through a MongoDB change stream.
+
+    publish delivers to this worker at once and queues the envelope; a
+    background task inserts queued envelopes into a capped collection with
+    insert_many, so no database write happens on the request path (at most
+    max_outbox envelopes wait, the oldest are dropped beyond that). Every
+    worker watches the collection's inserts and delivers envelopes
+    published by the others. Change streams need a
+    replica set or sharded cluster (Atlas included). The stream resumes
+    after errors from the last seen change; when that change is no longer
+    available (history rolled off the oplog, collection dropped) it starts
+    again from the present, and broadcasts missed meanwhile are lost.
+    """
+
+    local_only = False
+
+    def __init__(
+        self,
+        collection_name: str,
+        capped_size_bytes: int,
+        get_db: Callable = get_database,
+        max_outbox: int = 10_000
+    ):
+        """Initialize the backend (watching and publishing start with start())."""
+        super().__init__()
+        self.collection_name = collection_name
+        self.capped_size_bytes = capped_size_bytes
+        self._get_db = get_db
+        self.origin = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._watch_task: Optional[asyncio.Task] = None
+        self._publish_task: Optional[asyncio.Task] = None
+        self._resume_token = None
+        self._outbox: Deque[Dict] = deque()
+        self._outbox_ready = asyncio.Event()
+        self.max_outbox = max_outbox
+        self.received = 0
+        self.publish_errors = 0
+        self.publish_dropped = 0
+        self.watch_errors = 0
+        self.watch_resets = 0
+
+    @property
+    def collection(self):
+        return self._get_db()[self.collection_name]
+
+    async def _ensure_collection(self):
+        """Create the capped broadcast collection if it does not exist."""
+        try:
+            await self._get_db().create_collection(
+                self.collection_name, capped=True, size=self.capped_size_bytes
+            )
+            logger.info(f"✓ Created capped collection {self.collection_name}")
+        except CollectionInvalid:
+            pass  # Already exists
+
+    def start(self, deliver: Deliver):
+        """Subscribe this worker, start publishing and watch for other workers' broadcasts."""
+        super().start(deliver)
+        if self._publish_task is None:
+            self._publish_task = asyncio.create_task(self._publish_loop())
+        if self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch_loop())
+            logger.info(f"✓ Watching {self.collection_name} for broadcasts (origin={self.origin})")
+
+    async def stop(self):
+        """Stop watching, publish queued envelopes and unsubscribe this worker."""
+        for task in (self._watch_task, self._publish_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._watch_task = self._publish_task = None
+        await self._publish_queued()
+        await super().stop()
+
+    async def publish(self, envelope: Dict):
+        """Deliver to this worker, then queue the envelope for the others."""
+        self.published += 1
+        await self._deliver_local(envelope)
+        if len(self._outbox) >= self.max_outbox:
+            self._outbox.popleft()
+            self.publish_dropped += 1
+        self._outbox.append({
+            **envelope,
+            "origin": self.origin,
+            "created_at": datetime.utcnow()
+        })
+        self._outbox_ready.set()
+
+    async def _publish_queued(self):
+        """Insert every queued envelope with one insert_many."""
+        if not self._outbox:
+            return
+        documents = list(self._outbox)
+        self._outbox.clear()
+        try:
+            await self.collection.insert_many(documents, ordered=False)
+        except asyncio.CancelledError:
+            # Stopping; stop() publishes them again
+            self._outbox.extendleft(reversed(documents))
+            raise
+        except Exception as e:
+            self.publish_errors += 1
+            logger.error(f"Error publishing {len(documents)} broadcast(s): {e}")
+
+    async def _publish_loop(self):
+        """Publish queued envelopes as they arrive until cancelled."""
+        while True:
+            await self._outbox_ready.wait()
+            self._outbox_ready.clear()
+            await self._publish_queued()
+
+    async def receive(self, document: Dict):
+        """
+        Deliver an envelope read from the shared collection.
+
+        Envelopes this worker published were already delivered locally.
+
+        Args:
+            document: Inserted broadcast document
+        """
+        if document.get("origin") == self.origin:
+            return
+        self.received += 1
+        envelope = {field: document.get(field) for field in ("class_id", "role", "key", "text")}
+        await self._deliver_local(envelope)
+
+    async def _watch_loop(self):
+        """Follow the collection's change stream until cancelled, resuming after errors."""
+        while True:
+            try:
+                await self._ensure_collection()
+                async with self.collection.watch(
+                    [{"$match": {"operationType": "insert"}}],
+                    resume_after=self._resume_token
+                ) as stream:
+                    async for change in stream:
+                        if change["operationType"] != "insert":
+                            break  # Invalidated (collection dropped or renamed)
+                        self._resume_token = change["_id"]
+                        try:
+                            await self.receive(change["fullDocument"])
+                        except Exception as e:
+                            logger.error(f"Error delivering broadcast: {e}")
+                # The stream only ends when invalidated; its token cannot resume it
+                self._resume_token = None
+                self.watch_resets += 1
+                logger.warning(f"⚠ Broadcast change stream invalidated, watching {self.collection_name} again")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.watch_errors += 1
+                if is_non_resumable(e):
+                    self._resume_token = None
+                    self.watch_resets += 1
+                    logger.error(f"Broadcast change stream cannot resume, watching from now: {e}")
+                else:
+                    logger.error(f"Broadcast change stream failed, retrying: {e}")
+                await asyncio.sleep(1.0)
+
+    def get_stats(self) -> Dict:
+        """Publish, delivery and error counters, for monitoring."""
+        return {
+            **super().get_stats(),
+            "received": self.received,
+            "publish_errors": self.publish_errors,
+            "publish_dropped": self.publish_dropped,
+            "outbox": len(self._outbox),
+            "watch_errors": self.watch_errors,
+            "watch_resets": self.watch_resets
+        }
+
+
+def create_broadcast_backend(name: str) -> BroadcastBackend:
+    """
+    Create the broadcast backend selected in settings.
+
+    Args:
+        name: "local" (single worker) or "mongo" (shared between workers)
+
+    Returns:
+        BroadcastBackend instance
+
+    Raises:
+        ValueError: If the backend name is unknown
+    """
+    if name == "local":
+        return BroadcastBackend()
+    if name == "mongo":
+        return MongoBroadcastBackend(
+            collection_name=settings.websocket_broadcast_collection,
+            capped_size_bytes=settings.websocket_broadcast_capped_mb * 1024 * 1024
+        )
+    raise ValueError(f"Unknown WebSocket broadcast backend: {name}")
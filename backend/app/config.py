@@ -26,10 +26,78 @@ class Settings(BaseSettings):
     port: int = 10000
     environment: str = "development"  # "development" or "production"
     frontend_url: str = "http://localhost:5173"
+    metrics_token: str = ""  # Bearer token required by GET /metrics (empty = endpoint disabled)
 
     # Engagement Thresholds
     attendance_threshold: float = 75.0
-    frame_interval_seconds: int = 3
+    frame_interval_seconds: int = 3  # Base tick interval advertised to clients
+    tick_interval_max_ms: int = 15000  # Longest interval advertised under load
+    tick_lag_budget_ms: float = 100.0  # Event loop lag at which intervals start stretching
+    tick_class_size_reference: int = 100  # Students per class served at the base interval
+    max_frame_upload_bytes: int = 2_000_000  # Raw frame uploads larger than this are rejected
+
+    # Server-side face analysis (legacy frame endpoints)
+    face_analysis_workers: int = 2  # Worker processes, each with its own FaceMesh (0 = one thread)
+    face_analysis_max_pending: int = 64  # Frames queued or running before new ones are rejected
+    face_analysis_timeout_seconds: float = 5.0
+    frame_queue_max_in_flight: int = 32  # Frames analyzed at once; newer frames per student replace waiting ones
+    face_analysis_batch_size: int = 8  # Frames per worker batch (1 = no micro-batching)
+    face_analysis_batch_window_ms: float = 0.0  # Max wait for a batch to fill at an idle worker (0 = send at once)
+    face_analysis_decode_threads: int = 4  # Threads decoding a batch in each worker
+    face_tracker_max_per_worker: int = 32  # Per-student FaceMesh trackers per worker; further students share one FaceMesh
+    face_tracker_idle_seconds: float = 60.0  # Trackers unused for this long are closed
+    face_mesh_refine_landmarks: bool = False  # Iris refinement; not needed for head pose
+    face_analysis_decode_scale: int = 2  # Decode JPEGs at 1/N resolution (1, 2, 4 or 8)
+    face_analysis_max_width: int = 320  # Downscale wider frames before inference (0 = never)
+    face_roi_margin: float = 0.5  # Crop to the last face box plus this fraction per side (0 = off)
+    motion_skip_threshold: float = 3.0  # Mean gray-level thumbnail change below which a frame is skipped (0 = off)
+    motion_refresh_frames: int = 5  # Analyze at least every N+1 frames even when nothing changed
+    head_yaw_max_degrees: float = 30.0  # Max left/right head turn still counted as looking at screen
+    head_pitch_max_degrees: float = 25.0  # Max up/down head tilt still counted as looking at screen
+
+    # Attendance session state: seconds between write-behind flushes to MongoDB
+    # (0 writes every tick through immediately)
+    session_flush_interval_seconds: float = 2.0
+    # Ticks buffered per session while flushes fail (oldest dropped beyond this)
+    session_max_buffered_ticks: int = 300
+
+    # Abandoned session sweeper: seconds between sweeps (0 disables it),
+    # seconds without a tick before an open session is finalized, and the
+    # maximum number of sessions finalized per sweep
+    session_sweep_interval_seconds: float = 60.0
+    session_idle_timeout_seconds: int = 600
+    session_sweep_batch_size: int = 500
+
+    # Maximum sessions tracked in memory per worker (least recently active evicted)
+    session_registry_max_entries: int = 100_000
+
+    # Classes left active are closed by the sweeper this many minutes after
+    # schedule_time (or activation, if later) + duration_minutes
+    class_auto_close_enabled: bool = True
+    class_auto_close_grace_minutes: int = 15
+
+    # WebSocket fan-out: messages queued per connection (oldest dropped beyond
+    # this) and seconds a connection may lag before it is disconnected
+    websocket_send_queue_size: int = 64
+    websocket_max_lag_seconds: float = 10.0
+    # Milliseconds between per-class engagement_batch messages (0 sends one
+    # engagement_update per tick)
+    websocket_engagement_batch_ms: int = 1000
+    # Broadcast backend: "local" (single worker) or "mongo" (shared between
+    # workers through a change stream on a capped collection; needs a replica
+    # set). mongo inserts every broadcast whether or not anyone listens, so
+    # keep engagement batching on with it.
+    websocket_broadcast_backend: str = "local"
+    websocket_broadcast_collection: str = "ws_broadcasts"
+    websocket_broadcast_capped_mb: int = 16
+
+    # Engagement time series (attendance_ticks): seconds between background
+    # bulk inserts (0 disables capture), ticks per insert, buffered ticks
+    # before the oldest are dropped, and retention (0 = keep forever)
+    timeline_flush_interval_seconds: float = 5.0
+    timeline_batch_size: int = 500
+    timeline_max_buffer: int = 50_000
+    timeline_retention_days: int = 30
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,238 @@
+"""
+Packed per-second engagement bitmaps.
+Each attendance record carries one bit per second of the class (bit i set =
+engaged during second i after started_at), packed into 32-bit words stored
+as an array of integers (second i is bit i % 32 of word i // 32). A
+90-minute class takes 169 words per student.
+
+Bits are set by MongoDB inside the tick update pipeline (mark_intervals_expr),
+so concurrent writers OR their bits into the stored bitmap atomically.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+WORD_BITS = 32
+
+# Number of set bits in each byte value
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint16)
+
+
+def seconds_since(started_at: datetime, moment: datetime) -> float:
+    """Offset of moment on a record's bitmap (second 0 starts at started_at, truncated)."""
+    return (moment - started_at.replace(microsecond=0)).total_seconds()
+
+
+def bitmap_words(duration_seconds: int) -> int:
+    """Words needed for a bitmap covering duration_seconds."""
+    return (max(0, int(duration_seconds)) + WORD_BITS - 1) // WORD_BITS
+
+
+def _pow2(exponent: Any) -> Dict:
+    return {"$pow": [2, exponent]}
+
+
+def _set_bits_expr(word: Any, low: Any, high: Any) -> Dict:
+    """
+    Aggregation expression for word with bits [low, high) set.
+
+    Uses arithmetic only: the $bitOr expression needs MongoDB 6.3 or later.
+    The bits already set in the range are subtracted before the full range
+    mask is added.
+    """
+    already_set = {"$multiply": [
+        {"$mod": [{"$floor": {"$divide": [word, _pow2(low)]}}, _pow2({"$subtract": [high, low]})]},
+        _pow2(low)
+    ]}
+    return {"$toLong": {"$add": [
+        {"$subtract": [word, already_set]},
+        {"$subtract": [_pow2(high), _pow2(low)]}
+    ]}}
+
+
+def mark_intervals_expr(intervals: Any) -> Dict:
+    """
+    Aggregation expression for the record's bitmap with engaged intervals marked.
+
+    Interval bounds are dates, converted to seconds_since() started_at and
+    rounded to whole seconds; the part of an interval outside the class is
+    ignored. A record without a bitmap gets an empty one sized for
+    total_class_duration_seconds.
+
+    Args:
+        intervals: Expression resolving to an array of [start, end) date pairs
+
+    Returns:
+        Expression for an update pipeline $set of engagement_bitmap
+    """
+    duration = "$total_class_duration_seconds"
+    started_ms = {"$toLong": "$started_at"}
+
+    def offset(moment: Any) -> Dict:
+        return {"$round": [{"$divide": [{"$subtract": [{"$toLong": moment}, "$$origin"]}, 1000]}, 0]}
+
+    empty = {"$map": {
+        "input": {"$range": [0, {"$toInt": {"$ceil": {"$divide": [duration, WORD_BITS]}}}]},
+        "in": 0
+    }}
+    mark_interval = {"$let": {
+        "vars": {
+            "first": {"$max": [0, offset({"$arrayElemAt": ["$$this", 0]})]},
+            "last": {"$min": [duration, offset({"$arrayElemAt": ["$$this", 1]})]}
+        },
+        "in": {"$map": {
+            "input": {"$range": [0, {"$size": "$$value"}]},
+            "as": "index",
+            "in": {"$let": {
+                "vars": {
+                    "word": {"$arrayElemAt": ["$$value", "$$index"]},
+                    "low": {"$max": [0, {"$subtract": ["$$first", {"$multiply": ["$$index", WORD_BITS]}]}]},
+                    "high": {"$min": [WORD_BITS, {"$subtract": ["$$last", {"$multiply": ["$$index", WORD_BITS]}]}]}
+                },
+                "in": {"$cond": [
+                    {"$lt": ["$$low", "$$high"]},
+                    _set_bits_expr("$$word", "$$low", "$$high"),
+                    "$$word"
+                ]}
+            }}
+        }}
+    }}
+    return {"$let": {
+        "vars": {"origin": {"$subtract": [started_ms, {"$mod": [started_ms, 1000]}]}},
+        "in": {"$reduce": {
+            "input": intervals,
+            "initialValue": {"$cond": [{"$isArray": "$engagement_bitmap"}, "$engagement_bitmap", empty]},
+            "in": mark_interval
+        }}
+    }}
+
+
+def unpack(bitmap: Optional[Sequence[int]], duration_seconds: int) -> np.ndarray:
+    """
+    Unpack a bitmap into one flag per second.
+
+    Args:
+        bitmap: Bitmap words (None for records without engagement yet)
+        duration_seconds: Seconds covered by the bitmap
+
+    Returns:
+        uint8 array of length duration_seconds
+    """
+    words = np.asarray(bitmap or [], dtype=np.int64).astype("<u4")
+    return np.unpackbits(words.view(np.uint8), count=max(0, int(duration_seconds)), bitorder="little")
+
+
+def popcount(bitmap: Optional[Sequence[int]]) -> int:
+    """Number of engaged seconds in a bitmap."""
+    words = np.asarray(bitmap or [], dtype=np.int64).astype("<u4")
+    return int(_POPCOUNT[words.view(np.uint8)].sum())
+
+
+def align(
+    bitmaps: Sequence[Optional[Sequence[int]]],
+    started_at: Sequence[datetime],
+    durations: Sequence[int]
+) -> Tuple[np.ndarray, Optional[datetime]]:
+    """
+    Unpack bitmaps onto a common timeline starting at the earliest started_at.
+
+    Args:
+        bitmaps: Bitmap words (None for records without engagement yet)
+        started_at: Start time of each record
+        durations: Seconds covered by each bitmap
+
+    Returns:
+        Tuple of (bool matrix of shape (students, seconds), timeline origin)
+    """
+    if not bitmaps:
+        return np.zeros((0, 0), dtype=bool), None
+
+    origin = min(started_at).replace(microsecond=0)
+    offsets = [int(seconds_since(origin, start.replace(microsecond=0))) for start in started_at]
+    length = max(offset + int(duration) for offset, duration in zip(offsets, durations))
+
+    matrix = np.zeros((len(bitmaps), length), dtype=bool)
+    for row, (bitmap, offset, duration) in enumerate(zip(bitmaps, offsets, durations)):
+        if bitmap:
+            bits = unpack(bitmap, duration)
+            matrix[row, offset:offset + len(bits)] = bits
+    return matrix, origin
+
+
+def class_engagement(
+    bitmaps: Sequence[Optional[Sequence[int]]],
+    started_at: Sequence[datetime],
+    durations: Sequence[int],
+    resolution_seconds: int = 60
+) -> Dict:
+    """
+    Class-wide engagement from per-student bitmaps.
+
+    Args:
+        bitmaps: Bitmap words, one per student
+        started_at: Start time of each record
+        durations: Seconds covered by each bitmap
+        resolution_seconds: Bucket size of the coverage curve
+
+    Returns:
+        Dictionary with:
+        - origin: Time of second 0
+        - any_engaged_seconds: Seconds where at least one student was engaged (OR)
+        - all_engaged_seconds: Seconds where every student was engaged (AND)
+        - coverage: Average number of engaged students per bucket
+        - student_seconds: Engaged seconds per student (popcount), in input order
+    """
+    matrix, origin = align(bitmaps, started_at, durations)
+    if origin is None:
+        return {
+            "origin": None,
+            "any_engaged_seconds": 0,
+            "all_engaged_seconds": 0,
+            "coverage": [],
+            "student_seconds": []
+        }
+
+    packed = np.packbits(matrix, axis=1)
+    any_engaged = np.bitwise_or.reduce(packed, axis=0)
+    all_engaged = np.bitwise_and.reduce(packed, axis=0)
+
+    # Engaged students per second, averaged over each bucket
+    per_second = matrix.sum(axis=0)
+    buckets = -(-len(per_second) // resolution_seconds)
+    padded = np.zeros(buckets * resolution_seconds, dtype=np.float64)
+    padded[:len(per_second)] = per_second
+    coverage = padded.reshape(buckets, resolution_seconds).mean(axis=1)
+
+    return {
+        "origin": origin,
+        "any_engaged_seconds": int(_POPCOUNT[any_engaged].sum()),
+        "all_engaged_seconds": int(_POPCOUNT[all_engaged].sum()),
+        "coverage": [round(float(value), 2) for value in coverage],
+        "student_seconds": [int(value) for value in _POPCOUNT[packed].sum(axis=1)]
+    }
+
+
+def engaged_at(
+    bitmaps: Sequence[Optional[Sequence[int]]],
+    started_at: Sequence[datetime],
+    durations: Sequence[int],
+    moment: datetime
+) -> List[bool]:
+    """
+    Whether each student was engaged during the second containing moment.
+
+    Args:
+        bitmaps: Bitmap words, one per student
+        started_at: Start time of each record
+        durations: Seconds covered by each bitmap
+        moment: Time to look up
+
+    Returns:
+        One flag per student, in input order
+    """
+    matrix, origin = align(bitmaps, started_at, durations)
+    second = int(seconds_since(origin, moment) // 1) if origin is not None else -1
+    if not 0 <= second < matrix.shape[1]:
+        return [False] * len(bitmaps)
+    return [bool(flag) for flag in matrix[:, second]]
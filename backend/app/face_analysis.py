@@ -0,0 +1,466 @@
+"""
+Face analysis executor.
+Runs FaceDetector work off the event loop in a pool of worker processes,
+each holding its own MediaPipe FaceMesh instance.
+"""
+
+import asyncio
+import itertools
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Tuple, Union
+from app.config import settings
+from app.face_detection import FACE_DETECTION_AVAILABLE, DetectionStats, FaceDetector, get_face_detector
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class FaceAnalysisUnavailable(Exception):
+    """Raised when a frame cannot be analyzed right now; clients should retry later."""
+
+
+class FaceAnalysisBusy(FaceAnalysisUnavailable):
+    """Raised when too many frames are already waiting for analysis."""
+
+
+class FaceAnalysisTimeout(FaceAnalysisUnavailable):
+    """Raised when a frame is not analyzed within the configured timeout."""
+
+
+# ─── Worker process side ────────────────────────────────────────────────────
+_worker_detector: Optional[FaceDetector] = None
+
+
+def _init_worker():
+    """Create this worker process's own FaceDetector (and FaceMesh)."""
+    global _worker_detector
+    _worker_detector = FaceDetector()
+
+
+def _worker_result(result: Tuple[bool, bool]) -> Tuple[Tuple[bool, bool], Dict, Dict]:
+    """Attach this worker's stats (drained since its last result) to a result."""
+    trackers = _worker_detector.trackers.get_stats() if _worker_detector.trackers else None
+    return result, _worker_detector.stats.drain(), trackers
+
+
+def _analyze_base64(frame_base64: str, tracker_key: Optional[Hashable]):
+    return _worker_result(_worker_detector.analyze_frame(frame_base64, tracker_key))
+
+
+def _analyze_bytes(frame_bytes: bytes, tracker_key: Optional[Hashable]):
+    return _worker_result(_worker_detector.analyze_frame_bytes(frame_bytes, tracker_key))
+
+
+def _analyze_batch(frames: List[Tuple[Union[str, bytes], Optional[Hashable]]]):
+    return _worker_result(_worker_detector.analyze_batch(frames))
+
+
+# ─── Event loop side ────────────────────────────────────────────────────────
+class LatencyStats:
+    """
+    End-to-end latency and throughput of analyzed frames.
+
+    Keeps the most recent latencies for percentiles and counts frames since
+    the first one for average throughput.
+    """
+
+    def __init__(self, window: int = 1024):
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self.frames = 0
+        self._started: Optional[float] = None
+
+    def record(self, seconds: float):
+        """Record one analyzed frame."""
+        if self._started is None:
+            self._started = time.monotonic() - seconds
+        self.frames += 1
+        self._latencies.append(seconds)
+
+    def snapshot(self) -> Dict[str, float]:
+        """Frame count, throughput and latency percentiles, for monitoring."""
+        latencies = sorted(self._latencies)
+        elapsed = time.monotonic() - self._started if self._started is not None else 0.0
+
+        def percentile(q: float) -> float:
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 3)
+
+        return {
+            "frames": self.frames,
+            "frames_per_second": round(self.frames / elapsed, 2) if elapsed > 0 else 0.0,
+            "p50_ms": percentile(0.50),
+            "p99_ms": percentile(0.99)
+        }
+
+
+class _PendingBatch:
+    """Frames waiting to be sent to one worker as a batch."""
+
+    __slots__ = ("frames", "futures", "timer")
+
+    def __init__(self):
+        self.frames: List[Tuple[Union[str, bytes], Optional[Hashable]]] = []
+        self.futures: List[asyncio.Future] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+class FaceAnalysisExecutor:
+    """
+    Dispatches frame analysis to worker processes and awaits the results.
+
+    Each worker is a single-process pool with its own FaceDetector, so
+    throughput scales with cores. Frames carrying a tracker key always go to
+    the same worker, which keeps that student's FaceMesh tracker. At most
+    max_pending frames may be queued or running at once; further frames are
+    rejected with FaceAnalysisBusy instead of piling up. A worker that dies
+    (e.g. killed by the OOM killer) is replaced, and the frames it held fail
+    with FaceAnalysisUnavailable. With workers=0, or
+    when the ML libraries are not installed, frames are analyzed in a thread
+    with the shared detector.
+
+    With batch_size > 1, frames are batched per worker only when the queue
+    is deep: a frame for an idle worker is sent at once (or after waiting up
+    to batch_window_ms for more), while frames arriving during a batch
+    collect into the next one (up to batch_size frames), which saves a
+    process round trip per frame without adding latency at low load.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_pending: int,
+        timeout_seconds: float,
+        batch_size: int = 1,
+        batch_window_ms: float = 0.0
+    ):
+        """Initialize the executor (worker processes start on first use)."""
+        self.workers = workers if FACE_DETECTION_AVAILABLE else 0
+        self.max_pending = max_pending
+        self.timeout_seconds = timeout_seconds
+        self.batch_size = max(1, batch_size)
+        self.batch_window_seconds = batch_window_ms / 1000
+        self._pools: List[Executor] = []
+        self._batches: Dict[int, _PendingBatch] = {}
+        self._busy: set = set()  # Workers with a batch in flight
+        self._round_robin = itertools.count()
+        self._pending = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.restarts = 0
+        self.batches = 0
+        self.batched_frames = 0
+        # Detection stats reported back by worker processes
+        self.stats = DetectionStats()
+        self._worker_trackers: Dict[int, Dict] = {}
+        # End-to-end latency per submission path
+        self.latency = {"direct": LatencyStats(), "batched": LatencyStats()}
+        logger.info(f"✓ Face analysis executor initialized (workers={self.workers}, "
+                    f"max_pending={max_pending}, batch_size={self.batch_size})")
+
+    @property
+    def pending(self) -> int:
+        """Number of frames queued or being analyzed."""
+        return self._pending
+
+    def start(self):
+        """Create the worker pools."""
+        if self._pools:
+            return
+        if self.workers > 0:
+            self._pools = [self._new_process_pool() for _ in range(self.workers)]
+        else:
+            self._pools = [ThreadPoolExecutor(max_workers=1, thread_name_prefix="face-analysis")]
+        logger.info(f"✓ Face analysis executor started with {len(self._pools)} worker(s)")
+
+    def _new_process_pool(self) -> ProcessPoolExecutor:
+        context = multiprocessing.get_context("spawn")
+        return ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_worker)
+
+    def _replace_broken(self, index: int, pool: Executor) -> FaceAnalysisUnavailable:
+        """
+        Replace a worker whose process died, unless that was already done.
+
+        Args:
+            index: Worker index
+            pool: Pool that raised BrokenProcessPool
+
+        Returns:
+            Error to hand to the callers whose frames were lost
+        """
+        if index < len(self._pools) and self._pools[index] is pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+            self._pools[index] = self._new_process_pool()
+            self._worker_trackers.pop(index, None)
+            self.restarts += 1
+            logger.warning(f"⚠ Face analysis worker {index} died; started a replacement")
+        return FaceAnalysisUnavailable("Face analysis worker restarted")
+
+    def shutdown(self):
+        """Stop the worker pools without waiting for queued frames."""
+        for batch in self._batches.values():
+            if batch.timer:
+                batch.timer.cancel()
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(FaceAnalysisUnavailable("Face analysis is shutting down"))
+        self._batches = {}
+        self._busy.clear()
+        for pool in self._pools:
+            pool.shutdown(wait=False, cancel_futures=True)
+        self._pools = []
+        logger.info("✓ Face analysis executor stopped")
+
+    def _release(self, count: int = 1):
+        self._pending -= count
+
+    def _on_worker_done(self, future: Future, callback: Callable[[Future], None]):
+        """Run callback on the event loop when a worker future completes."""
+        loop = asyncio.get_running_loop()
+
+        def _on_done(f):
+            try:
+                loop.call_soon_threadsafe(callback, f)
+            except RuntimeError:
+                pass  # Event loop already closed (shutdown)
+
+        future.add_done_callback(_on_done)
+
+    def _unpack(self, index: int, output):
+        """Merge worker stats from a worker output and return its result."""
+        if self.workers == 0:
+            return output
+        result, stats_delta, tracker_stats = output
+        self.stats.merge(stats_delta)
+        self._worker_trackers[index] = tracker_stats
+        return result
+
+    async def _submit(
+        self,
+        process_fn: Callable,
+        thread_fn: Callable,
+        payload: Union[str, bytes],
+        tracker_key: Optional[Hashable]
+    ) -> Tuple[bool, bool]:
+        """Run one analysis on a worker with admission control and a timeout."""
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise FaceAnalysisBusy("Face analysis queue is full")
+
+        if not self._pools:
+            self.start()
+        shard = hash(tracker_key) if tracker_key is not None else next(self._round_robin)
+        index = shard % len(self._pools)
+        # Bound for both paths: a batch's waiter may also raise BrokenProcessPool
+        pool = self._pools[index]
+        start = time.perf_counter()
+
+        if self.batch_size > 1:
+            path = "batched"
+            waiter = self._enqueue(index, payload, tracker_key)
+        else:
+            path = "direct"
+            fn = process_fn if self.workers > 0 else thread_fn
+            try:
+                future = pool.submit(fn, payload, tracker_key)
+            except BrokenProcessPool:
+                raise self._replace_broken(index, pool)
+            self._pending += 1
+            # Release the slot when the worker finishes, even if the caller timed out
+            self._on_worker_done(future, lambda f: self._release())
+            waiter = asyncio.wrap_future(future)
+
+        try:
+            output = await asyncio.wait_for(waiter, self.timeout_seconds)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise FaceAnalysisTimeout("Face analysis timed out")
+        except BrokenProcessPool:
+            raise self._replace_broken(index, pool)
+
+        result = output if path == "batched" else self._unpack(index, output)
+        self.latency[path].record(time.perf_counter() - start)
+        return result
+
+    def _enqueue(
+        self,
+        index: int,
+        payload: Union[str, bytes],
+        tracker_key: Optional[Hashable]
+    ) -> asyncio.Future:
+        """
+        Add a frame to a worker's pending batch.
+
+        The batch is dispatched when it is full, at once (or after the batch
+        window) if the worker is idle, and otherwise when the worker's
+        current batch completes.
+        """
+        loop = asyncio.get_running_loop()
+        batch = self._batches.get(index)
+        if batch is None:
+            batch = self._batches[index] = _PendingBatch()
+
+        future = loop.create_future()
+        batch.frames.append((payload, tracker_key))
+        batch.futures.append(future)
+        self._pending += 1
+
+        idle = index not in self._busy
+        if len(batch.frames) >= self.batch_size or (idle and self.batch_window_seconds <= 0):
+            self._dispatch(index)
+        elif idle and batch.timer is None:
+            batch.timer = loop.call_later(self.batch_window_seconds, self._dispatch, index)
+        return future
+
+    def _dispatch(self, index: int):
+        """Send a worker's pending batch to it."""
+        batch = self._batches.pop(index, None)
+        if batch is None:
+            return
+        if batch.timer:
+            batch.timer.cancel()
+        self._busy.add(index)
+        self.batches += 1
+        self.batched_frames += len(batch.frames)
+
+        fn = _analyze_batch if self.workers > 0 else get_face_detector().analyze_batch
+        pool = self._pools[index]
+        try:
+            future = pool.submit(fn, batch.frames)
+        except RuntimeError as e:
+            # Pool already shut down, or its worker died
+            self._resolve(index, pool, batch, None, e)
+            return
+        self._on_worker_done(future, lambda f: self._resolve(index, pool, batch, f))
+
+    def _resolve(
+        self,
+        index: int,
+        pool: Executor,
+        batch: _PendingBatch,
+        future: Optional[Future],
+        error: Optional[BaseException] = None
+    ):
+        """Hand each caller its result (or the batch's error), then send the next batch."""
+        self._release(len(batch.futures))
+        self._busy.discard(index)
+        if index in self._batches:
+            self._dispatch(index)
+        results = None
+        if error is None:
+            error = FaceAnalysisUnavailable("Face analysis was cancelled") if future.cancelled() else future.exception()
+        if isinstance(error, BrokenProcessPool):
+            error = self._replace_broken(index, pool)
+        if error is None:
+            results = self._unpack(index, future.result())
+
+        for i, waiter in enumerate(batch.futures):
+            if waiter.done():
+                continue  # Caller timed out
+            if results is None:
+                waiter.set_exception(error)
+            else:
+                waiter.set_result(results[i])
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Queue depth, admission counters and per-tier detection stats."""
+        if self.workers > 0:
+            tiers = self.stats.snapshot()
+            trackers = {
+                key: sum(stats[key] for stats in self._worker_trackers.values() if stats)
+                for key in ("trackers", "created", "evicted", "hits", "misses", "overflows")
+            }
+        else:
+            detector_stats = get_face_detector().get_stats()
+            tiers = detector_stats["tiers"]
+            trackers = detector_stats["trackers"]
+        if trackers:
+            lookups = trackers["hits"] + trackers["misses"]
+            trackers = {**trackers, "hit_ratio": round(trackers["hits"] / lookups, 4) if lookups else 0.0}
+        return {
+            "workers": self.workers,
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "restarts": self.restarts,
+            "batch_size": self.batch_size,
+            "avg_batch_size": round(self.batched_frames / self.batches, 2) if self.batches else 0.0,
+            "latency": {path: stats.snapshot() for path, stats in self.latency.items()},
+            # Share of tracked frames answered from the previous result
+            "skip_ratio": tiers["motion_gate"]["hit_ratio"],
+            "tiers": tiers,
+            "trackers": trackers
+        }
+
+    async def analyze_base64(
+        self,
+        frame_base64: str,
+        tracker_key: Optional[Hashable] = None
+    ) -> Tuple[bool, bool]:
+        """
+        Analyze a base64 encoded frame.
+
+        Args:
+            frame_base64: Base64 encoded image frame
+            tracker_key: Stream key, e.g. (session_id, student_id) (optional)
+
+        Returns:
+            Tuple of (face_detected, looking_at_screen)
+
+        Raises:
+            FaceAnalysisUnavailable: If the queue is full or analysis timed out
+        """
+        if not FACE_DETECTION_AVAILABLE:
+            return get_face_detector().analyze_frame(frame_base64, tracker_key)
+        return await self._submit(
+            _analyze_base64, get_face_detector().analyze_frame, frame_base64, tracker_key
+        )
+
+    async def analyze_bytes(
+        self,
+        frame_bytes: bytes,
+        tracker_key: Optional[Hashable] = None
+    ) -> Tuple[bool, bool]:
+        """
+        Analyze a frame given as raw encoded image bytes.
+
+        Args:
+            frame_bytes: Encoded image bytes (JPEG/PNG)
+            tracker_key: Stream key, e.g. (session_id, student_id) (optional)
+
+        Returns:
+            Tuple of (face_detected, looking_at_screen)
+
+        Raises:
+            FaceAnalysisUnavailable: If the queue is full or analysis timed out
+        """
+        if not FACE_DETECTION_AVAILABLE:
+            return get_face_detector().analyze_frame_bytes(frame_bytes, tracker_key)
+        return await self._submit(
+            _analyze_bytes, get_face_detector().analyze_frame_bytes, frame_bytes, tracker_key
+        )
+
+
+# Global face analysis executor instance
+face_analysis_executor = FaceAnalysisExecutor(
+    workers=settings.face_analysis_workers,
+    max_pending=settings.face_analysis_max_pending,
+    timeout_seconds=settings.face_analysis_timeout_seconds,
+    batch_size=settings.face_analysis_batch_size,
+    batch_window_ms=settings.face_analysis_batch_window_ms
+)
+
+
+def get_face_analysis_executor() -> FaceAnalysisExecutor:
+    """
+    Get the global face analysis executor instance.
+    Used for dependency injection.
+
+    Returns:
+        FaceAnalysisExecutor instance
+    """
+    return face_analysis_executor
@@ -7,10 +7,33 @@ Falls back to a stub when mediapipe/opencv are not installed (e.g. on Render).
 
 import base64
 import logging
-from typing import Tuple, Optional, Any
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, Optional, Any, Callable, Dict, Hashable, List, Union
+from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Size (width, height) of the grayscale thumbnail compared between frames
+MOTION_THUMBNAIL_SIZE = (32, 24)
+
+# Face Mesh landmarks used for head pose: nose tip, chin, outer eye corners
+# (image left, image right) and mouth corners (image left, image right)
+POSE_LANDMARKS = (1, 152, 33, 263, 61, 291)
+
+# Canonical 3D face model for POSE_LANDMARKS, in camera axes (x right,
+# y down, z away from the camera) with the nose tip at the origin
+FACE_MODEL_POINTS = (
+    (0.0, 0.0, 0.0),
+    (0.0, 330.0, 65.0),
+    (-225.0, -170.0, 135.0),
+    (225.0, -170.0, 135.0),
+    (-150.0, 150.0, 125.0),
+    (150.0, 150.0, 125.0),
+)
+
 FACE_DETECTION_AVAILABLE = False
 mp = None
 cv2 = None
@@ -21,7 +44,7 @@ try:
     import mediapipe as _mp
     import numpy as _np
     # Verify mediapipe.solutions is available (not available on some Python versions)
-    if hasattr(_mp, 'solutions') and hasattr(_mp.solutions, 'face_mesh'):
+    if hasattr(_mp, 'solutions') and hasattr(_mp.solutions, 'face_mesh') and hasattr(_mp.solutions, 'face_detection'):
         cv2 = _cv2
         mp = _mp
         np = _np
@@ -35,26 +58,320 @@ except Exception as e:
     logger.warning(f"⚠ Error loading face detection libraries – disabled (stub mode): {e}")
 
 
+def _reduced_decode(scale: int) -> Tuple[int, int]:
+    """Map a decode scale (1, 2, 4 or 8) to the matching cv2.imdecode flag."""
+    flags = {
+        1: cv2.IMREAD_COLOR,
+        2: cv2.IMREAD_REDUCED_COLOR_2,
+        4: cv2.IMREAD_REDUCED_COLOR_4,
+        8: cv2.IMREAD_REDUCED_COLOR_8,
+    }
+    if scale not in flags:
+        logger.warning(f"⚠ Unsupported decode scale {scale}, decoding at full resolution")
+        scale = 1
+    return scale, flags[scale]
+
+
+def _rotation_matrices(rvecs: Any) -> Any:
+    """Rodrigues rotation vectors of shape (N, 3) to rotation matrices (N, 3, 3)."""
+    theta = np.linalg.norm(rvecs, axis=1)
+    axis = rvecs / np.where(theta > 0, theta, 1.0)[:, None]
+    kx, ky, kz = axis[:, 0], axis[:, 1], axis[:, 2]
+    zero = np.zeros_like(kx)
+    skew = np.stack([
+        np.stack([zero, -kz, ky], axis=1),
+        np.stack([kz, zero, -kx], axis=1),
+        np.stack([-ky, kx, zero], axis=1),
+    ], axis=1)
+    sin = np.sin(theta)[:, None, None]
+    cos = np.cos(theta)[:, None, None]
+    return np.eye(3) + sin * skew + (1 - cos) * (skew @ skew)
+
+
+def estimate_head_pose(image_points: Any, frame_sizes: Any) -> Any:
+    """
+    Estimate head pose from 2D landmarks with cv2.solvePnP.
+    
+    Points are fitted to FACE_MODEL_POINTS with a pinhole camera whose focal
+    length is the frame width, so the angles do not depend on resolution.
+    
+    Args:
+        image_points: Pixel coordinates of POSE_LANDMARKS, shape (6, 2) or (N, 6, 2)
+        frame_sizes: (width, height) of the frame(s), shape (2,) or (N, 2)
+        
+    Returns:
+        (yaw, pitch, roll) in degrees, shape (3,) or (N, 3). Yaw is positive
+        when the face turns towards image left, pitch when it tilts down.
+    """
+    points = np.asarray(image_points, dtype=np.float64)
+    single = points.ndim == 2
+    points = points.reshape(-1, len(POSE_LANDMARKS), 2)
+    sizes = np.broadcast_to(np.asarray(frame_sizes, dtype=np.float64), (len(points), 2))
+    
+    model = np.asarray(FACE_MODEL_POINTS, dtype=np.float64)
+    camera = np.zeros((3, 3))
+    camera[2, 2] = 1.0
+    # Faces without a solution keep NaN angles, which fail every threshold
+    rvecs = np.full((len(points), 3), np.nan)
+    for i, ((width, height), face) in enumerate(zip(sizes, points)):
+        camera[0, 0] = camera[1, 1] = width
+        camera[0, 2], camera[1, 2] = width / 2, height / 2
+        try:
+            ok, rvec, _ = cv2.solvePnP(model, face, camera, None, flags=cv2.SOLVEPNP_ITERATIVE)
+        except cv2.error:
+            continue  # Degenerate landmarks
+        if ok:
+            rvecs[i] = rvec.ravel()
+    
+    rotation = _rotation_matrices(rvecs)
+    pitch = np.arctan2(rotation[:, 2, 1], rotation[:, 2, 2])
+    yaw = np.arctan2(-rotation[:, 2, 0], np.hypot(rotation[:, 2, 1], rotation[:, 2, 2]))
+    roll = np.arctan2(rotation[:, 1, 0], rotation[:, 0, 0])
+    poses = np.degrees(np.stack([yaw, pitch, roll], axis=1))
+    return poses[0] if single else poses
+
+
+def looks_at_screen(image_points: Any, frame_sizes: Any) -> Any:
+    """
+    Decide from landmarks whether each face is looking at the screen.
+    
+    A face counts as looking when its eyes are within the middle of the
+    frame horizontally and its yaw and pitch are within the configured limits.
+    
+    Args:
+        image_points: Pixel coordinates of POSE_LANDMARKS, shape (N, 6, 2)
+        frame_sizes: (width, height) of the frame(s), shape (2,) or (N, 2)
+        
+    Returns:
+        Boolean array of shape (N,)
+    """
+    points = np.asarray(image_points, dtype=np.float64)
+    sizes = np.broadcast_to(np.asarray(frame_sizes, dtype=np.float64), (len(points), 2))
+    poses = estimate_head_pose(points, sizes)
+    
+    # Face roughly centered (horizontal deviation < 30% of the frame width)
+    eye_center_x = points[:, 2:4, 0].mean(axis=1)
+    is_centered = np.abs(eye_center_x - sizes[:, 0] / 2) / sizes[:, 0] < 0.3
+    
+    is_frontal = (
+        (np.abs(poses[:, 0]) < settings.head_yaw_max_degrees)
+        & (np.abs(poses[:, 1]) < settings.head_pitch_max_degrees)
+    )
+    return is_centered & is_frontal
+
+
+class DetectionStats:
+    """
+    Call counts, hit counts and timings per detection tier.
+    
+    Tiers: "decode" (hit = image decoded), "motion_gate" (hit = frame
+    unchanged, previous result reused), "face_detection" (hit = face found by
+    the lightweight detector) and "face_mesh" (hit = landmarks found).
+    """
+    
+    TIERS = ("decode", "motion_gate", "face_detection", "face_mesh")
+    
+    def __init__(self):
+        self._tiers: Dict[str, list] = {tier: [0, 0, 0.0] for tier in self.TIERS}
+        # Batched frames are decoded on several threads
+        self._lock = threading.Lock()
+    
+    def record(self, tier: str, hit: bool, seconds: float):
+        """Record one call of a tier."""
+        with self._lock:
+            entry = self._tiers[tier]
+            entry[0] += 1
+            entry[1] += 1 if hit else 0
+            entry[2] += seconds
+    
+    def merge(self, delta: Dict[str, list]):
+        """Add counts drained from another DetectionStats (e.g. a worker process)."""
+        for tier, (calls, hits, seconds) in delta.items():
+            entry = self._tiers[tier]
+            entry[0] += calls
+            entry[1] += hits
+            entry[2] += seconds
+    
+    def drain(self) -> Dict[str, list]:
+        """Return the counts recorded since the last drain and reset them."""
+        with self._lock:
+            delta = self._tiers
+            self._tiers = {tier: [0, 0, 0.0] for tier in self.TIERS}
+        return delta
+    
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Counts and average latency per tier, for monitoring."""
+        return {
+            tier: {
+                "calls": calls,
+                "hits": hits,
+                "hit_ratio": round(hits / calls, 4) if calls else 0.0,
+                "total_ms": round(seconds * 1000, 3),
+                "avg_ms": round(seconds * 1000 / calls, 3) if calls else 0.0
+            }
+            for tier, (calls, hits, seconds) in self._tiers.items()
+        }
+
+
+class TrackerContext:
+    """A FaceMesh instance and per-frame history for one student's video stream."""
+    
+    __slots__ = ("face_mesh", "last_used", "roi", "thumbnail", "last_result", "skipped")
+    
+    def __init__(self, face_mesh: Any):
+        self.face_mesh = face_mesh
+        self.last_used = time.monotonic()
+        # Last face box with margin, normalized (x0, y0, x1, y1), or None
+        self.roi: Optional[Tuple[float, float, float, float]] = None
+        # Grayscale thumbnail of the last fully analyzed frame
+        self.thumbnail: Any = None
+        self.last_result: Optional[Tuple[bool, bool]] = None
+        # Consecutive frames answered with last_result
+        self.skipped = 0
+
+
+class _PendingPose:
+    """A frame with a face whose head pose is still to be decided."""
+    
+    __slots__ = ("points", "frame_size", "context")
+    
+    def __init__(self, points: Any, frame_size: Tuple[float, float], context: Optional[TrackerContext]):
+        self.points = points  # POSE_LANDMARKS in original-frame pixels, shape (6, 2)
+        self.frame_size = frame_size  # (width, height) of the original frame
+        self.context = context
+
+
+class TrackerPool:
+    """
+    Per-student FaceMesh trackers keyed by (session_id, student_id).
+    
+    Consecutive frames from one student hit the same FaceMesh, so MediaPipe
+    can track landmarks between frames instead of re-running full detection.
+    The pool is bounded: once max_trackers streams hold a tracker, other
+    streams get none (and use the shared FaceMesh) until trackers idle for
+    longer than idle_seconds are closed. Evicting on every miss would
+    rebuild a FaceMesh graph per frame when more students than trackers
+    take turns.
+    """
+    
+    def __init__(self, factory: Callable[[], Any], max_trackers: int, idle_seconds: float):
+        """Initialize an empty tracker pool."""
+        self._factory = factory
+        self.max_trackers = max_trackers
+        self.idle_seconds = idle_seconds
+        self._trackers: "OrderedDict[Hashable, TrackerContext]" = OrderedDict()
+        self.created = 0
+        self.evicted = 0
+        self.hits = 0
+        self.misses = 0
+        self.overflows = 0
+    
+    def acquire(self, key: Hashable) -> Optional[TrackerContext]:
+        """
+        Get the tracker for a stream, creating it if there is room.
+        
+        Args:
+            key: Stream key, e.g. (session_id, student_id)
+            
+        Returns:
+            TrackerContext for the stream, or None if the pool is full
+        """
+        now = time.monotonic()
+        self.evict_idle(now)
+        context = self._trackers.get(key)
+        
+        if context is not None:
+            self.hits += 1
+            self._trackers.move_to_end(key)
+        else:
+            self.misses += 1
+            if len(self._trackers) >= self.max_trackers:
+                self.overflows += 1
+                return None
+            context = TrackerContext(self._factory())
+            self._trackers[key] = context
+            self.created += 1
+        
+        context.last_used = now
+        return context
+    
+    def evict_idle(self, now: Optional[float] = None):
+        """Close trackers that have not been used for idle_seconds."""
+        now = time.monotonic() if now is None else now
+        # Entries are in LRU order, so stop at the first recently used one
+        while self._trackers:
+            key, context = next(iter(self._trackers.items()))
+            if now - context.last_used < self.idle_seconds:
+                break
+            del self._trackers[key]
+            self._close(context)
+    
+    def _close(self, context: TrackerContext):
+        self.evicted += 1
+        try:
+            context.face_mesh.close()
+        except Exception as e:
+            logger.warning(f"⚠ Error closing face tracker: {e}")
+    
+    def close(self):
+        """Close all trackers."""
+        while self._trackers:
+            _, context = self._trackers.popitem(last=False)
+            self._close(context)
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Tracker counts and hit/miss counters, for monitoring."""
+        return {
+            "trackers": len(self._trackers),
+            "created": self.created,
+            "evicted": self.evicted,
+            "hits": self.hits,
+            "misses": self.misses,
+            "overflows": self.overflows
+        }
+    
+    def __len__(self) -> int:
+        return len(self._trackers)
+
+
 class FaceDetector:
     """
-    Face detection and engagement analysis using MediaPipe Face Mesh.
+    Face detection and engagement analysis using MediaPipe.
     Tracks face presence and head pose to determine screen attention.
+    
+    Detection is tiered: a lightweight face detector answers "no face"
+    cheaply, and the heavier Face Mesh (for head pose) only runs on frames
+    that contain a face.
     """
     
     def __init__(self):
         """Initialize MediaPipe Face Mesh detector (or stub)."""
         self.mp_face_mesh = None
         self.face_mesh = None
+        self.face_detection = None
+        self.trackers: Optional[TrackerPool] = None
+        self.stats = DetectionStats()
         self._available = False
+        self.decode_scale = 1
+        self._decode_flag = None
+        # Reused resize targets, keyed by (height, width, channels)
+        self._resize_buffers: Dict[Tuple[int, ...], Any] = {}
+        self._decode_pool: Optional[ThreadPoolExecutor] = None
         
         if FACE_DETECTION_AVAILABLE:
             try:
+                self.decode_scale, self._decode_flag = _reduced_decode(settings.face_analysis_decode_scale)
+                self.face_detection = mp.solutions.face_detection.FaceDetection(
+                    model_selection=0,  # Short-range model, suited to webcams
+                    min_detection_confidence=0.5
+                )
                 self.mp_face_mesh = mp.solutions.face_mesh
-                self.face_mesh = self.mp_face_mesh.FaceMesh(
-                    max_num_faces=1,
-                    refine_landmarks=True,
-                    min_detection_confidence=0.5,
-                    min_tracking_confidence=0.5
+                # Shared by streams without a tracker, so it must not track between frames
+                self.face_mesh = self._create_face_mesh(static_image_mode=True)
+                self.trackers = TrackerPool(
+                    factory=self._create_face_mesh,
+                    max_trackers=settings.face_tracker_max_per_worker,
+                    idle_seconds=settings.face_tracker_idle_seconds
                 )
                 self._available = True
                 logger.info("✓ Face detector initialized")
@@ -62,10 +379,21 @@ class FaceDetector:
                 logger.warning(f"⚠ Failed to initialize face detector: {e}")
                 self.mp_face_mesh = None
                 self.face_mesh = None
+                self.face_detection = None
                 self._available = False
         else:
             logger.info("✓ Face detector initialized (stub – no ML libraries)")
     
+    def _create_face_mesh(self, static_image_mode: bool = False) -> Any:
+        """Create a FaceMesh instance, in video (tracking) mode unless static_image_mode."""
+        return self.mp_face_mesh.FaceMesh(
+            static_image_mode=static_image_mode,
+            max_num_faces=1,
+            refine_landmarks=settings.face_mesh_refine_landmarks,
+            min_detection_confidence=0.5,
+            min_tracking_confidence=0.5
+        )
+    
     def decode_base64_image(self, base64_string: str) -> Optional[Any]:
         """
         Decode base64 encoded image to numpy array.
@@ -85,29 +413,63 @@ class FaceDetector:
             
             # Decode base64 to bytes
             img_bytes = base64.b64decode(base64_string)
-            
-            # Convert bytes to numpy array
-            nparr = np.frombuffer(img_bytes, np.uint8)
-            
-            # Decode image
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-            return img
         except Exception as e:
             logger.error(f"Error decoding base64 image: {e}")
             return None
+        
+        return self.decode_image_bytes(img_bytes)
+    
+    def decode_image_bytes(self, image_bytes: bytes) -> Optional[Any]:
+        """
+        Decode raw encoded image bytes (JPEG/PNG) to numpy array.
+        
+        The buffer is wrapped with np.frombuffer without copying. JPEGs are
+        decoded at reduced resolution (1/decode_scale) when configured, which
+        is much cheaper than a full decode followed by a resize.
+        
+        Args:
+            image_bytes: Encoded image bytes
+            
+        Returns:
+            Numpy array image in BGR format, or None if decoding fails
+        """
+        if not self._available:
+            return None
+        start = time.perf_counter()
+        image = None
+        try:
+            nparr = np.frombuffer(image_bytes, np.uint8)
+            image = cv2.imdecode(nparr, self._decode_flag)
+        except Exception as e:
+            logger.error(f"Error decoding image bytes: {e}")
+        self.stats.record("decode", image is not None, time.perf_counter() - start)
+        return image
     
-    def detect_face_and_pose(self, image: Any) -> Tuple[bool, bool]:
+    def detect_face_and_pose(
+        self,
+        image: Any,
+        tracker_key: Optional[Hashable] = None,
+        scale: float = 1.0
+    ) -> Tuple[bool, bool]:
         """
         Detect face and determine if person is looking at screen.
         
         Algorithm:
-        1. Detect face using MediaPipe Face Mesh
-        2. Calculate head pose angles (pitch, yaw, roll) using facial landmarks
-        3. Determine if face is centered and looking forward
+        1. Downscale the frame to the analysis width
+        2. Skip analysis if the stream's frame has not changed since the last
+           analyzed one (previous result reused, refreshed every N frames)
+        3. Crop to the stream's previous face region (plus margin), if known
+        4. Detect face using the lightweight MediaPipe face detector
+           (falls back to the full frame when the crop has no face)
+        5. Only if a face is present, run Face Mesh for facial landmarks
+        6. Calculate head pose angles (pitch, yaw, roll) using facial landmarks
+        7. Determine if face is centered and looking forward
         
         Args:
             image: Input image in BGR format (OpenCV format)
+            tracker_key: Stream key (e.g. (session_id, student_id)) to use that
+                stream's own tracker; None uses the shared FaceMesh
+            scale: Pixel scale from image to the original frame (for reduced decodes)
             
         Returns:
             Tuple of (face_detected, looking_at_screen)
@@ -115,110 +477,253 @@ class FaceDetector:
         if not self._available:
             return True, True  # Stub: assume present and looking
         try:
-            # Convert BGR to RGB for MediaPipe
-            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            
-            # Process image with Face Mesh
-            results = self.face_mesh.process(rgb_image)
-            
-            # No face detected
-            if not results.multi_face_landmarks:
-                return False, False
-            
-            # Face detected, now check head pose
-            face_landmarks = results.multi_face_landmarks[0]
-            
-            # Calculate if looking at screen based on head pose
-            looking_at_screen = self._is_looking_at_screen(face_landmarks, image.shape)
-            
-            return True, looking_at_screen
+            outcome = self._locate_face(image, tracker_key, scale)
+            if isinstance(outcome, _PendingPose):
+                return self._decide_poses([outcome])[0]
+            return outcome
             
         except Exception as e:
             logger.error(f"Error in face detection: {e}")
             return False, False
     
-    def _is_looking_at_screen(self, face_landmarks, image_shape: Tuple[int, int, int]) -> bool:
+    def _locate_face(
+        self,
+        image: Any,
+        tracker_key: Optional[Hashable],
+        scale: float
+    ) -> Union[Tuple[bool, bool], _PendingPose]:
         """
-        Determine if person is looking at the screen based on head pose.
+        Run steps 1-5 of detect_face_and_pose on one frame.
         
-        Uses key facial landmarks to estimate head rotation:
-        - Nose tip
-        - Chin
-        - Left eye outer corner
-        - Right eye outer corner
-        - Left ear
-        - Right ear
+        Returns:
+            The final (face_detected, looking_at_screen), or a _PendingPose
+            when a face's landmarks were found and only its pose is left
+        """
+        image, resize_scale = self._resize_for_analysis(image)
+        scale *= resize_scale
+        
+        context = self.trackers.acquire(tracker_key) if tracker_key is not None else None
+        if context is not None and self._is_unchanged(image, context):
+            return context.last_result
+        
+        outcome = self._detect_in_frame(image, context, scale)
+        if context is not None and not isinstance(outcome, _PendingPose):
+            context.last_result = outcome
+        return outcome
+    
+    def _decide_poses(self, pending: List[_PendingPose]) -> List[Tuple[bool, bool]]:
+        """
+        Decide head pose for many faces with one looks_at_screen call.
         
         Args:
-            face_landmarks: MediaPipe face landmarks
-            image_shape: Image dimensions (height, width, channels)
+            pending: Frames whose landmarks were found
             
         Returns:
-            True if looking at screen, False otherwise
+            (True, looking_at_screen) for each frame, in order
         """
-        h, w = image_shape[:2]
+        looking = looks_at_screen(
+            np.stack([entry.points for entry in pending]),
+            np.array([entry.frame_size for entry in pending])
+        )
+        results = []
+        for entry, looking_at_screen in zip(pending, looking):
+            result = (True, bool(looking_at_screen))
+            if entry.context is not None:
+                entry.context.last_result = result
+            results.append(result)
+        logger.debug(f"Face analysis: looking_at_screen={[looking for _, looking in results]}")
+        return results
+    
+    def _is_unchanged(self, image: Any, context: TrackerContext) -> bool:
+        """
+        Check whether a frame is close enough to the stream's last analyzed frame.
         
-        # Key landmark indices (MediaPipe Face Mesh)
-        # Nose tip: 1, Chin: 152
-        # Left eye outer: 33, Right eye outer: 263
-        # Left mouth corner: 61, Right mouth corner: 291
+        Compares small grayscale thumbnails by mean absolute difference. A
+        changed frame becomes the new reference; unchanged frames are
+        reused at most motion_refresh_frames times in a row.
         
-        nose_tip = face_landmarks.landmark[1]
-        chin = face_landmarks.landmark[152]
-        left_eye = face_landmarks.landmark[33]
-        right_eye = face_landmarks.landmark[263]
-        left_mouth = face_landmarks.landmark[61]
-        right_mouth = face_landmarks.landmark[291]
+        Args:
+            image: Frame in BGR format, already downscaled for analysis
+            context: The stream's tracker context
+            
+        Returns:
+            True if the previous result can be reused
+        """
+        threshold = settings.motion_skip_threshold
+        if threshold <= 0:
+            return False
         
-        # Convert normalized coordinates to pixel coordinates
-        nose_x, nose_y = int(nose_tip.x * w), int(nose_tip.y * h)
-        chin_x, chin_y = int(chin.x * w), int(chin.y * h)
-        left_eye_x = int(left_eye.x * w)
-        right_eye_x = int(right_eye.x * w)
-        left_mouth_x = int(left_mouth.x * w)
-        right_mouth_x = int(right_mouth.x * w)
+        start = time.perf_counter()
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        thumbnail = cv2.resize(gray, MOTION_THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA).astype(np.int16)
         
-        # Calculate face center
-        face_center_x = (left_eye_x + right_eye_x) // 2
-        image_center_x = w // 2
+        unchanged = (
+            context.last_result is not None
+            and context.thumbnail is not None
+            and context.skipped < settings.motion_refresh_frames
+            and float(np.mean(np.abs(thumbnail - context.thumbnail))) < threshold
+        )
+        if unchanged:
+            context.skipped += 1
+        else:
+            context.thumbnail = thumbnail
+            context.skipped = 0
         
-        # Check if face is roughly centered (horizontal deviation)
-        horizontal_deviation = abs(face_center_x - image_center_x) / w
+        self.stats.record("motion_gate", unchanged, time.perf_counter() - start)
+        return unchanged
+    
+    def _detect_in_frame(
+        self,
+        image: Any,
+        context: Optional[TrackerContext],
+        scale: float
+    ) -> Union[Tuple[bool, bool], _PendingPose]:
+        """
+        Run the detection tiers on one frame.
+        
+        Args:
+            image: Frame in BGR format, already downscaled for analysis
+            context: The stream's tracker context, or None for the shared FaceMesh
+            scale: Pixel scale from image to the original frame
+            
+        Returns:
+            Tuple of (face_detected, looking_at_screen), or a _PendingPose
+            with the landmarks to decide the head pose from
+        """
+        h, w = image.shape[:2]
+        face_mesh = context.face_mesh if context else self.face_mesh
+        
+        # Crop to the previous face region; box is (x, y, width, height) in pixels
+        box = (0, 0, w, h)
+        if context and context.roi:
+            x0, y0, x1, y1 = context.roi
+            box = (int(x0 * w), int(y0 * h), max(1, int((x1 - x0) * w)), max(1, int((y1 - y0) * h)))
+        
+        # Tier 1: cheap face presence check
+        detection, rgb_image = self._detect(image, box)
+        if not detection.detections and box != (0, 0, w, h):
+            # Face moved out of the crop; retry on the full frame
+            box = (0, 0, w, h)
+            detection, rgb_image = self._detect(image, box)
+        
+        # No face detected
+        if not detection.detections:
+            if context:
+                context.roi = None
+            return False, False
+        
+        if context:
+            context.roi = self._face_roi(detection.detections[0], box, w, h)
         
-        # Check face symmetry (indicates frontal view)
-        eye_distance = abs(right_eye_x - left_eye_x)
-        mouth_distance = abs(right_mouth_x - left_mouth_x)
+        # Tier 2: landmarks for head pose
+        start = time.perf_counter()
+        results = face_mesh.process(rgb_image)
+        self.stats.record("face_mesh", bool(results.multi_face_landmarks), time.perf_counter() - start)
         
-        # Both distances should be similar for frontal view
-        symmetry_ratio = min(eye_distance, mouth_distance) / max(eye_distance, mouth_distance) if max(eye_distance, mouth_distance) > 0 else 0
+        # Face present but landmarks not found: pose is unknown
+        if not results.multi_face_landmarks:
+            return True, False
+        
+        # Face detected; head pose is decided from these landmarks
+        points = self._pose_points(results.multi_face_landmarks[0], image.shape, box, scale)
+        return _PendingPose(points, (w * scale, h * scale), context)
+    
+    def _resize_for_analysis(self, image: Any) -> Tuple[Any, float]:
+        """
+        Downscale an image to the configured analysis width.
+        
+        Returns:
+            Tuple of (image, pixel scale back to the input image)
+        """
+        h, w = image.shape[:2]
+        max_width = settings.face_analysis_max_width
+        if max_width and w > max_width:
+            ratio = max_width / w
+            shape = (max(1, int(h * ratio)), max_width) + image.shape[2:]
+            # Frames are analyzed one after another, so the buffer can be reused
+            buffer = self._resize_buffers.get(shape)
+            if buffer is None:
+                buffer = self._resize_buffers[shape] = np.empty(shape, dtype=image.dtype)
+            image = cv2.resize(image, (shape[1], shape[0]), dst=buffer, interpolation=cv2.INTER_AREA)
+            return image, 1 / ratio
+        return image, 1.0
+    
+    def _detect(self, image: Any, box: Tuple[int, int, int, int]) -> Tuple[Any, Any]:
+        """
+        Run the lightweight face detector on a region of the image.
+        
+        Returns:
+            Tuple of (detection results, RGB crop the detector ran on)
+        """
+        x, y, bw, bh = box
+        rgb_image = cv2.cvtColor(image[y:y + bh, x:x + bw], cv2.COLOR_BGR2RGB)
         
-        # Calculate vertical alignment (pitch)
-        vertical_distance = abs(nose_y - chin_y)
+        start = time.perf_counter()
+        detection = self.face_detection.process(rgb_image)
+        self.stats.record("face_detection", bool(detection.detections), time.perf_counter() - start)
+        return detection, rgb_image
+    
+    def _face_roi(self, detection: Any, box: Tuple[int, int, int, int], w: int, h: int) -> Optional[Tuple[float, float, float, float]]:
+        """
+        Face box from a detection, expanded by the configured margin.
         
-        # Thresholds for determining "looking at screen"
-        # Face should be:
-        # - Reasonably centered (horizontal deviation < 30%)
-        # - Symmetrical (symmetry ratio > 0.7)
-        # - Not too tilted (vertical distance reasonable)
+        Returns:
+            Normalized (x0, y0, x1, y1) in full-frame coordinates, or None
+            when cropping is disabled
+        """
+        margin = settings.face_roi_margin
+        if margin <= 0:
+            return None
         
-        is_centered = horizontal_deviation < 0.3
-        is_symmetrical = symmetry_ratio > 0.7
-        has_proper_pose = vertical_distance > 50  # Face not too tilted down/up
+        x, y, bw, bh = box
+        rel = detection.location_data.relative_bounding_box
+        fx0 = (x + rel.xmin * bw) / w
+        fy0 = (y + rel.ymin * bh) / h
+        fw = rel.width * bw / w
+        fh = rel.height * bh / h
         
-        looking_at_screen = is_centered and is_symmetrical and has_proper_pose
+        return (
+            max(0.0, fx0 - fw * margin),
+            max(0.0, fy0 - fh * margin),
+            min(1.0, fx0 + fw * (1 + margin)),
+            min(1.0, fy0 + fh * (1 + margin))
+        )
+    
+    def _pose_points(
+        self,
+        face_landmarks,
+        image_shape: Tuple[int, int, int],
+        box: Optional[Tuple[int, int, int, int]] = None,
+        scale: float = 1.0
+    ) -> Any:
+        """
+        Pixel coordinates of the head pose landmarks in the original frame.
         
-        # Log for debugging
-        logger.debug(f"Face analysis: centered={is_centered}, symmetrical={is_symmetrical}, "
-                    f"proper_pose={has_proper_pose}, result={looking_at_screen}")
+        Args:
+            face_landmarks: MediaPipe face landmarks
+            image_shape: Image dimensions (height, width, channels)
+            box: Region (x, y, width, height) the landmarks are relative to
+            scale: Pixel scale from the image to the original frame
+            
+        Returns:
+            Array of POSE_LANDMARKS points, shape (6, 2)
+        """
+        h, w = image_shape[:2]
+        box_x, box_y, box_w, box_h = box or (0, 0, w, h)
         
-        return looking_at_screen
+        # Landmarks are normalized to the crop; map to original-frame pixels
+        normalized = np.array(
+            [(face_landmarks.landmark[i].x, face_landmarks.landmark[i].y) for i in POSE_LANDMARKS]
+        )
+        return (normalized * (box_w, box_h) + (box_x, box_y)) * scale
     
-    def analyze_frame(self, base64_frame: str) -> Tuple[bool, bool]:
+    def analyze_frame(self, base64_frame: str, tracker_key: Optional[Hashable] = None) -> Tuple[bool, bool]:
         """
         Main method to analyze a frame from base64 encoding.
         
         Args:
             base64_frame: Base64 encoded image frame
+            tracker_key: Stream key for per-student tracking (optional)
             
         Returns:
             Tuple of (face_detected, looking_at_screen)
@@ -234,10 +739,102 @@ class FaceDetector:
             return False, False
         
         # Detect face and pose
-        return self.detect_face_and_pose(image)
+        return self.detect_face_and_pose(image, tracker_key, self.decode_scale)
+    
+    def analyze_frame_bytes(self, image_bytes: bytes, tracker_key: Optional[Hashable] = None) -> Tuple[bool, bool]:
+        """
+        Analyze a frame uploaded as raw encoded image bytes.
+        
+        Args:
+            image_bytes: Encoded image bytes (JPEG/PNG)
+            tracker_key: Stream key for per-student tracking (optional)
+            
+        Returns:
+            Tuple of (face_detected, looking_at_screen)
+        """
+        if not self._available:
+            return True, True  # Stub: assume present and looking
+        
+        image = self.decode_image_bytes(image_bytes)
+        
+        if image is None:
+            logger.warning("Failed to decode image")
+            return False, False
+        
+        return self.detect_face_and_pose(image, tracker_key, self.decode_scale)
+    
+    def analyze_batch(
+        self,
+        frames: List[Tuple[Union[str, bytes], Optional[Hashable]]]
+    ) -> List[Tuple[bool, bool]]:
+        """
+        Analyze several frames (typically from different students) in one call.
+        
+        Frames are decoded in parallel threads (cv2.imdecode releases the
+        GIL), then run through face detection and Face Mesh back to back,
+        reusing the detector's resize buffers. The head poses of all faces
+        found are then decided with one vectorized looks_at_screen call.
+        
+        Args:
+            frames: (frame, tracker_key) pairs; frame is base64 text or encoded bytes
+            
+        Returns:
+            (face_detected, looking_at_screen) for each frame, in order
+        """
+        if not self._available:
+            return [(True, True)] * len(frames)  # Stub: assume present and looking
+        
+        if self._decode_pool is None:
+            self._decode_pool = ThreadPoolExecutor(
+                max_workers=settings.face_analysis_decode_threads,
+                thread_name_prefix="frame-decode"
+            )
+        images = list(self._decode_pool.map(
+            lambda frame: self.decode_base64_image(frame) if isinstance(frame, str)
+            else self.decode_image_bytes(frame),
+            [frame for frame, _ in frames]
+        ))
+        
+        results: List[Tuple[bool, bool]] = []
+        pending: Dict[int, _PendingPose] = {}
+        for index, (image, (_, tracker_key)) in enumerate(zip(images, frames)):
+            outcome = (False, False)
+            if image is None:
+                logger.warning("Failed to decode image")
+            else:
+                try:
+                    outcome = self._locate_face(image, tracker_key, self.decode_scale)
+                except Exception as e:
+                    logger.error(f"Error in face detection: {e}")
+            if isinstance(outcome, _PendingPose):
+                pending[index] = outcome
+                outcome = (True, False)  # Replaced once the pose is decided
+            results.append(outcome)
+        
+        if pending:
+            try:
+                for index, result in zip(pending, self._decide_poses(list(pending.values()))):
+                    results[index] = result
+            except Exception as e:
+                logger.error(f"Error in head pose estimation: {e}")
+        return results
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-tier detection stats and tracker counts, for monitoring."""
+        return {
+            "available": self._available,
+            "tiers": self.stats.snapshot(),
+            "trackers": self.trackers.get_stats() if self.trackers else None
+        }
     
     def cleanup(self):
         """Clean up resources."""
+        if self._decode_pool:
+            self._decode_pool.shutdown(wait=False)
+        if self.trackers:
+            self.trackers.close()
+        if self.face_detection:
+            self.face_detection.close()
         if self._available and self.face_mesh:
             self.face_mesh.close()
             logger.info("✓ Face detector cleaned up")
@@ -0,0 +1,173 @@
+"""
+Latest-frame-wins queue for server-side frame analysis.
+Keeps at most one waiting frame per student so a slow detector answers the
+newest frame instead of working through a growing backlog.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+from app.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+FrameJob = Callable[[], Awaitable[Dict]]
+
+
+class _FrameSlot:
+    """Queue state for one student's stream."""
+
+    __slots__ = ("running", "waiting", "last_result", "touched")
+
+    def __init__(self):
+        self.running = False
+        # Newest frame not yet started: (job, caller's future)
+        self.waiting: Optional[Tuple[FrameJob, asyncio.Future]] = None
+        self.last_result: Optional[Dict] = None
+        self.touched = time.monotonic()  # Last submitted frame, for idle eviction
+
+
+class FrameQueue:
+    """
+    Per-stream single-slot frame queue with a global in-flight cap.
+
+    Each stream (e.g. (session_id, student_id)) has at most one frame being
+    analyzed and one frame waiting. A new frame replaces the waiting one,
+    whose caller is answered immediately with the stream's last result
+    (coalesced), or with a "superseded" failure if there is none yet
+    (dropped). At most max_in_flight frames are analyzed at once across
+    all streams; waiting streams are started in arrival order.
+    """
+
+    def __init__(self, max_in_flight: int):
+        """Initialize an empty queue."""
+        self.max_in_flight = max_in_flight
+        self._slots: Dict[Hashable, _FrameSlot] = {}
+        self._ready: Deque[Hashable] = deque()
+        self._in_flight = 0
+        self.processed = 0
+        self.coalesced = 0
+        self.dropped = 0
+        logger.info(f"✓ Frame queue initialized (max_in_flight={max_in_flight})")
+
+    async def submit(self, key: Hashable, job: FrameJob) -> Dict:
+        """
+        Queue a frame for a stream and wait for its result.
+
+        Args:
+            key: Stream key, e.g. (session_id, student_id)
+            job: Coroutine function that analyzes the frame and returns its result
+
+        Returns:
+            The frame's result, or the stream's last result (with
+            "superseded": True) if a newer frame replaced this one
+        """
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = _FrameSlot()
+        slot.touched = time.monotonic()
+
+        future = asyncio.get_running_loop().create_future()
+        if slot.waiting is not None:
+            self._supersede(slot)
+        elif not slot.running:
+            self._ready.append(key)
+        slot.waiting = (job, future)
+
+        self._start_ready()
+        return await future
+
+    def _supersede(self, slot: _FrameSlot):
+        """Answer a slot's waiting frame without analyzing it."""
+        _, future = slot.waiting
+        slot.waiting = None
+        if future.done():
+            return  # Caller already gone
+        if slot.last_result is not None:
+            self.coalesced += 1
+            future.set_result({**slot.last_result, "superseded": True})
+        else:
+            self.dropped += 1
+            future.set_result({
+                "success": False,
+                "superseded": True,
+                "message": "Frame superseded by a newer frame"
+            })
+
+    def _start_ready(self):
+        """Start waiting frames while there is capacity."""
+        while self._ready and self._in_flight < self.max_in_flight:
+            key = self._ready.popleft()
+            slot = self._slots.get(key)
+            if slot is None or slot.running or slot.waiting is None:
+                continue
+            job, future = slot.waiting
+            slot.waiting = None
+            if future.done():
+                continue  # Caller disconnected while waiting
+            slot.running = True
+            self._in_flight += 1
+            asyncio.ensure_future(self._run(key, slot, job, future))
+
+    async def _run(self, key: Hashable, slot: _FrameSlot, job: FrameJob, future: asyncio.Future):
+        """Analyze one frame, then start the next waiting one."""
+        try:
+            result = await job()
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            self.processed += 1
+            if result.get("success"):
+                slot.last_result = result
+            if not future.done():
+                future.set_result(result)
+        finally:
+            slot.running = False
+            self._in_flight -= 1
+            if slot.waiting is not None:
+                self._ready.append(key)
+            self._start_ready()
+
+    def discard(self, key: Hashable):
+        """Forget a stream's last result (e.g. when its session ends)."""
+        slot = self._slots.get(key)
+        if slot is not None and not slot.running and slot.waiting is None:
+            del self._slots[key]
+
+    def idle_keys(self, idle_seconds: float) -> List[Hashable]:
+        """Keys of streams with no frame submitted for idle_seconds."""
+        cutoff = time.monotonic() - idle_seconds
+        return [
+            key for key, slot in self._slots.items()
+            if slot.touched < cutoff and not slot.running and slot.waiting is None
+        ]
+
+    def get_stats(self) -> Dict[str, int]:
+        """Queue depth and frame counters, for monitoring."""
+        return {
+            "streams": len(self._slots),
+            "in_flight": self._in_flight,
+            "max_in_flight": self.max_in_flight,
+            "waiting": sum(1 for slot in self._slots.values() if slot.waiting is not None),
+            "processed": self.processed,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped
+        }
+
+
+# Global frame queue instance
+frame_queue = FrameQueue(settings.frame_queue_max_in_flight)
+
+
+def get_frame_queue() -> FrameQueue:
+    """
+    Get the global frame queue instance.
+    Used for dependency injection.
+
+    Returns:
+        FrameQueue instance
+    """
+    return frame_queue
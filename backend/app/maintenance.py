@@ -0,0 +1,348 @@
+"""
+Background maintenance of classes and attendance sessions.
+Closes classes left active past their scheduled duration, finalizes
+sessions whose students stopped sending ticks (e.g. closed the tab) and
+evicts their in-memory state.
+"""
+
+import asyncio
+import os
+import socket
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from app.attendance import AttendanceManager, get_attendance_manager
+from app.config import settings
+from app.database import get_database
+from app.models import AttendanceStatus
+from app.websocket import ConnectionManager, get_connection_manager
+import logging
+
+logger = logging.getLogger(__name__)
+
+LOCKS_COLLECTION = "maintenance_locks"
+
+
+async def ensure_maintenance_indexes(db):
+    """
+    Create the indexes used by the sweeper.
+
+    Open sessions are found by status and last tick time, or by start time
+    for sessions that never ticked; active classes by schedule time.
+
+    Args:
+        db: Database instance
+    """
+    try:
+        await db.attendance.create_index(
+            [("status", ASCENDING), ("last_frame_timestamp", ASCENDING)],
+            name="status_last_frame"
+        )
+        await db.attendance.create_index(
+            [("status", ASCENDING), ("started_at", ASCENDING)],
+            name="status_started_at"
+        )
+        await db.classes.create_index(
+            [("is_active", ASCENDING), ("schedule_time", ASCENDING)],
+            name="active_schedule_time"
+        )
+    except Exception as e:
+        logger.warning(f"⚠ Could not create maintenance indexes: {e}")
+
+
+async def acquire_lease(db, name: str, owner: str, seconds: float) -> bool:
+    """
+    Take or renew a named lease so only one worker runs a periodic job.
+
+    The lease document is claimed when it is missing, expired or already
+    held by owner, and then expires after seconds unless renewed.
+
+    Args:
+        db: Database instance
+        name: Lease name
+        owner: Identifier of the worker asking for the lease
+        seconds: Lease duration
+
+    Returns:
+        True if owner holds the lease
+    """
+    now = datetime.utcnow()
+    try:
+        lease = await db[LOCKS_COLLECTION].find_one_and_update(
+            {"_id": name, "$or": [{"expires_at": {"$lt": now}}, {"owner": owner}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=seconds)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        return False  # Held by another worker
+    return lease is not None and lease.get("owner") == owner
+
+
+def overdue_classes_query(now: datetime, grace_minutes: int) -> Dict:
+    """
+    Filter for auto-closing active classes whose scheduled duration plus grace has passed.
+
+    The range on schedule_time uses the (is_active, schedule_time) index; the
+    exact deadline counts duration_minutes from schedule_time or from
+    activated_at, whichever is later.
+
+    Args:
+        now: Current time
+        grace_minutes: Minutes a class may overrun its duration
+
+    Returns:
+        Query for the classes collection
+    """
+    cutoff = now - timedelta(minutes=grace_minutes)
+    started = {"$max": ["$schedule_time", {"$ifNull": ["$activated_at", "$schedule_time"]}]}
+    return {
+        "is_active": True,
+        "schedule_time": {"$lt": cutoff},
+        "auto_close": {"$ne": False},
+        "$expr": {"$lt": [
+            {"$add": [started, {"$multiply": ["$duration_minutes", 60_000]}]},
+            cutoff
+        ]}
+    }
+
+
+def idle_sessions_query(cutoff: datetime) -> Dict:
+    """
+    Filter for open attendance sessions with no tick since cutoff.
+
+    Args:
+        cutoff: Sessions last active before this time are idle
+
+    Returns:
+        Query for the attendance collection
+    """
+    status = AttendanceStatus.IN_PROGRESS.value
+    return {"$or": [
+        {"status": status, "last_frame_timestamp": {"$lt": cutoff}},
+        {"status": status, "last_frame_timestamp": None, "started_at": {"$lt": cutoff}}
+    ]}
+
+
+class SessionSweeper:
+    """
+    Periodically closes overdue classes and finalizes abandoned attendance sessions.
+
+    Every interval_seconds the sweeper closes up to batch_size active
+    classes past their scheduled duration plus grace (unless they opted out
+    with auto_close=False) and finalizes their open attendance. It then
+    selects up to batch_size open sessions idle for longer than
+    idle_timeout_seconds and closes them the same way. Final statuses are
+    broadcast once per class. A sweep that hits a cap leaves the rest for
+    the next cycle.
+
+    Every worker runs a sweeper, but a sweep only runs while its worker
+    holds the session_sweeper lease in maintenance_locks, so workers do not
+    finalize the same sessions concurrently. Each worker still evicts its
+    own in-memory state of sessions idle for idle_timeout_seconds every
+    interval, whether or not it holds the lease.
+    """
+
+    def __init__(
+        self,
+        interval_seconds: float,
+        idle_timeout_seconds: int,
+        batch_size: int,
+        auto_close_grace_minutes: Optional[int],
+        attendance_manager: AttendanceManager,
+        connection_manager: ConnectionManager
+    ):
+        """Initialize the sweeper (sweeping starts with start(); no auto-close if grace is None)."""
+        self.interval_seconds = interval_seconds
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self.batch_size = batch_size
+        self.auto_close_grace_minutes = auto_close_grace_minutes
+        self.attendance_manager = attendance_manager
+        self.connection_manager = connection_manager
+        self._sweep_task: Optional[asyncio.Task] = None
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.sweeps = 0
+        self.lease_skips = 0
+        self.classes_closed = 0
+        self.finalized = 0
+        self.evicted = 0
+        self.capped_sweeps = 0
+        logger.info(f"✓ Session sweeper initialized (interval={interval_seconds}s, "
+                    f"idle timeout={idle_timeout_seconds}s)")
+
+    @property
+    def enabled(self) -> bool:
+        """Whether the sweeper runs."""
+        return self.interval_seconds > 0
+
+    async def close_overdue_classes(self, db) -> List[Dict]:
+        """
+        Close one batch of overdue classes and finalize their attendance.
+
+        Args:
+            db: Database instance
+
+        Returns:
+            Final status of each attendance record closed, including its class_id
+        """
+        if self.auto_close_grace_minutes is None:
+            return []
+
+        now = datetime.utcnow()
+        cursor = db.classes.find(
+            overdue_classes_query(now, self.auto_close_grace_minutes),
+            {"_id": 1, "class_id": 1}
+        ).limit(self.batch_size)
+        overdue = await cursor.to_list(length=self.batch_size)
+        if not overdue:
+            return []
+
+        await db.classes.update_many(
+            {"_id": {"$in": [doc["_id"] for doc in overdue]}, "is_active": True},
+            {"$set": {"is_active": False, "is_finished": True, "ended_at": now, "auto_closed": True}}
+        )
+
+        class_ids = [doc["class_id"] for doc in overdue]
+        session_state = self.attendance_manager.session_state
+        keys = [key for class_id in class_ids for key in session_state.keys_for_class(class_id)]
+        finalized = await self.attendance_manager.finalize_sessions(
+            {"class_id": {"$in": class_ids}}, keys, db
+        )
+
+        self.classes_closed += len(overdue)
+        if len(overdue) >= self.batch_size:
+            self.capped_sweeps += 1
+        logger.info(f"✓ Auto-closed {len(overdue)} overdue class(es): {', '.join(class_ids)}")
+        return finalized
+
+    async def sweep(self, db) -> int:
+        """
+        Close overdue classes, then finalize one batch of idle sessions.
+
+        Args:
+            db: Database instance
+
+        Returns:
+            Number of attendance sessions finalized
+        """
+        finalized: List[Dict] = await self.close_overdue_classes(db)
+
+        cutoff = datetime.utcnow() - timedelta(seconds=self.idle_timeout_seconds)
+        manager = self.attendance_manager
+
+        cursor = db.attendance.find(
+            idle_sessions_query(cutoff),
+            {"_id": 1, "session_id": 1, "student_id": 1}
+        ).limit(self.batch_size)
+        candidates = await cursor.to_list(length=self.batch_size)
+
+        # Ticks buffered in memory may be newer than what MongoDB has seen
+        stale = [
+            doc for doc in candidates
+            if (manager.last_activity(doc["session_id"], doc["student_id"]) or cutoff) <= cutoff
+        ]
+
+        if stale:
+            finalized += await manager.finalize_sessions(
+                {"_id": {"$in": [doc["_id"] for doc in stale]}},
+                [(doc["session_id"], doc["student_id"]) for doc in stale],
+                db
+            )
+
+        by_class: Dict[str, List[Dict]] = defaultdict(list)
+        for entry in finalized:
+            by_class[entry["class_id"]].append(entry)
+        for class_id, statuses in by_class.items():
+            await self.connection_manager.broadcast_attendance_statuses(class_id, statuses)
+
+        self.sweeps += 1
+        self.finalized += len(finalized)
+        if len(candidates) >= self.batch_size:
+            self.capped_sweeps += 1
+        if finalized:
+            logger.info(f"✓ Session sweep finalized {len(finalized)} idle session(s)")
+        return len(finalized)
+
+    def evict_idle(self) -> int:
+        """
+        Drop this worker's in-memory state of sessions idle past the timeout.
+
+        Returns:
+            Number of entries evicted
+        """
+        evicted = self.attendance_manager.evict_idle_sessions(self.idle_timeout_seconds)
+        self.evicted += evicted
+        if evicted:
+            logger.info(f"✓ Evicted {evicted} idle session entries from memory")
+        return evicted
+
+    async def _sweep_loop(self):
+        """Sweep every interval until cancelled."""
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                # Per-worker memory, so not behind the lease
+                self.evict_idle()
+                db = get_database()
+                # Held across a few intervals so a dead worker's lease soon expires
+                if not await acquire_lease(db, "session_sweeper", self.owner, self.interval_seconds * 3):
+                    self.lease_skips += 1
+                    continue
+                await self.sweep(db)
+            except Exception as e:
+                logger.error(f"Error sweeping idle attendance sessions: {e}")
+
+    def start(self):
+        """Start the background sweep task (no-op when disabled)."""
+        if not self.enabled or self._sweep_task is not None:
+            return
+        self._sweep_task = asyncio.create_task(self._sweep_loop())
+        logger.info("✓ Session sweeper started")
+
+    async def stop(self):
+        """Stop the background sweep task."""
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            try:
+                await self._sweep_task
+            except asyncio.CancelledError:
+                pass
+            self._sweep_task = None
+
+    def get_stats(self) -> Dict[str, int]:
+        """Sweep counters, for monitoring."""
+        return {
+            "sweeps": self.sweeps,
+            "classes_closed": self.classes_closed,
+            "finalized": self.finalized,
+            "evicted": self.evicted,
+            "capped_sweeps": self.capped_sweeps,
+            "lease_skips": self.lease_skips
+        }
+
+
+# Global session sweeper instance
+session_sweeper = SessionSweeper(
+    interval_seconds=settings.session_sweep_interval_seconds,
+    idle_timeout_seconds=settings.session_idle_timeout_seconds,
+    batch_size=settings.session_sweep_batch_size,
+    auto_close_grace_minutes=(
+        settings.class_auto_close_grace_minutes if settings.class_auto_close_enabled else None
+    ),
+    attendance_manager=get_attendance_manager(),
+    connection_manager=get_connection_manager()
+)
+
+
+def get_session_sweeper() -> SessionSweeper:
+    """
+    Get the global session sweeper instance.
+    Used for dependency injection.
+
+    Returns:
+        SessionSweeper instance
+    """
+    return session_sweeper
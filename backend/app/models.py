@@ -86,6 +86,7 @@ class Class(BaseModel):
     is_active: bool = Field(default=False, description="Whether class is currently in session")
     is_finished: bool = Field(default=False, description="Whether class has ended")
     ended_at: Optional[datetime] = Field(None, description="When the class ended")
+    auto_close: bool = Field(default=True, description="Close automatically once the scheduled duration has passed")
     created_at: datetime = Field(default_factory=datetime.utcnow)
     enrolled_students: List[str] = Field(default_factory=list, description="List of student IDs")
     # Multi-college fields are now optional (Google Meet style - anyone can join with class ID)
@@ -113,6 +114,7 @@ class ClassCreate(BaseModel):
     description: Optional[str] = None
     schedule_time: datetime
     duration_minutes: int = Field(..., gt=0)
+    auto_close: bool = True
 
 
 class ClassResponse(BaseModel):
@@ -128,6 +130,7 @@ class ClassResponse(BaseModel):
     is_active: bool
     is_finished: Optional[bool] = False
     ended_at: Optional[datetime] = None
+    auto_close: bool = True
     enrolled_students: List[str]
     created_at: datetime
 
@@ -152,6 +155,11 @@ class Attendance(BaseModel):
     ended_at: Optional[datetime] = None
     total_class_duration_seconds: int = Field(default=0, description="Expected class duration")
     engagement_duration_seconds: int = Field(default=0, description="Time student was engaged")
+    engagement_bitmap: Optional[List[int]] = Field(
+        default=None,
+        exclude=True,
+        description="Per-second engagement since started_at, packed in 32-bit words (see app.engagement_bitmap)"
+    )
     
     # Real-time tracking (from browser-side face detection)
     last_frame_timestamp: Optional[datetime] = None
@@ -210,6 +218,16 @@ class AttendanceMetadata(BaseModel):
     detection_method: str = Field(default="face-api.js", description="Face detection library used")
 
 
+class AttendanceMetadataBatch(BaseModel):
+    """
+    Schema for submitting several buffered metadata ticks in one request.
+
+    Ticks are applied in the order given; each tick's timestamp is used to
+    compute its engagement increment.
+    """
+    ticks: List[AttendanceMetadata] = Field(..., min_length=1, max_length=500, description="Ordered metadata ticks")
+
+
 class EngagementUpdate(BaseModel):
     """Real-time engagement update for WebSocket."""
     student_id: str
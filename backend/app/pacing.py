@@ -0,0 +1,233 @@
+"""
+Adaptive tick pacing.
+Computes the next_interval_ms hint returned to clients from current server
+load, and remembers what each session was told so engagement accounting
+can follow the interval the client actually uses. The resulting cap is
+also stored on the attendance record, for ticks served by other workers.
+"""
+
+import asyncio
+import time
+from typing import Dict, Optional, Tuple
+from app.config import settings
+from app.face_analysis import FaceAnalysisExecutor, get_face_analysis_executor
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Seconds between event loop lag samples
+LAG_SAMPLE_SECONDS = 0.5
+
+# Extra seconds credited on top of the advertised interval (network jitter)
+INCREMENT_GRACE_SECONDS = 2.0
+
+
+class _Advertised:
+    """Interval most recently advertised to one session."""
+
+    __slots__ = ("class_id", "interval_ms", "previous_ms", "last_seen", "stored_ms")
+
+    def __init__(self, class_id: str, interval_ms: int):
+        self.class_id = class_id
+        self.interval_ms = interval_ms
+        self.previous_ms = interval_ms
+        self.last_seen = time.monotonic()
+        # Interval whose cap was last stored on the attendance record
+        self.stored_ms: Optional[int] = None
+
+
+class TickPacer:
+    """
+    Chooses the tick interval clients are asked to use.
+
+    The interval starts at base_interval_ms and is stretched by the worst of
+    three pressures, each 1.0 at its budget: event loop lag against
+    lag_budget_ms, face analysis queue depth (half full = 1.0), and class
+    size against class_size_reference. It never exceeds max_interval_ms.
+    """
+
+    def __init__(
+        self,
+        base_interval_ms: int,
+        max_interval_ms: int,
+        lag_budget_ms: float,
+        class_size_reference: int,
+        face_analyzer: FaceAnalysisExecutor
+    ):
+        """Initialize the pacer (lag sampling starts with start())."""
+        self.base_interval_ms = base_interval_ms
+        self.max_interval_ms = max(base_interval_ms, max_interval_ms)
+        self.lag_budget_ms = lag_budget_ms
+        self.class_size_reference = class_size_reference
+        self.face_analyzer = face_analyzer
+        self.loop_lag_ms = 0.0
+        self._sessions: Dict[Tuple[str, str], _Advertised] = {}
+        self._class_sizes: Dict[str, int] = {}
+        self._monitor_task: Optional[asyncio.Task] = None
+        logger.info(f"✓ Tick pacer initialized (base={base_interval_ms}ms, max={self.max_interval_ms}ms)")
+
+    def interval_ms(self, class_id: str) -> int:
+        """
+        Compute the interval for a class under current load.
+
+        Args:
+            class_id: Class identifier
+
+        Returns:
+            Interval in milliseconds
+        """
+        executor = self.face_analyzer
+        pressure = max(
+            1.0,
+            self.loop_lag_ms / self.lag_budget_ms if self.lag_budget_ms > 0 else 0.0,
+            2 * executor.pending / executor.max_pending if executor.max_pending > 0 else 0.0,
+            self._class_sizes.get(class_id, 0) / self.class_size_reference if self.class_size_reference > 0 else 0.0
+        )
+        return min(self.max_interval_ms, int(self.base_interval_ms * pressure))
+
+    def advertise(self, class_id: str, session_id: Optional[str], student_id: str) -> int:
+        """
+        Compute the interval for a session and remember that it was advertised.
+
+        Args:
+            class_id: Class identifier
+            session_id: Attendance session (None to compute without recording)
+            student_id: Student's user ID
+
+        Returns:
+            Interval in milliseconds
+        """
+        interval = self.interval_ms(class_id)
+        if session_id is None:
+            return interval
+
+        key = (session_id, student_id)
+        entry = self._sessions.get(key)
+        if entry is None:
+            self._sessions[key] = _Advertised(class_id, interval)
+            self._class_sizes[class_id] = self._class_sizes.get(class_id, 0) + 1
+        else:
+            # The tick in flight was paced by the interval advertised before
+            entry.previous_ms = entry.interval_ms
+            entry.interval_ms = interval
+            entry.last_seen = time.monotonic()
+        return interval
+
+    def max_increment(self, session_id: str, student_id: str) -> float:
+        """
+        Maximum engagement seconds to credit for one tick of a session.
+
+        Follows the longest interval recently advertised to the session, so a
+        client obeying a stretched interval is still credited in full.
+
+        Args:
+            session_id: Session identifier
+            student_id: Student's user ID
+
+        Returns:
+            Seconds
+        """
+        entry = self._sessions.get((session_id, student_id))
+        interval = max(entry.interval_ms, entry.previous_ms) if entry else self.base_interval_ms
+        return interval / 1000 + INCREMENT_GRACE_SECONDS
+
+    def claim_store(self, session_id: str, student_id: str) -> Optional[float]:
+        """
+        Get a session's max_increment if it changed since it was last stored.
+
+        Workers only know the intervals they advertised themselves, so the
+        cap is stored on the attendance record for ticks served elsewhere.
+        Nothing is stored while the session is paced at the base interval.
+
+        Args:
+            session_id: Session identifier
+            student_id: Student's user ID
+
+        Returns:
+            Seconds to store, or None if the stored value is current
+        """
+        entry = self._sessions.get((session_id, student_id))
+        if entry is None:
+            return None
+        interval = max(entry.interval_ms, entry.previous_ms)
+        if interval == (entry.stored_ms or self.base_interval_ms):
+            return None
+        entry.stored_ms = interval
+        return interval / 1000 + INCREMENT_GRACE_SECONDS
+
+    def forget(self, session_id: str, student_id: str):
+        """Drop pacing state for a session (e.g. when it ends)."""
+        entry = self._sessions.pop((session_id, student_id), None)
+        if entry is not None:
+            self._release_class_slot(entry.class_id)
+
+    def _release_class_slot(self, class_id: str):
+        remaining = self._class_sizes.get(class_id, 0) - 1
+        if remaining > 0:
+            self._class_sizes[class_id] = remaining
+        else:
+            self._class_sizes.pop(class_id, None)
+
+    def _prune(self):
+        """Forget sessions that stopped ticking."""
+        cutoff = time.monotonic() - 3 * self.max_interval_ms / 1000
+        for key in [key for key, entry in self._sessions.items() if entry.last_seen < cutoff]:
+            self.forget(*key)
+
+    async def _monitor_loop(self):
+        """Sample event loop lag and prune idle sessions until cancelled."""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LAG_SAMPLE_SECONDS)
+            lag_ms = max(0.0, (loop.time() - started - LAG_SAMPLE_SECONDS) * 1000)
+            # Smooth out single slow iterations
+            self.loop_lag_ms = 0.7 * self.loop_lag_ms + 0.3 * lag_ms
+            self._prune()
+
+    def start(self):
+        """Start sampling event loop lag."""
+        if self._monitor_task is None:
+            self._monitor_task = asyncio.create_task(self._monitor_loop())
+            logger.info("✓ Tick pacer started")
+
+    async def stop(self):
+        """Stop sampling event loop lag."""
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            try:
+                await self._monitor_task
+            except asyncio.CancelledError:
+                pass
+            self._monitor_task = None
+
+    def get_stats(self) -> Dict:
+        """Current load signals and tracked sessions, for monitoring."""
+        return {
+            "loop_lag_ms": round(self.loop_lag_ms, 3),
+            "sessions": len(self._sessions),
+            "classes": len(self._class_sizes),
+            "base_interval_ms": self.base_interval_ms,
+            "max_interval_ms": self.max_interval_ms
+        }
+
+
+# Global tick pacer instance
+tick_pacer = TickPacer(
+    base_interval_ms=settings.frame_interval_seconds * 1000,
+    max_interval_ms=settings.tick_interval_max_ms,
+    lag_budget_ms=settings.tick_lag_budget_ms,
+    class_size_reference=settings.tick_class_size_reference,
+    face_analyzer=get_face_analysis_executor()
+)
+
+
+def get_tick_pacer() -> TickPacer:
+    """
+    Get the global tick pacer instance.
+    Used for dependency injection.
+
+    Returns:
+        TickPacer instance
+    """
+    return tick_pacer
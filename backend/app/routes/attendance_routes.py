@@ -3,18 +3,23 @@ API routes for attendance tracking and reporting.
 Handles frame processing, attendance sessions, and report generation.
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status, WebSocket, WebSocketDisconnect
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, Request, Header, Query
+from typing import List, Optional, Dict
 from app.models import (
     AttendanceStart, FrameData, AttendanceReport,
-    Attendance, EngagementUpdate, User, AttendanceMetadata
+    Attendance, EngagementUpdate, User, UserRole, AttendanceMetadata,
+    AttendanceMetadataBatch
 )
 from app.auth import get_current_student, get_current_teacher, get_current_user
 from app.database import get_db
-from app.face_detection import get_face_detector
+from app.config import settings
+from app.face_analysis import get_face_analysis_executor, FaceAnalysisUnavailable
 from app.attendance import get_attendance_manager
-from app.websocket import get_connection_manager
+from app.websocket import get_connection_manager, decode_tick_frame, encode_ack_frame
+from pydantic import ValidationError
 from datetime import datetime
+import json
+import struct
 import logging
 
 logger = logging.getLogger(__name__)
@@ -112,52 +117,200 @@ async def process_frame(
             detail="Cannot submit frames for another student"
         )
     
-    # Process frame
-    face_detector = get_face_detector()
+    # Process frame (analysis runs in the face analysis worker pool)
     attendance_manager = get_attendance_manager()
     
-    result = await attendance_manager.process_frame(
-        frame_data=frame_data,
-        face_detector=face_detector,
-        db=db
-    )
+    try:
+        result = await attendance_manager.process_frame(
+            frame_data=frame_data,
+            face_analyzer=get_face_analysis_executor(),
+            db=db
+        )
+    except FaceAnalysisUnavailable as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "1"}
+        )
     
-    if not result.get("success"):
+    return await _frame_response(result, frame_data.session_id, current_user, db)
+
+
+@router.post("/frame/{session_id}", response_model=dict)
+async def process_frame_binary(
+    session_id: str,
+    request: Request,
+    x_student_id: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_student),
+    db=Depends(get_db)
+):
+    """
+    Process a webcam frame uploaded as raw image bytes.
+    
+    Avoids the base64/JSON overhead of POST /attendance/frame. The body is
+    either the encoded image itself (Content-Type: application/octet-stream
+    or image/jpeg) or a multipart form with the image in a "frame" field.
+    
+    Args:
+        session_id: Session identifier
+        request: Incoming request carrying the image body
+        x_student_id: Optional X-Student-ID header; must match the caller
+        current_user: Authenticated student
+        db: Database instance
+        
+    Returns:
+        Analysis results and updated engagement metrics
+    """
+    # Verify student owns this session
+    if x_student_id is not None and x_student_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Cannot submit frames for another student"
+        )
+    
+    # Reject oversized uploads before reading any of the body
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.max_frame_upload_bytes:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Frame too large"
+        )
+    
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        # Forms are parsed as a whole, so their size must be known up front
+        if not (content_length and content_length.isdigit()):
+            raise HTTPException(
+                status_code=status.HTTP_411_LENGTH_REQUIRED,
+                detail="Content-Length required for multipart uploads"
+            )
+        form = await request.form()
+        upload = form.get("frame")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Missing frame file"
+            )
+        frame_bytes = await upload.read()
+    else:
+        frame_bytes = await _read_body_limited(request, settings.max_frame_upload_bytes)
+    
+    if not frame_bytes:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=result.get("message", "Failed to process frame")
+            detail="Empty frame"
         )
     
-    # Get attendance record to find class_id
-    attendance_doc = await db.attendance.find_one({
-        "session_id": frame_data.session_id,
-        "student_id": frame_data.student_id
-    })
+    if len(frame_bytes) > settings.max_frame_upload_bytes:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Frame too large"
+        )
     
-    if attendance_doc:
-        # Broadcast real-time update via WebSocket
-        connection_manager = get_connection_manager()
-        engagement_update = EngagementUpdate(
+    # Process frame (analysis runs in the face analysis worker pool)
+    attendance_manager = get_attendance_manager()
+    
+    try:
+        result = await attendance_manager.process_frame_bytes(
+            session_id=session_id,
             student_id=current_user.id,
-            student_name=current_user.name,
-            is_face_detected=result["face_detected"],
-            is_looking_at_screen=result["looking_at_screen"],
-            engagement_percentage=result["engagement_percentage"],
-            last_update=datetime.utcnow()
+            frame_bytes=frame_bytes,
+            face_analyzer=get_face_analysis_executor(),
+            db=db
+        )
+    except FaceAnalysisUnavailable as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "1"}
         )
+    
+    return await _frame_response(result, session_id, current_user, db)
+
+
+async def _read_body_limited(request: Request, limit: int) -> bytes:
+    """
+    Read a request body, stopping as soon as it exceeds limit bytes.
+    
+    Args:
+        request: Incoming request
+        limit: Maximum body size in bytes
         
-        await connection_manager.broadcast_engagement_update(
-            class_id=attendance_doc["class_id"],
-            engagement_update=engagement_update
+    Returns:
+        Body bytes
+        
+    Raises:
+        HTTPException: If the body is larger than limit
+    """
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail="Frame too large"
+            )
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def _frame_response(result: Dict, session_id: str, current_user: User, db) -> Dict:
+    """
+    Broadcast a processed frame's engagement update and build the response.
+    
+    Args:
+        result: Result from AttendanceManager frame processing
+        session_id: Session identifier
+        current_user: Authenticated student
+        db: Database instance
+        
+    Returns:
+        Analysis results and updated engagement metrics
+        
+    Raises:
+        HTTPException: If the frame could not be processed
+    """
+    if not result.get("success"):
+        raise HTTPException(
+            # A newer frame replaced this one before any result was known
+            status_code=status.HTTP_409_CONFLICT if result.get("superseded") else status.HTTP_400_BAD_REQUEST,
+            detail=result.get("message", "Failed to process frame")
         )
     
-    return {
+    response = {
         "message": "Frame processed successfully",
         "face_detected": result["face_detected"],
         "looking_at_screen": result["looking_at_screen"],
         "engagement_percentage": result["engagement_percentage"],
-        "engagement_seconds": result["engagement_seconds"]
+        "engagement_seconds": result["engagement_seconds"],
+        "next_interval_ms": await get_attendance_manager().next_interval_ms(
+            result["class_id"], session_id, current_user.id, db
+        )
     }
+    if result.get("superseded"):
+        # Last known result; it was already broadcast when it was computed
+        response["message"] = "Frame superseded by a newer frame"
+        response["superseded"] = True
+        return response
+    
+    # Broadcast real-time update via WebSocket
+    connection_manager = get_connection_manager()
+    engagement_update = EngagementUpdate(
+        student_id=current_user.id,
+        student_name=current_user.name,
+        is_face_detected=result["face_detected"],
+        is_looking_at_screen=result["looking_at_screen"],
+        engagement_percentage=result["engagement_percentage"],
+        last_update=datetime.utcnow()
+    )
+    
+    await connection_manager.broadcast_engagement_update(
+        class_id=result["class_id"],
+        engagement_update=engagement_update
+    )
+    
+    return response
 
 
 @router.post("/metadata", response_model=dict)
@@ -193,11 +346,9 @@ async def process_metadata(
             detail="Cannot submit metadata for another student"
         )
     
-    # Find attendance record
-    attendance_doc = await db.attendance.find_one({
-        "session_id": metadata.session_id,
-        "student_id": metadata.student_id
-    })
+    # Apply tick to the attendance session (buffered in memory)
+    attendance_manager = get_attendance_manager()
+    attendance_doc = await attendance_manager.process_metadata(metadata=metadata, db=db)
     
     if not attendance_doc:
         raise HTTPException(
@@ -205,42 +356,11 @@ async def process_metadata(
             detail="Attendance session not found"
         )
     
-    # Calculate engagement time increment
-    current_time = datetime.utcnow()
-    last_frame_time = attendance_doc.get("last_frame_timestamp")
-    time_increment = 0
-    
-    if last_frame_time:
-        time_diff = (current_time - last_frame_time).total_seconds()
-        # Only count time if face is detected
-        # Cap at reasonable interval to prevent manipulation
-        if metadata.face_detected:
-            time_increment = min(time_diff, 5)  # Max 5 seconds per update
-    
-    # Update engagement metrics
-    new_engagement_seconds = attendance_doc["engagement_duration_seconds"] + time_increment
-    total_duration = attendance_doc["total_class_duration_seconds"]
-    engagement_percentage = (new_engagement_seconds / total_duration * 100) if total_duration > 0 else 0
-    
-    # Combine attention score with presence tracking
-    # Weight: 70% presence time, 30% attention quality
-    weighted_score = engagement_percentage * 0.7 + (metadata.attention_score * time_increment / max(total_duration, 1)) * 0.3
-    
-    # Update database
-    update_data = {
-        "last_frame_timestamp": current_time,
-        "is_face_detected": metadata.face_detected,
-        "is_looking_at_screen": metadata.attention_score > 50,  # Estimate from attention score
-        "engagement_duration_seconds": new_engagement_seconds,
-        "engagement_percentage": round(min(engagement_percentage, 100), 2),
-        "attention_score": metadata.attention_score,
-        "multiple_faces_detected": metadata.multiple_faces
-    }
-    
-    await db.attendance.update_one(
-        {"_id": attendance_doc["_id"]},
-        {"$set": update_data}
-    )
+    engagement_percentage = attendance_doc["engagement_percentage"]
+    new_engagement_seconds = attendance_doc["engagement_duration_seconds"]
+    current_time = attendance_doc["last_frame_timestamp"]
+    # The record's class, not the one claimed by the client
+    class_id = attendance_doc["class_id"]
     
     # Broadcast engagement update via WebSocket (for teacher dashboard)
     connection_manager = get_connection_manager()
@@ -248,13 +368,13 @@ async def process_metadata(
         student_id=current_user.id,
         student_name=current_user.name,
         is_face_detected=metadata.face_detected,
-        is_looking_at_screen=metadata.attention_score > 50,
-        engagement_percentage=round(min(engagement_percentage, 100), 2),
+        is_looking_at_screen=attendance_doc["is_looking_at_screen"],
+        engagement_percentage=engagement_percentage,
         last_update=current_time
     )
     
     await connection_manager.broadcast_engagement_update(
-        class_id=metadata.class_id,
+        class_id=class_id,
         engagement_update=engagement_update
     )
     
@@ -266,8 +386,96 @@ async def process_metadata(
         "message": "Metadata processed successfully",
         "face_detected": metadata.face_detected,
         "attention_score": metadata.attention_score,
-        "engagement_percentage": round(min(engagement_percentage, 100), 2),
-        "engagement_seconds": new_engagement_seconds
+        "engagement_percentage": engagement_percentage,
+        "engagement_seconds": new_engagement_seconds,
+        "next_interval_ms": await attendance_manager.next_interval_ms(
+            class_id, metadata.session_id, current_user.id, db
+        )
+    }
+
+
+@router.post("/metadata/batch", response_model=dict)
+async def process_metadata_batch(
+    batch: AttendanceMetadataBatch,
+    current_user: User = Depends(get_current_user),
+    db=Depends(get_db)
+):
+    """
+    Process several buffered metadata ticks in one request.
+    
+    Ticks are applied in order with a single database read and a single
+    bulk write, so clients that buffer ticks can cut request volume
+    substantially. Each tick gets its own result; a failing tick does not
+    fail the batch.
+    
+    Students may only submit their own ticks. Teachers may submit ticks for
+    several students at once (e.g. from a classroom gateway), limited to
+    students attending their own classes.
+    
+    Args:
+        batch: Ordered metadata ticks
+        current_user: Authenticated student or teacher
+        db: Database instance
+        
+    Returns:
+        Per-tick results in input order
+    """
+    attendance_manager = get_attendance_manager()
+    if current_user.role == UserRole.TEACHER:
+        taught = await db.classes.distinct("class_id", {
+            "teacher_id": current_user.id,
+            "class_id": {"$in": list({tick.class_id for tick in batch.ticks})}
+        })
+        results, updated_docs = await attendance_manager.process_metadata_batch(
+            ticks=batch.ticks,
+            db=db,
+            class_ids=set(taught)
+        )
+    else:
+        results, updated_docs = await attendance_manager.process_metadata_batch(
+            ticks=batch.ticks,
+            db=db,
+            student_id=current_user.id
+        )
+    
+    # Broadcast only the latest state of each updated record
+    connection_manager = get_connection_manager()
+    for doc in updated_docs:
+        engagement_update = EngagementUpdate(
+            student_id=doc["student_id"],
+            student_name=doc["student_name"],
+            is_face_detected=doc["is_face_detected"],
+            is_looking_at_screen=doc["is_looking_at_screen"],
+            engagement_percentage=doc["engagement_percentage"],
+            last_update=doc["last_frame_timestamp"]
+        )
+        await connection_manager.broadcast_engagement_update(
+            class_id=doc["class_id"],
+            engagement_update=engagement_update
+        )
+    
+    processed = sum(1 for r in results if r["success"])
+    logger.debug(f"Metadata batch from {current_user.role.value} {current_user.id}: "
+                f"{processed}/{len(results)} ticks applied")
+    
+    # Pace by the class on the last tick's record; without one, don't record the hint
+    last_tick = batch.ticks[-1]
+    last_doc = next(
+        (doc for doc in updated_docs
+         if doc["session_id"] == last_tick.session_id and doc["student_id"] == last_tick.student_id),
+        None
+    )
+    return {
+        "message": "Metadata batch processed",
+        "processed": processed,
+        "failed": len(results) - processed,
+        "results": results,
+        "next_interval_ms": await attendance_manager.next_interval_ms(
+            last_doc["class_id"] if last_doc else last_tick.class_id,
+            last_tick.session_id if last_doc else None,
+            last_tick.student_id,
+            db
+        )
     }
 
 
@@ -372,6 +580,130 @@ async def get_attendance_report(
     return report
 
 
+@router.get("/timeline/{class_id}/{session_id}", response_model=dict)
+async def get_engagement_timeline(
+    class_id: str,
+    session_id: str,
+    resolution_seconds: int = Query(60, ge=1, le=3600, description="Bucket size in seconds"),
+    student_id: Optional[str] = Query(None, description="Restrict to one student"),
+    current_user: User = Depends(get_current_teacher),
+    db=Depends(get_db)
+):
+    """
+    Get downsampled engagement time series for a class session (teacher only).
+    
+    Each point summarises the ticks in one bucket: how many there were and
+    what fraction were engaged, had a face detected or were looking at the
+    screen, plus the average attention score.
+    
+    Args:
+        class_id: Class identifier
+        session_id: Session identifier
+        resolution_seconds: Bucket size in seconds
+        student_id: Restrict to one student (optional)
+        current_user: Authenticated teacher
+        db: Database instance
+        
+    Returns:
+        Per-student series of engagement points
+        
+    Raises:
+        HTTPException: If class not found or unauthorized
+    """
+    # Verify class exists and teacher owns it
+    class_doc = await db.classes.find_one({"class_id": class_id})
+    
+    if not class_doc:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Class not found"
+        )
+    
+    if class_doc["teacher_id"] != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to view this timeline"
+        )
+    
+    attendance_manager = get_attendance_manager()
+    series = await attendance_manager.get_engagement_timeline(
+        class_id=class_id,
+        session_id=session_id,
+        resolution_seconds=resolution_seconds,
+        db=db,
+        student_id=student_id
+    )
+    
+    return {
+        "class_id": class_id,
+        "session_id": session_id,
+        "resolution_seconds": resolution_seconds,
+        "series": series
+    }
+
+
+@router.get("/engagement/{class_id}/{session_id}", response_model=dict)
+async def get_class_engagement(
+    class_id: str,
+    session_id: str,
+    resolution_seconds: int = Query(60, ge=1, le=3600, description="Bucket size of the coverage curve"),
+    at: Optional[datetime] = Query(None, description="Also report who was engaged at this time"),
+    current_user: User = Depends(get_current_teacher),
+    db=Depends(get_db)
+):
+    """
+    Get class-wide engagement for a session from per-second bitmaps (teacher only).
+    
+    Returns the average number of engaged students per bucket, the seconds
+    in which any / every student was engaged, engaged seconds per student
+    and, with ?at=, which students were engaged at that moment.
+    
+    Args:
+        class_id: Class identifier
+        session_id: Session identifier
+        resolution_seconds: Bucket size of the coverage curve
+        at: Time to look up (optional)
+        current_user: Authenticated teacher
+        db: Database instance
+        
+    Returns:
+        Class engagement summary
+        
+    Raises:
+        HTTPException: If class not found or unauthorized
+    """
+    # Verify class exists and teacher owns it
+    class_doc = await db.classes.find_one({"class_id": class_id})
+    
+    if not class_doc:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Class not found"
+        )
+    
+    if class_doc["teacher_id"] != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to view this class"
+        )
+    
+    attendance_manager = get_attendance_manager()
+    summary = await attendance_manager.get_class_engagement(
+        class_id=class_id,
+        session_id=session_id,
+        resolution_seconds=resolution_seconds,
+        db=db,
+        at=at
+    )
+    
+    return {
+        "class_id": class_id,
+        "session_id": session_id,
+        "resolution_seconds": resolution_seconds,
+        **summary
+    }
+
+
 @router.get("/student/{student_id}", response_model=List[dict])
 async def get_student_attendance_history(
     student_id: str,
@@ -419,11 +751,84 @@ async def get_student_attendance_history(
     return formatted_records
 
 
+async def _process_student_tick(
+    tick: Dict,
+    session_id: Optional[str],
+    class_id: str,
+    user_doc: Dict,
+    db
+) -> Dict:
+    """
+    Apply one engagement tick received over a student's WebSocket.
+    
+    Args:
+        tick: Decoded tick (JSON or binary frame)
+        session_id: Attendance session bound to the connection, if any
+        class_id: Class the connection belongs to
+        user_doc: Authenticated student
+        db: Database instance
+        
+    Returns:
+        Ack message for the tick
+    """
+    attendance_manager = get_attendance_manager()
+    student_id = str(user_doc["_id"])
+    tick_session_id = tick.get("session_id") or session_id
+    ack = {
+        "type": "ack",
+        "seq": tick.get("seq"),
+        # Not recorded for the session until its record (and class) is known
+        "next_interval_ms": await attendance_manager.next_interval_ms(class_id, None, student_id, db)
+    }
+    
+    try:
+        metadata = AttendanceMetadata(
+            student_id=student_id,
+            class_id=class_id,
+            session_id=tick_session_id,
+            face_detected=tick.get("face_detected"),
+            multiple_faces=tick.get("multiple_faces", False),
+            face_count=tick.get("face_count", 0),
+            attention_score=tick.get("attention_score", 0.0)
+        )
+    except ValidationError:
+        return {**ack, "success": False, "message": "Invalid tick"}
+    
+    attendance_doc = await attendance_manager.process_metadata(metadata=metadata, db=db)
+    if not attendance_doc:
+        return {**ack, "success": False, "message": "Attendance session not found"}
+    
+    # Broadcast engagement update (for teacher dashboard)
+    connection_manager = get_connection_manager()
+    await connection_manager.broadcast_engagement_update(
+        class_id=attendance_doc["class_id"],
+        engagement_update=EngagementUpdate(
+            student_id=attendance_doc["student_id"],
+            student_name=attendance_doc["student_name"],
+            is_face_detected=attendance_doc["is_face_detected"],
+            is_looking_at_screen=attendance_doc["is_looking_at_screen"],
+            engagement_percentage=attendance_doc["engagement_percentage"],
+            last_update=attendance_doc["last_frame_timestamp"]
+        )
+    )
+    
+    return {
+        **ack,
+        "success": True,
+        "next_interval_ms": await attendance_manager.next_interval_ms(
+            attendance_doc["class_id"], tick_session_id, student_id, db
+        ),
+        "engagement_percentage": attendance_doc["engagement_percentage"],
+        "engagement_seconds": attendance_doc["engagement_duration_seconds"]
+    }
+
+
 @router.websocket("/ws/{class_id}")
 async def websocket_endpoint(
     websocket: WebSocket,
     class_id: str,
     token: str,
+    session_id: Optional[str] = None,
     db=Depends(get_db)
 ):
     """
@@ -434,10 +839,18 @@ async def websocket_endpoint(
     
     Teachers connect to monitor student engagement in real-time.
     
+    Students may also use their connection to send engagement ticks instead
+    of calling POST /attendance/metadata for every tick:
+    - JSON: {"type": "tick", "seq": 1, "face_detected": true, "attention_score": 80, ...}
+    - Binary: TICK_FRAME (see app.websocket), bound to the session_id query param
+    Each tick is answered with an ack (JSON or binary, matching the tick)
+    carrying the updated engagement and a next_interval_ms hint.
+    
     Args:
         websocket: WebSocket connection
         class_id: Class identifier to monitor
         token: JWT authentication token
+        session_id: Attendance session for student ticks (optional)
         db: Database instance
     """
     try:
@@ -451,8 +864,12 @@ async def websocket_endpoint(
             await websocket.close(code=1008, reason="Invalid token")
             return
         
-        # Get user from database
-        user_doc = await db.users.find_one({"_id": user_id})
+        # Get user from database (user IDs are stored as ObjectIds)
+        from bson import ObjectId
+        
+        user_doc = None
+        if ObjectId.is_valid(user_id):
+            user_doc = await db.users.find_one({"_id": ObjectId(user_id)})
         
         if not user_doc:
             await websocket.close(code=1008, reason="User not found")
@@ -484,18 +901,56 @@ async def websocket_endpoint(
         
         # Connect to WebSocket manager
         connection_manager = get_connection_manager()
-        await connection_manager.connect(
-            websocket=websocket,
-            class_id=class_id,
-            user_id=user_id,
-            role=user_doc["role"]
-        )
         
-        # Keep connection alive
+        # Keep connection alive; unregistered however the loop ends
+        # (disconnect is a no-op if connect never registered it)
         try:
+            await connection_manager.connect(
+                websocket=websocket,
+                class_id=class_id,
+                user_id=user_id,
+                role=user_doc["role"]
+            )
+            
+            is_student = user_doc["role"] == "student"
+            if is_student:
+                await websocket.send_json({
+                    "type": "config",
+                    "next_interval_ms": await get_attendance_manager().next_interval_ms(
+                        class_id, None, str(user_doc["_id"]), db
+                    )
+                })
+            
             while True:
-                # Wait for client messages (heartbeat, etc.)
-                data = await websocket.receive_text()
+                # Wait for client messages (heartbeat, student ticks)
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(message.get("code", 1000))
+                
+                data = message.get("bytes")
+                if data is not None and is_student:
+                    try:
+                        tick = decode_tick_frame(data)
+                    except struct.error:
+                        await websocket.send_json({"type": "error", "message": "Invalid tick frame"})
+                        continue
+                    ack = await _process_student_tick(tick, session_id, class_id, user_doc, db)
+                    await websocket.send_bytes(encode_ack_frame(
+                        ack["seq"], ack["success"],
+                        ack.get("engagement_percentage", 0.0), ack["next_interval_ms"]
+                    ))
+                    continue
+                
+                text = message.get("text")
+                if text and is_student and text.startswith("{"):
+                    try:
+                        tick = json.loads(text)
+                    except ValueError:
+                        tick = None
+                    if isinstance(tick, dict) and tick.get("type") == "tick":
+                        ack = await _process_student_tick(tick, session_id, class_id, user_doc, db)
+                        await websocket.send_json(ack)
+                        continue
                 
                 # Echo back to confirm connection
                 await websocket.send_json({
@@ -504,8 +959,9 @@ async def websocket_endpoint(
                 })
         
         except WebSocketDisconnect:
-            connection_manager.disconnect(websocket, class_id, user_id)
             logger.info(f"WebSocket disconnected: user={user_id}, class={class_id}")
+        finally:
+            connection_manager.disconnect(websocket, class_id, user_id)
     
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
@@ -9,6 +9,8 @@ from typing import List, Optional
 from app.models import ClassCreate, ClassResponse, Class, User
 from app.auth import get_current_teacher, get_current_student, get_current_user
 from app.database import get_db
+from app.attendance import get_attendance_manager
+from app.websocket import get_connection_manager
 from datetime import datetime
 import uuid
 import logging
@@ -24,6 +26,7 @@ class ClassUpdate(BaseModel):
     description: Optional[str] = None
     schedule_time: Optional[datetime] = None
     duration_minutes: Optional[int] = None
+    auto_close: Optional[bool] = None
 
 
 @router.post("/create", response_model=ClassResponse, status_code=status.HTTP_201_CREATED)
@@ -65,6 +68,7 @@ async def create_class(
         "teacher_name": current_user.name,
         "schedule_time": class_data.schedule_time,
         "duration_minutes": class_data.duration_minutes,
+        "auto_close": class_data.auto_close,
         "is_active": False,
         "enrolled_students": [],
         "created_at": datetime.utcnow(),
@@ -342,10 +346,10 @@ async def activate_class(
     # Generate session ID
     session_id = f"{class_id}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}"
     
-    # Mark class as active
+    # Mark class as active; auto-close counts the duration from here if started late
     await db.classes.update_one(
         {"_id": class_doc["_id"]},
-        {"$set": {"is_active": True}}
+        {"$set": {"is_active": True, "activated_at": datetime.utcnow()}}
     )
     
     logger.info(f"✓ Class {class_id} activated with session {session_id}")
@@ -366,6 +370,9 @@ async def deactivate_class(
     """
     Deactivate a class session (teacher only).
     
+    Also finalizes all attendance records still in progress for the class
+    and broadcasts their final statuses in one WebSocket message.
+    
     Args:
         class_id: Class identifier
         current_user: Authenticated teacher
@@ -399,12 +406,17 @@ async def deactivate_class(
         }}
     )
     
+    # Close every student's open attendance record and announce the results once
+    finalized = await get_attendance_manager().finalize_class_sessions(class_id, db)
+    await get_connection_manager().broadcast_attendance_statuses(class_id, finalized)
+    
     logger.info(f"✓ Class {class_id} deactivated and finished")
     
     return {
         "message": "Class ended",
         "class_id": class_id,
-        "ended_at": ended_at.isoformat()
+        "ended_at": ended_at.isoformat(),
+        "attendance_finalized": len(finalized)
     }
 
 
@@ -454,6 +466,8 @@ async def update_class(
         update_doc["schedule_time"] = class_update.schedule_time
     if class_update.duration_minutes:
         update_doc["duration_minutes"] = class_update.duration_minutes
+    if class_update.auto_close is not None:
+        update_doc["auto_close"] = class_update.auto_close
     
     if not update_doc:
         raise HTTPException(
@@ -0,0 +1,137 @@
+"""
+Bounded registry of active attendance sessions.
+Tracks the last activity of each (session_id, student_id) with a per-entry
+TTL and least-recently-used eviction, so memory stays flat in long-running
+workers even when sessions are never ended explicitly.
+"""
+
+import sys
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+SessionKey = Tuple[str, str]  # (session_id, student_id)
+
+
+class _SessionEntry:
+    """Last activity of one session."""
+
+    __slots__ = ("last_seen", "touched")
+
+    def __init__(self, last_seen: datetime, touched: float):
+        self.last_seen = last_seen  # Activity time reported by the caller
+        self.touched = touched  # time.monotonic() of the last touch, for TTL/LRU
+
+
+class SessionRegistry:
+    """
+    LRU map of (session_id, student_id) to last activity, bounded in size and age.
+
+    Entries are kept in touch order. Entries untouched for ttl_seconds are
+    expired from the old end on every touch (and by expire()); once
+    max_entries is reached, touching a new session evicts the least
+    recently used one.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        """Initialize an empty registry."""
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[SessionKey, _SessionEntry]" = OrderedDict()
+        self.evictions = 0
+        self.expirations = 0
+        logger.info(f"✓ Session registry initialized (max_entries={max_entries}, ttl={ttl_seconds}s)")
+
+    def touch(self, session_id: str, student_id: str, last_seen: Optional[datetime] = None):
+        """
+        Record activity for a session, adding it if needed.
+
+        Args:
+            session_id: Session identifier
+            student_id: Student's user ID
+            last_seen: Activity time (default: now)
+        """
+        key = (session_id, student_id)
+        now = time.monotonic()
+        last_seen = last_seen or datetime.utcnow()
+
+        entry = self._entries.get(key)
+        if entry is None:
+            self._entries[key] = _SessionEntry(last_seen, now)
+        else:
+            entry.last_seen = last_seen
+            entry.touched = now
+            self._entries.move_to_end(key)
+
+        self._expire(now)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def last_seen(self, session_id: str, student_id: str) -> Optional[datetime]:
+        """Last activity time of a live session, or None."""
+        entry = self._entries.get((session_id, student_id))
+        if entry is None or self._is_expired(entry, time.monotonic()):
+            return None
+        return entry.last_seen
+
+    def discard(self, session_id: str, student_id: str):
+        """Forget a session (e.g. when it ends)."""
+        self._entries.pop((session_id, student_id), None)
+
+    def expire(self) -> int:
+        """
+        Remove entries untouched for longer than the TTL.
+
+        Returns:
+            Number of entries removed
+        """
+        return self._expire(time.monotonic())
+
+    def _is_expired(self, entry: _SessionEntry, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - entry.touched > self.ttl_seconds
+
+    def _expire(self, now: float) -> int:
+        # Touch order means the oldest entries are always at the front
+        expired = 0
+        while self._entries:
+            entry = next(iter(self._entries.values()))
+            if not self._is_expired(entry, now):
+                break
+            self._entries.popitem(last=False)
+            expired += 1
+        self.expirations += expired
+        return expired
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: SessionKey) -> bool:
+        return self.last_seen(*key) is not None
+
+    def approximate_bytes(self) -> int:
+        """Rough memory footprint of the registry (container plus one sampled entry per session)."""
+        size = sys.getsizeof(self._entries)
+        if self._entries:
+            key, entry = next(iter(self._entries.items()))
+            per_entry = (
+                sys.getsizeof(key) + sum(sys.getsizeof(part) for part in key)
+                + sys.getsizeof(entry) + sys.getsizeof(entry.last_seen) + sys.getsizeof(entry.touched)
+            )
+            size += per_entry * len(self._entries)
+        return size
+
+    def get_stats(self) -> Dict[str, int]:
+        """Entry count, evictions and memory estimate, for monitoring."""
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "approx_bytes": self.approximate_bytes()
+        }
+
@@ -0,0 +1,455 @@
+"""
+In-memory session state for attendance ticks (write-behind cache).
+Answers engagement ticks from memory and flushes the buffered ticks to
+MongoDB periodically, so per-tick latency does not depend on database round trips.
+"""
+
+import asyncio
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from pymongo import UpdateOne
+from app.config import settings
+from app.database import get_database
+from app.engagement_bitmap import mark_intervals_expr
+from app.models import AttendanceStatus
+import logging
+
+logger = logging.getLogger(__name__)
+
+SessionKey = Tuple[str, str]  # (session_id, student_id)
+Tick = Tuple[datetime, bool, float, Dict[str, Any]]  # (time, engaged, max_increment, fields)
+
+# Status of attendance records that still accept ticks
+IN_PROGRESS = AttendanceStatus.IN_PROGRESS.value
+
+# Record field holding the per-tick cap advertised by any worker (see TickPacer)
+ADVERTISED_INCREMENT_FIELD = "advertised_max_increment"
+
+# The bitmap is only ever updated on the server, so it is not cached
+CACHED_PROJECTION = {"engagement_bitmap": 0}
+
+
+# Aggregation expression recomputing engagement_percentage from the stored totals
+ENGAGEMENT_PERCENTAGE_EXPR = {
+    "$cond": [
+        {"$gt": ["$total_class_duration_seconds", 0]},
+        {"$round": [
+            {"$min": [
+                100,
+                {"$multiply": [
+                    {"$divide": ["$engagement_duration_seconds", "$total_class_duration_seconds"]},
+                    100
+                ]}
+            ]},
+            2
+        ]},
+        0
+    ]
+}
+
+
+def ticks_update_pipeline(ticks: Sequence[Tick]) -> List[Dict]:
+    """
+    Build an update pipeline that credits engagement ticks atomically.
+
+    The ticks are replayed on the server in time order, starting from the
+    stored last_frame_timestamp. Each tick newer than the previous one
+    credits the time since it, capped at its max_increment (or the
+    record's advertised_max_increment, if larger) and only when engaged;
+    ticks that are not newer are ignored. Writers that buffer ticks
+    for the same session (e.g. several gunicorn workers) can therefore
+    flush overlapping ticks without double-crediting time or moving
+    last_frame_timestamp backwards, and re-applying ticks is a no-op.
+    The credited intervals are ORed into engagement_bitmap in the same
+    update. Detection fields are stored from the newest tick if it was
+    applied.
+
+    Args:
+        ticks: (time, engaged, max_increment, fields) of each tick, at least one
+
+    Returns:
+        Update pipeline for update_one/find_one_and_update/bulk_write
+    """
+    ticks = sorted(ticks, key=lambda tick: tick[0])
+    newest_time, _, _, newest_fields = ticks[-1]
+
+    last = "$$value.last"
+    credit = {
+        "$cond": [
+            {"$and": ["$$this.engaged", {"$eq": [{"$type": last}, "date"]}]},
+            {"$max": [
+                0,
+                {"$min": [
+                    {"$divide": [{"$subtract": ["$$this.time", last]}, 1000]},
+                    {"$max": [
+                        "$$this.max_increment",
+                        {"$ifNull": [f"${ADVERTISED_INCREMENT_FIELD}", 0]}
+                    ]}
+                ]}
+            ]},
+            0
+        ]
+    }
+    # Credited seconds, plus the engaged interval they cover for the bitmap
+    apply_tick = {"$let": {
+        "vars": {"credit": credit},
+        "in": {
+            "last": "$$this.time",
+            "seconds": {"$add": ["$$value.seconds", "$$credit"]},
+            "intervals": {"$cond": [
+                {"$gt": ["$$credit", 0]},
+                {"$concatArrays": ["$$value.intervals", [[
+                    {"$subtract": ["$$this.time", {"$multiply": ["$$credit", 1000]}]},
+                    "$$this.time"
+                ]]]},
+                "$$value.intervals"
+            ]}
+        }
+    }}
+    replay = {
+        "$reduce": {
+            "input": {"$literal": [
+                {"time": time, "engaged": engaged, "max_increment": max_increment}
+                for time, engaged, max_increment, _ in ticks
+            ]},
+            "initialValue": {
+                "last": {"$ifNull": ["$last_frame_timestamp", None]},
+                "seconds": 0,
+                "intervals": []
+            },
+            "in": {"$cond": [
+                {"$or": [{"$ne": [{"$type": last}, "date"]}, {"$gt": ["$$this.time", last]}]},
+                apply_tick,
+                "$$value"
+            ]}
+        }
+    }
+    newest_applied = {"$eq": ["$_replay.last", newest_time]}
+
+    return [
+        {"$set": {"_replay": replay}},
+        {"$set": {
+            "engagement_duration_seconds": {"$add": ["$engagement_duration_seconds", "$_replay.seconds"]},
+            "last_frame_timestamp": "$_replay.last",
+            "engagement_bitmap": {"$cond": [
+                {"$gt": [{"$size": "$_replay.intervals"}, 0]},
+                mark_intervals_expr("$_replay.intervals"),
+                "$engagement_bitmap"
+            ]},
+            **{field: {"$cond": [newest_applied, {"$literal": value}, f"${field}"]}
+               for field, value in newest_fields.items()}
+        }},
+        {"$set": {"engagement_percentage": ENGAGEMENT_PERCENTAGE_EXPR}},
+        {"$unset": "_replay"}
+    ]
+
+
+def tick_update_pipeline(
+    current_time: datetime,
+    engaged: bool,
+    max_increment: float,
+    fields: Dict[str, Any]
+) -> List[Dict]:
+    """
+    Build an update pipeline that credits one engagement tick atomically.
+
+    The increment is the time since last_frame_timestamp, capped at
+    max_increment and only credited when engaged. The percentage is
+    recomputed from the new total on the server.
+
+    Args:
+        current_time: Time the tick is accounted at
+        engaged: Whether the student was engaged for this tick
+        max_increment: Maximum seconds credited for one tick
+        fields: Detection fields to store verbatim
+
+    Returns:
+        Update pipeline for update_one/find_one_and_update
+    """
+    return ticks_update_pipeline([(current_time, engaged, max_increment, fields)])
+
+
+def finalize_update_pipeline(ended_at: datetime, threshold: float, present: str, absent: str) -> List[Dict]:
+    """
+    Build an update pipeline that closes attendance records.
+
+    Args:
+        ended_at: End time to store
+        threshold: Minimum engagement_percentage for present
+        present: Status value stored at or above the threshold
+        absent: Status value stored below it
+
+    Returns:
+        Update pipeline for update_many
+    """
+    return [
+        {"$set": {
+            "ended_at": ended_at,
+            "status": {"$cond": [
+                {"$gte": ["$engagement_percentage", threshold]}, present, absent
+            ]}
+        }}
+    ]
+
+
+class SessionState:
+    """Cached attendance record plus the ticks not yet written to MongoDB."""
+
+    __slots__ = ("doc", "ticks", "dirty", "touched")
+
+    def __init__(self, doc: Dict):
+        self.doc = doc
+        self.ticks: List[Tick] = []
+        self.dirty = False
+        self.touched = time.monotonic()  # Last load or tick, for idle eviction
+
+    @property
+    def key(self) -> SessionKey:
+        return self.doc["session_id"], self.doc["student_id"]
+
+
+class SessionStateStore:
+    """
+    Write-behind store of attendance session state keyed by (session_id, student_id).
+
+    Records are loaded from MongoDB on first use and ticks are answered from
+    memory. Dirty records are written back with one bulk_write every
+    flush_interval_seconds; the buffered ticks are replayed on the server
+    (ticks_update_pipeline), so workers holding state for the same session
+    do not overwrite each other. An interval of 0 disables buffering and
+    callers write each tick with tick_update_pipeline instead.
+
+    Each session buffers at most max_buffered_ticks ticks; while MongoDB
+    is unavailable the oldest are dropped (and counted). The first tick
+    kept is still credited at most its own capped increment, so dropping
+    only under-credits the dropped span.
+    """
+
+    def __init__(self, flush_interval_seconds: float, max_buffered_ticks: int):
+        """Initialize an empty store."""
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_buffered_ticks = max_buffered_ticks
+        self._states: Dict[SessionKey, SessionState] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self.dropped_ticks = 0
+        self.flush_errors = 0
+        logger.info(f"✓ Session state store initialized (flush interval={flush_interval_seconds}s)")
+
+    @property
+    def write_through(self) -> bool:
+        """Whether every tick is written to MongoDB immediately."""
+        return self.flush_interval_seconds <= 0
+
+    async def load_many(self, keys: Iterable[SessionKey], db) -> Dict[SessionKey, SessionState]:
+        """
+        Get cached state for the given keys, loading misses with one query.
+
+        Only records still in progress are loaded; finalized sessions do not
+        accept ticks.
+
+        Args:
+            keys: (session_id, student_id) pairs
+            db: Database instance
+
+        Returns:
+            Mapping of key to state for every key with an attendance record in progress
+        """
+        keys = list(dict.fromkeys(keys))
+        missing = [key for key in keys if key not in self._states]
+
+        if missing:
+            cursor = db.attendance.find({
+                "status": IN_PROGRESS,
+                "$or": [{"session_id": session_id, "student_id": student_id}
+                        for session_id, student_id in missing]
+            }, CACHED_PROJECTION)
+            for doc in await cursor.to_list(length=None):
+                state = SessionState(doc)
+                # A concurrent load may have won the race; keep its pending deltas
+                self._states.setdefault(state.key, state)
+
+        return {key: self._states[key] for key in keys if key in self._states}
+
+    async def get(self, session_id: str, student_id: str, db) -> Optional[SessionState]:
+        """Get cached state for one session, loading it on a miss."""
+        states = await self.load_many([(session_id, student_id)], db)
+        return states.get((session_id, student_id))
+
+    def apply(self, state: SessionState, update_data: Dict, tick: Tick):
+        """
+        Apply a tick to cached state and queue it for flushing.
+
+        Args:
+            state: Cached session state
+            update_data: Fields computed for the tick in memory
+            tick: (time, engaged, max_increment, fields) replayed on flush
+        """
+        state.doc.update(update_data)
+        state.ticks.append(tick)
+        state.dirty = True
+        state.touched = time.monotonic()
+        self._trim(state)
+
+    def _trim(self, state: SessionState):
+        """Drop the oldest buffered ticks beyond max_buffered_ticks."""
+        excess = len(state.ticks) - self.max_buffered_ticks
+        if excess > 0:
+            del state.ticks[:excess]
+            self.dropped_ticks += excess
+
+    async def flush(self, db, keys: Optional[Iterable[SessionKey]] = None) -> int:
+        """
+        Write buffered ticks for dirty sessions to MongoDB in one bulk_write.
+
+        Only records still in progress are updated. Flushed records are
+        then re-read in one query so the cache reflects ticks credited by
+        other workers, and records finalized meanwhile are dropped.
+
+        Args:
+            db: Database instance
+            keys: Restrict the flush to these sessions (default: all)
+
+        Returns:
+            Number of attendance records written
+        """
+        if keys is None:
+            candidates = list(self._states.values())
+        else:
+            candidates = [self._states[key] for key in keys if key in self._states]
+
+        dirty = [state for state in candidates if state.dirty and state.ticks]
+        if not dirty:
+            return 0
+
+        # Take the buffered ticks; ticks applied while the write is in flight stay pending
+        snapshot: List[Tuple[SessionState, List[Tick]]] = []
+        operations = []
+        for state in dirty:
+            snapshot.append((state, state.ticks))
+            # Records finalized elsewhere (another worker, the sweeper) are left alone
+            operations.append(UpdateOne(
+                {"_id": state.doc["_id"], "status": IN_PROGRESS},
+                ticks_update_pipeline(state.ticks)
+            ))
+            state.ticks = []
+            state.dirty = False
+
+        try:
+            await db.attendance.bulk_write(operations, ordered=False)
+        except Exception:
+            self.flush_errors += 1
+            for state, ticks in snapshot:
+                state.ticks = ticks + state.ticks
+                state.dirty = True
+                self._trim(state)
+            raise
+
+        await self._refresh([state for state, _ in snapshot], db)
+
+        logger.debug(f"Flushed {len(operations)} attendance session(s)")
+        return len(operations)
+
+    async def _refresh(self, states: List[SessionState], db):
+        """
+        Reload flushed records and drop the ones that are no longer in progress.
+
+        A flush matches nothing for a record that was finalized (or deleted)
+        elsewhere; its cached state and buffered ticks are discarded. Records
+        with ticks applied since the snapshot keep their cached values.
+        """
+        flushed = {state.doc["_id"]: state for state in states}
+        try:
+            cursor = db.attendance.find({"_id": {"$in": list(flushed)}}, CACHED_PROJECTION)
+            docs = {doc["_id"]: doc for doc in await cursor.to_list(length=None)}
+        except Exception as e:
+            logger.warning(f"Could not refresh flushed attendance session state: {e}")
+            return
+
+        for record_id, state in flushed.items():
+            doc = docs.get(record_id)
+            if doc is None or doc.get("status") != IN_PROGRESS:
+                if self._states.get(state.key) is state:
+                    del self._states[state.key]
+            elif not state.ticks:
+                state.doc.update(doc)
+
+    def peek(self, session_id: str, student_id: str) -> Optional[SessionState]:
+        """Get cached state for a session without loading it."""
+        return self._states.get((session_id, student_id))
+
+    def keys_for_class(self, class_id: str) -> List[SessionKey]:
+        """Keys of cached sessions belonging to a class."""
+        return [key for key, state in self._states.items() if state.doc.get("class_id") == class_id]
+
+    def idle_keys(self, idle_seconds: float) -> List[SessionKey]:
+        """Keys of flushed sessions without a tick for idle_seconds."""
+        cutoff = time.monotonic() - idle_seconds
+        return [
+            key for key, state in self._states.items()
+            if state.touched < cutoff and not state.dirty and not state.ticks
+        ]
+
+    def discard(self, session_id: str, student_id: str):
+        """Drop cached state for a session. Callers flush it first if it is dirty."""
+        self._states.pop((session_id, student_id), None)
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Cached sessions, buffered ticks and flush counters, for monitoring."""
+        return {
+            "sessions": len(self._states),
+            "buffered_ticks": sum(len(state.ticks) for state in self._states.values()),
+            "dropped_ticks": self.dropped_ticks,
+            "flush_errors": self.flush_errors
+        }
+
+    async def _flush_loop(self):
+        """Periodically flush dirty sessions until cancelled."""
+        while True:
+            await asyncio.sleep(self.flush_interval_seconds)
+            try:
+                await self.flush(get_database())
+            except Exception as e:
+                logger.error(f"Error flushing attendance session state: {e}")
+
+    def start(self):
+        """Start the background flush task (no-op in write-through mode)."""
+        if self.write_through or self._flush_task is not None:
+            return
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        logger.info("✓ Session state flush task started")
+
+    async def stop(self):
+        """Stop the background flush task and write any remaining deltas."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        try:
+            await self.flush(get_database())
+        except Exception as e:
+            logger.error(f"Error flushing attendance session state on shutdown: {e}")
+
+
+# Global session state store instance
+session_state_store = SessionStateStore(
+    settings.session_flush_interval_seconds,
+    settings.session_max_buffered_ticks
+)
+
+
+def get_session_state_store() -> SessionStateStore:
+    """
+    Get the global session state store instance.
+    Used for dependency injection.
+
+    Returns:
+        SessionStateStore instance
+    """
+    return session_state_store
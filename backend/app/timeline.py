@@ -0,0 +1,267 @@
+"""
+Engagement time series.
+Appends every attendance tick to the attendance_ticks time-series collection
+in background bulk inserts, and downsamples it for timeline charts.
+"""
+
+import asyncio
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+from pymongo.errors import CollectionInvalid, OperationFailure
+from app.config import settings
+from app.database import get_database
+import logging
+
+logger = logging.getLogger(__name__)
+
+TICKS_COLLECTION = "attendance_ticks"
+
+
+async def ensure_ticks_collection(db) -> bool:
+    """
+    Create the attendance_ticks time-series collection if it does not exist.
+
+    Ticks are stored with timeField "timestamp" and metaField "meta"
+    ({session_id, student_id, class_id}), so MongoDB buckets each student's
+    ticks together.
+
+    Args:
+        db: Database instance
+
+    Returns:
+        True if the collection exists, False if it could not be created
+
+    Raises:
+        PyMongoError: If the database cannot be reached
+    """
+    options: Dict[str, Any] = {
+        "timeseries": {"timeField": "timestamp", "metaField": "meta", "granularity": "seconds"}
+    }
+    if settings.timeline_retention_days > 0:
+        options["expireAfterSeconds"] = settings.timeline_retention_days * 86400
+    try:
+        await db.create_collection(TICKS_COLLECTION, **options)
+        logger.info(f"✓ Created time-series collection {TICKS_COLLECTION}")
+    except CollectionInvalid:
+        pass  # Already exists
+    except OperationFailure as e:
+        logger.warning(f"⚠ Could not create time-series collection {TICKS_COLLECTION}: {e}")
+        return False
+    return True
+
+
+def timeline_pipeline(
+    class_id: str,
+    session_id: str,
+    resolution_seconds: int,
+    student_id: Optional[str] = None
+) -> List[Dict]:
+    """
+    Build an aggregation that downsamples ticks into fixed-size buckets per student.
+
+    Args:
+        class_id: Class identifier
+        session_id: Session identifier
+        resolution_seconds: Bucket size in seconds
+        student_id: Restrict to one student (optional)
+
+    Returns:
+        Aggregation pipeline for the attendance_ticks collection
+    """
+    match = {"meta.class_id": class_id, "meta.session_id": session_id}
+    if student_id:
+        match["meta.student_id"] = student_id
+
+    def ratio_of(field: str) -> Dict:
+        return {"$avg": {"$cond": [f"${field}", 1, 0]}}
+
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": {
+                "student_id": "$meta.student_id",
+                "bucket": {"$dateTrunc": {
+                    "date": "$timestamp", "unit": "second", "binSize": resolution_seconds
+                }}
+            },
+            "ticks": {"$sum": 1},
+            "engaged_ratio": ratio_of("engaged"),
+            "face_detected_ratio": ratio_of("is_face_detected"),
+            "looking_ratio": ratio_of("is_looking_at_screen"),
+            "avg_attention_score": {"$avg": "$attention_score"}
+        }},
+        {"$sort": {"_id.bucket": 1}},
+        {"$group": {
+            "_id": "$_id.student_id",
+            "points": {"$push": {
+                "timestamp": "$_id.bucket",
+                "ticks": "$ticks",
+                "engaged_ratio": {"$round": ["$engaged_ratio", 3]},
+                "face_detected_ratio": {"$round": ["$face_detected_ratio", 3]},
+                "looking_ratio": {"$round": ["$looking_ratio", 3]},
+                "avg_attention_score": {"$round": ["$avg_attention_score", 2]}
+            }}
+        }},
+        {"$sort": {"_id": 1}},
+        {"$project": {"_id": 0, "student_id": "$_id", "points": 1}}
+    ]
+
+
+class TickRecorder:
+    """
+    Buffers attendance ticks and writes them with background insert_many calls.
+
+    Recording never touches the database, so it adds no latency to the
+    request path. The buffer holds at most max_buffer ticks; when MongoDB
+    falls behind, the oldest ticks are dropped (and counted). The
+    time-series collection is created before the first insert, so inserts
+    never create a regular collection in its place.
+    """
+
+    def __init__(self, flush_interval_seconds: float, batch_size: int, max_buffer: int):
+        """Initialize an empty recorder (flushing starts with start())."""
+        self.flush_interval_seconds = flush_interval_seconds
+        self.batch_size = batch_size
+        self._buffer: Deque[Dict] = deque(maxlen=max_buffer)
+        self._flush_task: Optional[asyncio.Task] = None
+        self._batch_ready = asyncio.Event()
+        self._collection_ready = False
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed_batches = 0
+        logger.info(f"✓ Tick recorder initialized (flush interval={flush_interval_seconds}s)")
+
+    @property
+    def enabled(self) -> bool:
+        """Whether ticks are being captured."""
+        return self.flush_interval_seconds > 0
+
+    def record(
+        self,
+        session_id: str,
+        student_id: str,
+        class_id: str,
+        timestamp: datetime,
+        engaged: bool,
+        fields: Dict[str, Any]
+    ):
+        """
+        Queue one tick for the time series.
+
+        Args:
+            session_id: Session identifier
+            student_id: Student's user ID
+            class_id: Class identifier
+            timestamp: Time the tick was accounted at
+            engaged: Whether engagement was credited for the tick
+            fields: Detection fields stored with the tick
+        """
+        if not self.enabled:
+            return
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append({
+            "timestamp": timestamp,
+            "meta": {"session_id": session_id, "student_id": student_id, "class_id": class_id},
+            "engaged": engaged,
+            **fields
+        })
+        self.recorded += 1
+        if len(self._buffer) >= self.batch_size:
+            self._batch_ready.set()
+
+    async def flush(self, db) -> int:
+        """
+        Write buffered ticks with insert_many, batch_size at a time.
+
+        Args:
+            db: Database instance
+
+        Returns:
+            Number of ticks written
+        """
+        if self._buffer and not self._collection_ready:
+            # Keep ticks buffered until the time-series collection exists
+            self._collection_ready = await ensure_ticks_collection(db)
+            if not self._collection_ready:
+                return 0
+
+        written = 0
+        while self._buffer:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            try:
+                await db[TICKS_COLLECTION].insert_many(batch, ordered=False)
+            except Exception as e:
+                # Ticks are best-effort history; do not retry into an unbounded backlog
+                self.failed_batches += 1
+                self.dropped += len(batch)
+                logger.error(f"Error writing {len(batch)} attendance tick(s): {e}")
+                break
+            written += len(batch)
+        self.written += written
+        return written
+
+    async def _flush_loop(self):
+        """Flush every interval, or as soon as a full batch is buffered."""
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            try:
+                await self.flush(get_database())
+            except Exception as e:
+                logger.error(f"Error flushing attendance ticks: {e}")
+
+    def start(self):
+        """Start the background flush task (no-op when disabled)."""
+        if not self.enabled or self._flush_task is not None:
+            return
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        logger.info("✓ Tick recorder flush task started")
+
+    async def stop(self):
+        """Stop the background flush task and write remaining ticks."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        try:
+            await self.flush(get_database())
+        except Exception as e:
+            logger.error(f"Error flushing attendance ticks on shutdown: {e}")
+
+    def get_stats(self) -> Dict[str, int]:
+        """Buffer depth and tick counters, for monitoring."""
+        return {
+            "buffered": len(self._buffer),
+            "recorded": self.recorded,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed_batches": self.failed_batches
+        }
+
+
+# Global tick recorder instance
+tick_recorder = TickRecorder(
+    flush_interval_seconds=settings.timeline_flush_interval_seconds,
+    batch_size=settings.timeline_batch_size,
+    max_buffer=settings.timeline_max_buffer
+)
+
+
+def get_tick_recorder() -> TickRecorder:
+    """
+    Get the global tick recorder instance.
+    Used for dependency injection.
+
+    Returns:
+        TickRecorder instance
+    """
+    return tick_recorder
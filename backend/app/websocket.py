@@ -4,14 +4,222 @@ Enables live monitoring of student attendance status for teachers.
 """
 
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import Dict, Set, List
+from typing import Callable, Deque, Dict, Hashable, Set, List, Optional
 from datetime import datetime
-from app.models import EngagementUpdate
+from collections import deque
+from app.broadcast import BroadcastBackend, create_broadcast_backend
+from app.config import settings
+from app.models import EngagementUpdate, UserRole
+import asyncio
+import time
 import json
+import struct
 import logging
 
 logger = logging.getLogger(__name__)
 
+# orjson is optional; broadcasts fall back to the standard library encoder
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Binary student tick frame: seq (uint32), flags (uint8: bit0 face_detected,
+# bit1 multiple_faces), face_count (uint8), attention_score (float32)
+TICK_FRAME = struct.Struct("<IBBf")
+
+# Binary ack frame: seq (uint32), success (uint8), engagement_percentage (float32),
+# next_interval_ms (uint32)
+ACK_FRAME = struct.Struct("<IBfI")
+
+
+def decode_tick_frame(data: bytes) -> Dict:
+    """
+    Decode a binary student tick frame.
+    
+    Args:
+        data: Raw frame bytes
+        
+    Returns:
+        Tick fields as a dictionary
+        
+    Raises:
+        struct.error: If the frame has the wrong size
+    """
+    seq, flags, face_count, attention_score = TICK_FRAME.unpack(data)
+    return {
+        "seq": seq,
+        "face_detected": bool(flags & 0x01),
+        "multiple_faces": bool(flags & 0x02),
+        "face_count": face_count,
+        "attention_score": attention_score
+    }
+
+
+def encode_ack_frame(seq: int, success: bool, engagement_percentage: float, next_interval_ms: int) -> bytes:
+    """Encode a binary ack for a student tick frame."""
+    return ACK_FRAME.pack(seq, 1 if success else 0, engagement_percentage, next_interval_ms)
+
+
+def encode_message(message: Dict) -> str:
+    """
+    Encode a WebSocket message as JSON text once, for sending to many sockets.
+    
+    Produces the same compact output as WebSocket.send_json.
+    
+    Args:
+        message: JSON-serializable message
+        
+    Returns:
+        Encoded JSON text
+    """
+    if orjson is not None:
+        return orjson.dumps(message).decode("utf-8")
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+class _Outbound:
+    """One queued message for a connection."""
+    
+    __slots__ = ("key", "text", "queued_at")
+    
+    def __init__(self, key: Optional[Hashable], text: str):
+        self.key = key
+        self.text = text
+        self.queued_at = time.monotonic()
+
+
+class ConnectionWriter:
+    """
+    Bounded outbound queue of one WebSocket, drained by its own writer task.
+    
+    Enqueuing never waits on the socket. A message with a coalesce key
+    replaces a queued message with the same key (keeping its place in the
+    queue); when the queue is full the oldest message is dropped. If the
+    oldest queued message or a single send is older than max_lag_seconds,
+    the connection is closed and on_lagged is called; if a send fails, the
+    writer stops and on_error is called.
+    """
+    
+    def __init__(
+        self,
+        websocket: WebSocket,
+        max_queue: int,
+        max_lag_seconds: float,
+        on_lagged: Callable[[], None],
+        on_error: Callable[[], None]
+    ):
+        """Initialize the queue and start the writer task."""
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.max_lag_seconds = max_lag_seconds
+        self._on_lagged = on_lagged
+        self._on_error = on_error
+        self._queue: Deque[_Outbound] = deque()
+        self._by_key: Dict[Hashable, _Outbound] = {}
+        self._ready = asyncio.Event()
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.closed = False
+        self._task = asyncio.create_task(self._run())
+    
+    @property
+    def depth(self) -> int:
+        """Messages waiting to be sent."""
+        return len(self._queue)
+    
+    def enqueue(self, text: str, key: Optional[Hashable] = None):
+        """
+        Queue an encoded message without waiting.
+        
+        Args:
+            text: Encoded message
+            key: Coalesce key; a queued message with the same key is replaced
+        """
+        if self.closed:
+            return
+        
+        if key is not None:
+            queued = self._by_key.get(key)
+            if queued is not None:
+                queued.text = text
+                self.coalesced += 1
+                return
+        
+        if len(self._queue) >= self.max_queue:
+            oldest = self._queue.popleft()
+            if oldest.key is not None:
+                self._by_key.pop(oldest.key, None)
+            self.dropped += 1
+        
+        outbound = _Outbound(key, text)
+        self._queue.append(outbound)
+        if key is not None:
+            self._by_key[key] = outbound
+        self._ready.set()
+    
+    async def _run(self):
+        """Send queued messages in order until closed."""
+        try:
+            while True:
+                await self._ready.wait()
+                while self._queue:
+                    outbound = self._queue[0]
+                    if time.monotonic() - outbound.queued_at > self.max_lag_seconds:
+                        await self._close_lagged()
+                        return
+                    # Text being sent is final; later messages with the key queue anew
+                    self._queue.popleft()
+                    if outbound.key is not None and self._by_key.get(outbound.key) is outbound:
+                        del self._by_key[outbound.key]
+                    await asyncio.wait_for(self.websocket.send_text(outbound.text), self.max_lag_seconds)
+                    self.sent += 1
+                self._ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            await self._close_lagged()
+        except Exception as e:
+            logger.error(f"Error sending to websocket: {e}")
+            self._stop()
+            self._on_error()
+    
+    async def _close_lagged(self):
+        """Disconnect a consumer that fell too far behind."""
+        logger.warning(f"Closing lagging websocket ({len(self._queue)} queued message(s))")
+        self._stop()
+        try:
+            await self.websocket.close(code=1013, reason="Too slow")
+        except Exception:
+            pass
+        self._on_lagged()
+    
+    def _stop(self):
+        self.closed = True
+        self._queue.clear()
+        self._by_key.clear()
+    
+    def close(self):
+        """Stop the writer task and discard queued messages."""
+        self._stop()
+        if not self._task.done() and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+
+class _Connection:
+    """A registered WebSocket connection."""
+    
+    __slots__ = ("websocket", "class_id", "user_id", "role", "connected_at", "writer")
+    
+    def __init__(self, websocket: WebSocket, class_id: str, user_id: str, role: str, writer: ConnectionWriter):
+        self.websocket = websocket
+        self.class_id = class_id
+        self.user_id = user_id
+        self.role = role
+        self.connected_at = datetime.utcnow()
+        self.writer = writer
+
 
 class ConnectionManager:
     """
@@ -19,14 +227,41 @@ class ConnectionManager:
     
     Architecture:
     - Teachers connect to monitor their class sessions
-    - Students send engagement updates through REST API
-    - Manager broadcasts updates to all connected teachers for that class
+    - Students send engagement updates through the REST API or as ticks
+      over their own WebSocket connection
+    - Manager broadcasts updates to all connected teachers for that class,
+      one message per tick or as periodic per-class engagement batches
+    
+    Connections are indexed by websocket and by class and role, so
+    connecting, disconnecting and selecting a class's teachers are O(1).
+    
+    Broadcasts are published through a BroadcastBackend, which delivers
+    them to the connection manager of every worker sharing the backend.
     """
     
-    def __init__(self):
-        """Initialize connection manager."""
-        # Store active connections by class_id: {websocket, user_id, role}
-        self.active_connections: Dict[str, List[Dict]] = {}
+    def __init__(
+        self,
+        send_queue_size: int,
+        max_lag_seconds: float,
+        engagement_batch_ms: int = 0,
+        backend: Optional[BroadcastBackend] = None
+    ):
+        """Initialize connection manager (engagement_batch_ms > 0 enables batched engagement updates)."""
+        # Connections by websocket, and by class_id then role
+        self._connections: Dict[WebSocket, _Connection] = {}
+        self._by_class: Dict[str, Dict[str, Set[_Connection]]] = {}
+        self.send_queue_size = send_queue_size
+        self.max_lag_seconds = max_lag_seconds
+        self.engagement_batch_ms = engagement_batch_ms
+        self.backend = backend or BroadcastBackend()
+        # Latest engagement per class and student since the last batch
+        self._pending_engagement: Dict[str, Dict[str, Dict]] = {}
+        self._batch_task: Optional[asyncio.Task] = None
+        self.engagement_batches = 0
+        self.lag_disconnects = 0
+        self.send_errors = 0
+        # Counters of writers already closed
+        self._closed_totals = {"sent": 0, "coalesced": 0, "dropped": 0}
         logger.info("✓ WebSocket connection manager initialized")
     
     async def connect(self, websocket: WebSocket, class_id: str, user_id: str, role: str):
@@ -41,17 +276,17 @@ class ConnectionManager:
         """
         await websocket.accept()
         
-        if class_id not in self.active_connections:
-            self.active_connections[class_id] = []
-        
-        connection_info = {
-            "websocket": websocket,
-            "user_id": user_id,
-            "role": role,
-            "connected_at": datetime.utcnow()
-        }
+        writer = ConnectionWriter(
+            websocket,
+            self.send_queue_size,
+            self.max_lag_seconds,
+            on_lagged=lambda: self._drop_lagged(websocket, class_id, user_id),
+            on_error=lambda: self._drop_failed(websocket, class_id, user_id)
+        )
+        connection = _Connection(websocket, class_id, user_id, role, writer)
         
-        self.active_connections[class_id].append(connection_info)
+        self._connections[websocket] = connection
+        self._by_class.setdefault(class_id, {}).setdefault(role, set()).add(connection)
         
         logger.info(f"✓ WebSocket connected: user={user_id}, role={role}, class={class_id}")
         
@@ -72,60 +307,148 @@ class ConnectionManager:
             class_id: Class identifier
             user_id: User's ID
         """
-        if class_id in self.active_connections:
-            self.active_connections[class_id] = [
-                conn for conn in self.active_connections[class_id]
-                if conn["websocket"] != websocket
-            ]
-            
-            # Clean up empty class connections
-            if not self.active_connections[class_id]:
-                del self.active_connections[class_id]
+        connection = self._connections.pop(websocket, None)
+        if connection is None:
+            return  # Already removed (e.g. dropped for lagging)
+        
+        roles = self._by_class.get(connection.class_id, {})
+        members = roles.get(connection.role)
+        if members is not None:
+            members.discard(connection)
+            # Clean up empty role and class entries
+            if not members:
+                del roles[connection.role]
+            if not roles:
+                self._by_class.pop(connection.class_id, None)
+        
+        writer = connection.writer
+        writer.close()
+        self._closed_totals["sent"] += writer.sent
+        self._closed_totals["coalesced"] += writer.coalesced
+        self._closed_totals["dropped"] += writer.dropped
         
         logger.info(f"✓ WebSocket disconnected: user={user_id}, class={class_id}")
     
+    def _subscribers(self, class_id: str, role: Optional[str] = None) -> List[_Connection]:
+        """Connections of a class, optionally only those with the given role."""
+        roles = self._by_class.get(class_id)
+        if not roles:
+            return []
+        if role is not None:
+            return list(roles.get(role, ()))
+        return [connection for members in roles.values() for connection in members]
+    
+    def _drop_lagged(self, websocket: WebSocket, class_id: str, user_id: str):
+        """Remove a connection whose writer gave up on it for lagging."""
+        self.lag_disconnects += 1
+        self.disconnect(websocket, class_id, user_id)
+    
+    def _drop_failed(self, websocket: WebSocket, class_id: str, user_id: str):
+        """Remove a connection whose writer failed to send."""
+        self.send_errors += 1
+        self.disconnect(websocket, class_id, user_id)
+    
     async def broadcast_engagement_update(
         self,
         class_id: str,
         engagement_update: EngagementUpdate
     ):
         """
-        Broadcast student engagement update to all connected clients for a class.
+        Broadcast student engagement update to the teachers connected to a class.
+        
+        In batching mode the update is held and sent with the class's next
+        engagement_batch message instead.
         
         Args:
             class_id: Class identifier
             engagement_update: Engagement update data
         """
-        if class_id not in self.active_connections:
-            logger.debug(f"No active connections for class {class_id}")
+        if self.backend.local_only and not self._subscribers(class_id, UserRole.TEACHER.value):
+            logger.debug(f"No teachers connected for class {class_id}")
+            return
+        
+        data = {
+            "student_id": engagement_update.student_id,
+            "student_name": engagement_update.student_name,
+            "is_face_detected": engagement_update.is_face_detected,
+            "is_looking_at_screen": engagement_update.is_looking_at_screen,
+            "engagement_percentage": engagement_update.engagement_percentage,
+            "last_update": engagement_update.last_update.isoformat()
+        }
+        
+        if self.batching_engagement:
+            # Sent with the class's next engagement_batch
+            self._pending_engagement.setdefault(class_id, {})[engagement_update.student_id] = data
             return
         
         # Prepare message
         message = {
             "type": "engagement_update",
-            "data": {
-                "student_id": engagement_update.student_id,
-                "student_name": engagement_update.student_name,
-                "is_face_detected": engagement_update.is_face_detected,
-                "is_looking_at_screen": engagement_update.is_looking_at_screen,
-                "engagement_percentage": engagement_update.engagement_percentage,
-                "last_update": engagement_update.last_update.isoformat()
-            },
+            "data": data,
             "timestamp": datetime.utcnow().isoformat()
         }
         
-        # Send to all connected clients
-        disconnected = []
-        for connection in self.active_connections[class_id]:
+        # A newer update for the same student replaces one still queued
+        await self._broadcast(
+            class_id, message,
+            key=("engagement_update", engagement_update.student_id),
+            role=UserRole.TEACHER.value
+        )
+    
+    @property
+    def batching_engagement(self) -> bool:
+        """Whether engagement updates are sent as periodic engagement_batch messages."""
+        return self.engagement_batch_ms > 0
+    
+    async def flush_engagement_batches(self) -> int:
+        """
+        Send one engagement_batch message per class with the students that changed, to its teachers.
+        
+        With a shared backend each worker sends the batch of the ticks it handled.
+        
+        Returns:
+            Number of batches sent
+        """
+        pending, self._pending_engagement = self._pending_engagement, {}
+        sent = 0
+        for class_id, students in pending.items():
+            message = {
+                "type": "engagement_batch",
+                "data": list(students.values()),
+                "timestamp": datetime.utcnow().isoformat()
+            }
+            await self._broadcast(class_id, message, role=UserRole.TEACHER.value)
+            sent += 1
+        self.engagement_batches += sent
+        return sent
+    
+    async def _batch_loop(self):
+        """Flush engagement batches every interval until cancelled."""
+        while True:
+            await asyncio.sleep(self.engagement_batch_ms / 1000)
             try:
-                await connection["websocket"].send_json(message)
+                await self.flush_engagement_batches()
             except Exception as e:
-                logger.error(f"Error sending to websocket: {e}")
-                disconnected.append(connection)
-        
-        # Remove disconnected clients
-        for conn in disconnected:
-            self.disconnect(conn["websocket"], class_id, conn["user_id"])
+                logger.error(f"Error sending engagement batches: {e}")
+    
+    def start(self):
+        """Subscribe to the broadcast backend and start the engagement batch task (if batching)."""
+        self.backend.start(self._deliver)
+        if not self.batching_engagement or self._batch_task is not None:
+            return
+        self._batch_task = asyncio.create_task(self._batch_loop())
+        logger.info(f"✓ Engagement batching started (every {self.engagement_batch_ms}ms)")
+    
+    async def stop(self):
+        """Stop the engagement batch task and unsubscribe from the broadcast backend."""
+        if self._batch_task is not None:
+            self._batch_task.cancel()
+            try:
+                await self._batch_task
+            except asyncio.CancelledError:
+                pass
+            self._batch_task = None
+        await self.backend.stop()
     
     async def broadcast_attendance_status(
         self,
@@ -136,7 +459,7 @@ class ConnectionManager:
         engagement_percentage: float
     ):
         """
-        Broadcast final attendance status when a session ends.
+        Broadcast final attendance status to the teachers of a class when a session ends.
         
         Args:
             class_id: Class identifier
@@ -145,9 +468,6 @@ class ConnectionManager:
             status: Final attendance status (present/absent)
             engagement_percentage: Final engagement percentage
         """
-        if class_id not in self.active_connections:
-            return
-        
         message = {
             "type": "attendance_status",
             "data": {
@@ -159,16 +479,71 @@ class ConnectionManager:
             "timestamp": datetime.utcnow().isoformat()
         }
         
-        disconnected = []
-        for connection in self.active_connections[class_id]:
-            try:
-                await connection["websocket"].send_json(message)
-            except Exception as e:
-                logger.error(f"Error sending attendance status: {e}")
-                disconnected.append(connection)
+        await self._broadcast(class_id, message, role=UserRole.TEACHER.value)
+    
+    async def broadcast_attendance_statuses(self, class_id: str, statuses: List[Dict]):
+        """
+        Broadcast the final statuses of many sessions to the teachers of a class as one message.
         
-        for conn in disconnected:
-            self.disconnect(conn["websocket"], class_id, conn["user_id"])
+        Args:
+            class_id: Class identifier
+            statuses: Dicts with student_id, student_name, status and engagement_percentage
+        """
+        if not statuses:
+            return
+        
+        message = {
+            "type": "attendance_status_batch",
+            "data": statuses,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        
+        await self._broadcast(class_id, message, role=UserRole.TEACHER.value)
+    
+    async def _broadcast(
+        self,
+        class_id: str,
+        message: Dict,
+        key: Optional[Hashable] = None,
+        role: Optional[str] = None
+    ):
+        """
+        Publish a message for the connections of a class on every worker.
+        
+        The message is encoded once; each worker queues the same text on
+        its connections' writers without waiting on any socket.
+        
+        Args:
+            class_id: Class identifier
+            message: JSON-serializable message
+            key: Coalesce key for messages superseded by newer ones
+            role: Only send to connections with this role (default: all)
+        """
+        if self.backend.local_only and not self._subscribers(class_id, role):
+            return
+        
+        await self.backend.publish({
+            "class_id": class_id,
+            "role": role,
+            "key": list(key) if key is not None else None,
+            "text": encode_message(message)
+        })
+    
+    async def _deliver(self, envelope: Dict):
+        """
+        Queue a published message on this worker's matching connections.
+        
+        Args:
+            envelope: Broadcast with class_id, role, key and encoded text
+        """
+        connections = self._subscribers(envelope["class_id"], envelope["role"])
+        if not connections:
+            return
+        
+        # Keys travel as lists; coalescing needs them hashable again
+        key = tuple(envelope["key"]) if envelope["key"] is not None else None
+        for connection in connections:
+            connection.writer.enqueue(envelope["text"], key)
     
     async def send_personal_message(self, message: str, websocket: WebSocket):
         """
@@ -193,21 +568,41 @@ class ConnectionManager:
         Returns:
             List of connected user information
         """
-        if class_id not in self.active_connections:
-            return []
-        
+        connections = sorted(self._subscribers(class_id), key=lambda connection: connection.connected_at)
         return [
             {
-                "user_id": conn["user_id"],
-                "role": conn["role"],
-                "connected_at": conn["connected_at"].isoformat()
+                "user_id": connection.user_id,
+                "role": connection.role,
+                "connected_at": connection.connected_at.isoformat()
             }
-            for conn in self.active_connections[class_id]
+            for connection in connections
         ]
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Connection count, outbound queue depth and send counters, for monitoring."""
+        writers = [connection.writer for connection in self._connections.values()]
+        return {
+            "connections": len(writers),
+            "classes": len(self._by_class),
+            "queued": sum(writer.depth for writer in writers),
+            "max_queue_depth": max((writer.depth for writer in writers), default=0),
+            "sent": self._closed_totals["sent"] + sum(writer.sent for writer in writers),
+            "coalesced": self._closed_totals["coalesced"] + sum(writer.coalesced for writer in writers),
+            "dropped": self._closed_totals["dropped"] + sum(writer.dropped for writer in writers),
+            "lag_disconnects": self.lag_disconnects,
+            "send_errors": self.send_errors,
+            "engagement_batches": self.engagement_batches,
+            "broadcast": self.backend.get_stats()
+        }
 
 
 # Global connection manager instance
-connection_manager = ConnectionManager()
+connection_manager = ConnectionManager(
+    send_queue_size=settings.websocket_send_queue_size,
+    max_lag_seconds=settings.websocket_max_lag_seconds,
+    engagement_batch_ms=settings.websocket_engagement_batch_ms,
+    backend=create_broadcast_backend(settings.websocket_broadcast_backend)
+)
 
 
 def get_connection_manager() -> ConnectionManager:
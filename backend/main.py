@@ -4,10 +4,20 @@ Configures the server, connects to database, and registers all routes.
 """
 
 import os
-from fastapi import FastAPI
+import secrets
+from typing import Optional
+from fastapi import FastAPI, Header, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from app import database
+from app.session_state import get_session_state_store
+from app.face_analysis import get_face_analysis_executor
+from app.frame_queue import get_frame_queue
+from app.attendance import get_attendance_manager
+from app.maintenance import ensure_maintenance_indexes, get_session_sweeper
+from app.pacing import get_tick_pacer
+from app.timeline import get_tick_recorder
+from app.websocket import get_connection_manager
 from app.routes import auth_router, class_router, attendance_router, join_request_router, announcement_router, document_router
 from app.config import settings
 import logging
@@ -34,13 +44,45 @@ async def lifespan(app: FastAPI):
 
     if database.is_connected():
         logger.info("Database connected successfully")
+        await ensure_maintenance_indexes(database.get_database())
     else:
         logger.warning("App started WITHOUT database — DB will reconnect on first request")
 
+    # Write-behind flushing of attendance session state
+    session_state_store = get_session_state_store()
+    session_state_store.start()
+
+    # Background bulk inserts of the engagement time series (the collection
+    # is created before the first insert, even if the DB was down at startup)
+    tick_recorder = get_tick_recorder()
+    tick_recorder.start()
+
+    # Worker processes for server-side face analysis
+    face_analysis_executor = get_face_analysis_executor()
+    face_analysis_executor.start()
+
+    # Event loop lag sampling for adaptive tick intervals
+    tick_pacer = get_tick_pacer()
+    tick_pacer.start()
+
+    # Auto-close of overdue classes and finalization of abandoned sessions
+    session_sweeper = get_session_sweeper()
+    session_sweeper.start()
+
+    # Broadcast subscription and periodic engagement_batch messages to teachers
+    connection_manager = get_connection_manager()
+    connection_manager.start()
+
     yield
 
     # Shutdown
     logger.info("Shutting down Virtual Classroom Backend...")
+    await connection_manager.stop()
+    await session_sweeper.stop()
+    await tick_pacer.stop()
+    face_analysis_executor.shutdown()
+    await session_state_store.stop()
+    await tick_recorder.stop()
     await database.close_db()
     logger.info("Shutdown complete")
 
@@ -101,6 +143,44 @@ async def root():
     }
 
 
+@app.get("/metrics", tags=["Health"])
+async def metrics(authorization: Optional[str] = Header(None)):
+    """
+    Runtime metrics for the attendance pipeline.
+    
+    The metrics expose per-class and per-session internals, so the endpoint
+    is only served when METRICS_TOKEN is set, to callers sending it as
+    "Authorization: Bearer <token>".
+    
+    Returns:
+        Face analysis, frame queue, pacing, timeline, session state, session registry,
+        sweeper and WebSocket counters
+        
+    Raises:
+        HTTPException: 404 if metrics are disabled, 401 if the token is missing or wrong
+    """
+    if not settings.metrics_token:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(token, settings.metrics_token):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid metrics token",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    
+    return {
+        "face_analysis": get_face_analysis_executor().get_stats(),
+        "frame_queue": get_frame_queue().get_stats(),
+        "pacing": get_tick_pacer().get_stats(),
+        "timeline": get_tick_recorder().get_stats(),
+        "session_state": get_session_state_store().get_stats(),
+        "session_registry": get_attendance_manager().active_sessions.get_stats(),
+        "session_sweeper": get_session_sweeper().get_stats(),
+        "websocket": get_connection_manager().get_stats()
+    }
+
+
 @app.get("/health", tags=["Health"])
 async def health_check():
     """
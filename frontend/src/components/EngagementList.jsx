@@ -5,6 +5,7 @@ function EngagementList({ students, onSelectStudent, classId, sessionId }) {
   const getStatusColor = (status) => {
     switch (status) {
       case 'active':
+      case 'present':
         return 'border-green-500 bg-green-900/30'
       case 'distracted':
         return 'border-yellow-500 bg-yellow-900/30'
@@ -5,7 +5,7 @@ import {
   HelpCircle, Users, Monitor, Loader2, Clock,
   Shield, AlertCircle, MonitorUp, Hand, X, UserX, Eye
 } from 'lucide-react'
-import { classAPI, attendanceAPI, createWebSocket, webcamUtils } from '../services/api'
+import { classAPI, attendanceAPI, createWebSocket, createTickSocket, webcamUtils } from '../services/api'
 import { createWebRTCManager } from '../services/webrtc'
 import { createFaceTracker, generateAttendanceMetadata, loadFaceDetectionModels } from '../services/faceDetection'
 import EngagementList from '../components/EngagementList'
@@ -860,6 +860,7 @@ function LiveClassroom({ classData, user, onLeave, initialSettings }) {
   const canvasRef = useRef(null)
   const wsRef = useRef(null)
   const faceTrackerRef = useRef(null) // Face detection tracker
+  const tickSocketRef = useRef(null) // Student engagement ticks over WebSocket
   const webrtcRef = useRef(null)
 
   // ── Initialize media and WebRTC ──
@@ -1027,6 +1028,9 @@ function LiveClassroom({ classData, user, onLeave, initialSettings }) {
             attendanceVideoRef.current.srcObject = localStreamRef.current
             setAttendanceStreamActive(true)
             
+            // Ticks go over one long-lived WebSocket (HTTP fallback)
+            tickSocketRef.current = createTickSocket(classData.class_id, sessionIdToUse)
+            
             // Create face tracker
             const tracker = createFaceTracker(
               attendanceVideoRef.current,
@@ -1042,14 +1046,15 @@ function LiveClassroom({ classData, user, onLeave, initialSettings }) {
                 // Update local state for UI feedback
                 setLastDetection(detection)
                 
-                // Send only metadata to backend
+                // Send only metadata to backend; the ack carries the
+                // server's next_interval_ms, which the tracker follows
                 try {
-                  await attendanceAPI.submitMetadata(metadata)
+                  return await tickSocketRef.current.sendTick(metadata)
                 } catch (err) {
                   console.error('[FaceTracking] Failed to submit metadata:', err)
                 }
               },
-              3000 // Detection interval: every 3 seconds
+              3000 // Initial detection interval; the server adjusts it
             )
             
             faceTrackerRef.current = tracker
@@ -1114,6 +1119,7 @@ function LiveClassroom({ classData, user, onLeave, initialSettings }) {
       if (faceTrackerRef.current) {
         faceTrackerRef.current.stop()
       }
+      if (tickSocketRef.current) tickSocketRef.current.close()
       if (wsRef.current) wsRef.current.close()
       if (webrtcRef.current) webrtcRef.current.leaveRoom()
     }
@@ -1164,12 +1170,12 @@ function LiveClassroom({ classData, user, onLeave, initialSettings }) {
     if (user?.role !== 'teacher' || !classData?.class_id) return
     try {
       const ws = createWebSocket(classData.class_id)
-      ws.onmessage = (event) => {
-        const msg = JSON.parse(event.data)
-        if (msg.type === 'engagement_update' && msg.data) {
-          const d = msg.data
-          setStudents(prev => {
-            const idx = prev.findIndex(s => s.id === d.student_id)
+      // Apply a list of student engagement updates in one state change
+      const applyUpdates = (updates) => {
+        setStudents(prev => {
+          const u = [...prev]
+          for (const d of updates) {
+            const idx = u.findIndex(s => s.id === d.student_id)
             const entry = {
               id: d.student_id,
               name: d.student_name || 'Student',
@@ -1177,13 +1183,31 @@ function LiveClassroom({ classData, user, onLeave, initialSettings }) {
               status: d.is_face_detected ? 'active' : 'inactive',
               lookingAtScreen: d.is_looking_at_screen,
             }
-            if (idx >= 0) {
-              const u = [...prev]
-              u[idx] = { ...u[idx], ...entry }
-              return u
-            }
-            return [...prev, entry]
-          })
+            if (idx >= 0) u[idx] = { ...u[idx], ...entry }
+            else u.push(entry)
+          }
+          return u
+        })
+      }
+      // Show the final present/absent status of sessions that ended
+      const applyStatuses = (statuses) => {
+        setStudents(prev => prev.map(s => {
+          const d = statuses.find(st => st.student_id === s.id)
+          return d
+            ? { ...s, status: d.status, engagement: Math.round(d.engagement_percentage || 0) }
+            : s
+        }))
+      }
+      ws.onmessage = (event) => {
+        const msg = JSON.parse(event.data)
+        if (msg.type === 'engagement_update' && msg.data) {
+          applyUpdates([msg.data])
+        } else if (msg.type === 'engagement_batch' && Array.isArray(msg.data)) {
+          applyUpdates(msg.data)
+        } else if (msg.type === 'attendance_status' && msg.data) {
+          applyStatuses([msg.data])
+        } else if (msg.type === 'attendance_status_batch' && Array.isArray(msg.data)) {
+          applyStatuses(msg.data)
         }
       }
       wsRef.current = ws
@@ -143,6 +143,13 @@ export const attendanceAPI = {
     })
   },
 
+  submitMetadata: async (metadata) => {
+    return apiRequest('/attendance/metadata', {
+      method: 'POST',
+      body: JSON.stringify(metadata),
+    })
+  },
+
   end: async (attendanceId) => {
     return apiRequest('/attendance/end', {
       method: 'POST',
@@ -168,6 +175,72 @@ export const createWebSocket = (classId) => {
   return ws
 }
 
+// Student engagement ticks over the class WebSocket (binary frames).
+// Tick frame (little-endian): seq u32, flags u8 (1 = face, 2 = multiple faces),
+// face_count u8, attention_score f32. Ack frame: seq u32, success u8,
+// engagement_percentage f32, next_interval_ms u32.
+// sendTick falls back to POST /attendance/metadata while the socket is not
+// open or when no ack arrives in time, so callers always get a response.
+export const createTickSocket = (classId, sessionId, { ackTimeoutMs = 5000 } = {}) => {
+  const pending = new Map()
+  let ws = null
+  let seq = 0
+
+  const connect = () => {
+    const token = getAuthToken()
+    const wsBase = API_BASE_URL.replace(/^http/, 'ws')
+    ws = new WebSocket(
+      `${wsBase}/attendance/ws/${classId}?token=${token}&session_id=${encodeURIComponent(sessionId)}`
+    )
+    ws.binaryType = 'arraybuffer'
+    ws.onmessage = (event) => {
+      if (!(event.data instanceof ArrayBuffer) || event.data.byteLength < 13) return
+      const view = new DataView(event.data)
+      const ack = pending.get(view.getUint32(0, true))
+      if (!ack) return
+      ack({
+        success: view.getUint8(4) === 1,
+        engagement_percentage: view.getFloat32(5, true),
+        next_interval_ms: view.getUint32(9, true),
+      })
+    }
+  }
+
+  const sendTick = (metadata) => {
+    if (!ws || ws.readyState === WebSocket.CLOSED || ws.readyState === WebSocket.CLOSING) connect()
+    if (ws.readyState !== WebSocket.OPEN) return attendanceAPI.submitMetadata(metadata)
+
+    seq = (seq + 1) >>> 0
+    const tickSeq = seq
+    const frame = new DataView(new ArrayBuffer(10))
+    frame.setUint32(0, tickSeq, true)
+    frame.setUint8(4, (metadata.face_detected ? 1 : 0) | (metadata.multiple_faces ? 2 : 0))
+    frame.setUint8(5, Math.min(metadata.face_count || 0, 255))
+    frame.setFloat32(6, metadata.attention_score || 0, true)
+
+    return new Promise((resolve, reject) => {
+      const timer = setTimeout(() => {
+        pending.delete(tickSeq)
+        attendanceAPI.submitMetadata(metadata).then(resolve, reject)
+      }, ackTimeoutMs)
+      pending.set(tickSeq, (ack) => {
+        clearTimeout(timer)
+        pending.delete(tickSeq)
+        resolve(ack)
+      })
+      ws.send(frame.buffer)
+    })
+  }
+
+  const close = () => {
+    if (ws) ws.close()
+    ws = null
+  }
+
+  connect()
+  return { sendTick, close }
+}
+
 // Webcam utilities for capturing frames
 export const webcamUtils = {
   captureFrame: (videoElement, canvasElement) => {
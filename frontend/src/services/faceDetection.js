@@ -211,25 +211,49 @@ export async function detectFaces(videoElement) {
 
 /**
  * Create a face detection tracker that runs at intervals
+ * The server may ask for a different interval: if onDetection resolves to a
+ * response with next_interval_ms, the next detection is scheduled after that.
  * @param {HTMLVideoElement} videoElement - Video element to track
- * @param {Function} onDetection - Callback with detection results
- * @param {number} intervalMs - Detection interval in milliseconds (default: 3000)
+ * @param {Function} onDetection - Callback with detection results (may return the server response)
+ * @param {number} intervalMs - Initial detection interval in milliseconds (default: 3000)
  * @returns {Object} Controller object with stop() method
  */
 export function createFaceTracker(videoElement, onDetection, intervalMs = 3000) {
-  let intervalId = null
+  let timeoutId = null
   let isRunning = false
   let isPaused = false
+  let currentIntervalMs = intervalMs
+  
+  const setIntervalMs = (ms) => {
+    if (Number.isFinite(ms) && ms > 0 && ms !== currentIntervalMs) {
+      currentIntervalMs = ms
+      console.log('[FaceTracker] Interval set by server:', ms, 'ms')
+    }
+  }
   
   const runDetection = async () => {
     if (!isRunning || isPaused) return
     
     const result = await detectFaces(videoElement)
     if (onDetection && isRunning) {
-      onDetection(result)
+      const response = await onDetection(result)
+      setIntervalMs(response?.next_interval_ms)
     }
   }
   
+  // Schedule each run after the previous one so interval changes apply immediately
+  const scheduleNext = () => {
+    if (!isRunning) return
+    timeoutId = setTimeout(async () => {
+      try {
+        await runDetection()
+      } catch (err) {
+        console.error('[FaceTracker] Detection failed:', err)
+      }
+      scheduleNext()
+    }, currentIntervalMs)
+  }
+  
   const start = async () => {
     if (isRunning) return
     
@@ -244,19 +268,19 @@ export function createFaceTracker(videoElement, onDetection, intervalMs = 3000)
     isPaused = false
     
     // Run initial detection
-    runDetection()
+    runDetection().catch(err => console.error('[FaceTracker] Detection failed:', err))
     
     // Start interval
-    intervalId = setInterval(runDetection, intervalMs)
-    console.log('[FaceTracker] Started with interval:', intervalMs, 'ms')
+    scheduleNext()
+    console.log('[FaceTracker] Started with interval:', currentIntervalMs, 'ms')
     return true
   }
   
   const stop = () => {
     isRunning = false
-    if (intervalId) {
-      clearInterval(intervalId)
-      intervalId = null
+    if (timeoutId) {
+      clearTimeout(timeoutId)
+      timeoutId = null
     }
     console.log('[FaceTracker] Stopped')
   }
@@ -276,6 +300,8 @@ export function createFaceTracker(videoElement, onDetection, intervalMs = 3000)
     stop,
     pause,
     resume,
+    setIntervalMs,
+    getIntervalMs: () => currentIntervalMs,
     isRunning: () => isRunning,
     isPaused: () => isPaused
   }